@@ -0,0 +1,405 @@
+from __future__ import annotations
+import gzip
+import json
+import os
+import struct
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Codificacion compacta de eventos para historial frio (segmentos sellados)
+# (frio = datos que ya no cambian y casi no se leen; se guardan chicos y se leen por bloques)
+#
+# Archivo .apb (APIM blocks):
+#   b"APB1"
+#   bloque 0, bloque 1, ...      -> cada uno: JSON utf-8 de [formas, filas], opcionalmente con zlib
+#   indice (JSON)                -> por bloque: offset, largo, crc32, n, rango de ts, conteo por tipo;
+#                                   + las tablas de codigos con las que se escribio el archivo
+#   largo del indice (8 bytes) + b"APB1"
+#
+# Dentro de un bloque cada evento es una fila [forma, v1, v2, ...]:
+# - diccionario de llaves: las llaves de cada dict se guardan una vez por bloque ("forma"), junto con
+#   que posiciones van convertidas y como; los dicts anidados (resultado, v3, sample...) tambien son filas
+# - codigos enteros: type y personas (persona, v2_persona, pred_persona) van como indice de su tabla
+# - ts ISO UTC -> microsegundos (int); run_id / session_id uuid -> 32 hex sin guiones
+# Solo se convierte lo que regresa identico; lo demas se guarda tal cual (los floats de JSON en Python
+# regresan exactos).
+#
+# Los bloques son JSON y no marshal/pickle: el historial frio se guarda por años y marshal no promete
+# leerse igual despues de actualizar Python. El parser JSON de la libreria estandar esta en C, asi que
+# leer un bloque sigue siendo rapido.
+#
+# Los lectores leen el indice y abren solo los bloques que se traslapan con el rango de tiempo y
+# traen los tipos pedidos; dentro del bloque solo se arman los eventos de esos tipos.
+
+MAGIC = b"APB1"
+FORMAT_VERSION = 2
+
+# Eventos por bloque: bloques chicos = lecturas por rango mas finas; grandes = comprime mejor
+BLOCK_SIZE = 4096
+
+# Tablas de codigos; solo se agregan valores al final (cada archivo guarda las suyas en el indice).
+# Personas en el mismo orden que dojo.PROFILE_TO_ID.
+CODE_TABLES = {
+    "type": ["run", "feedback", "shadow", "trace"],
+    "persona": ["Comprador impulsivo", "Ahorrador disciplinado", "Genio financiero", "Jefe de jefes"],
+}
+# Llave del evento -> tabla
+CODE_KEYS = {"type": "type", "persona": "persona", "v2_persona": "persona", "pred_persona": "persona"}
+TS_KEYS = ("ts",)
+UUID_KEYS = ("run_id", "session_id")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_US = timedelta(microseconds=1)
+_TRAILER = struct.Struct("<Q4s")
+
+
+# ===== Bloques =====
+
+# Como se convirtio una posicion de la forma
+_CODE, _TS, _UUID, _ROW = 0, 1, 2, 3
+
+# Codifica un bloque de eventos: regresa el payload (JSON utf-8) listo para comprimir
+def encode_block(events: List[Dict[str, Any]]) -> bytes:
+    shapes: Dict[Tuple[Tuple[str, ...], Tuple[Tuple[int, int], ...]], int] = {}
+    index = {key: {v: i for i, v in enumerate(CODE_TABLES[table])} for key, table in CODE_KEYS.items()}
+
+    def row(d: Dict[str, Any]) -> list:
+        values = []
+        special = []
+        for i, (k, v) in enumerate(d.items()):
+            tv = type(v)
+            if tv is dict:
+                v = row(v)
+                special.append((i, _ROW))
+            elif tv is str:
+                codes = index.get(k)
+                if codes is not None:
+                    if v in codes:
+                        v = codes[v]
+                        special.append((i, _CODE))
+                elif k in TS_KEYS:
+                    us = _ts_to_us(v)
+                    if us is not None:
+                        v = us
+                        special.append((i, _TS))
+                elif k in UUID_KEYS and len(v) == 36:
+                    if _uuid_is_canonical(v):
+                        v = v.replace("-", "")
+                        special.append((i, _UUID))
+            values.append(v)
+        shape = shapes.setdefault((tuple(d), tuple(special)), len(shapes))
+        return [shape, *values]
+
+    rows = [row(e) for e in events]
+    forms = [[list(keys), [list(s) for s in special]] for keys, special in shapes]
+    return json.dumps([forms, rows], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# Decodifica un bloque; con `types` solo arma los eventos de esos tipos
+def decode_block(
+    payload: bytes,
+    code_tables: Optional[Dict[str, List[str]]] = None,
+    types: Optional[set] = None,
+) -> List[Dict[str, Any]]:
+    tables = code_tables or CODE_TABLES
+    shapes, rows = json.loads(payload)
+
+    # Por forma: llaves + que hacer con cada posicion convertida
+    plans = []
+    type_pos = []
+    for keys, special in shapes:
+        plan = [(i + 1, keys[i], kind, tables[CODE_KEYS[keys[i]]] if kind == _CODE else None) for i, kind in special]
+        plans.append((keys, plan))
+        # Donde esta el type de la forma (y si va como codigo), para filtrar sin armar el evento
+        if "type" in keys:
+            i = keys.index("type")
+            type_pos.append((i + 1, any(j == i for j, _ in special)))
+        else:
+            type_pos.append(None)
+
+    def build(r: list) -> Dict[str, Any]:
+        keys, plan = plans[r[0]]
+        d = dict(zip(keys, r[1:]))
+        for pos, k, kind, table in plan:
+            v = r[pos]
+            if kind == _ROW:
+                d[k] = build(v)
+            elif kind == _CODE:
+                d[k] = table[v]
+            elif kind == _TS:
+                d[k] = (_EPOCH + v * _US).isoformat()
+            else:
+                d[k] = f"{v[:8]}-{v[8:12]}-{v[12:16]}-{v[16:20]}-{v[20:]}"
+        return d
+
+    if types is None:
+        return [build(r) for r in rows]
+
+    type_table = tables["type"]
+    out = []
+    for r in rows:
+        tp = type_pos[r[0]]
+        if tp is None:
+            continue
+        pos, coded = tp
+        t = type_table[r[pos]] if coded else r[pos]
+        if t in types:
+            out.append(build(r))
+    return out
+
+def _ts_to_us(ts: str) -> Optional[int]:
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        return None
+    if dt.tzinfo is not timezone.utc or dt.isoformat() != ts:
+        return None
+    return (dt - _EPOCH) // _US
+
+# Solo uuid en forma canonica (minusculas con guiones): asi regresa identico al quitar y poner los guiones
+def _uuid_is_canonical(value: str) -> bool:
+    try:
+        return str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+# ===== Archivos =====
+
+# Resumen de un bloque para el indice (rango de ts y conteo por tipo, para saltarlo al leer)
+def _block_stats(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts: Dict[str, int] = {}
+    start_ts = end_ts = None
+    for e in events:
+        t = e.get("type", "")
+        counts[t] = counts.get(t, 0) + 1
+        ts = e.get("ts")
+        if ts:
+            start_ts = ts if start_ts is None or ts < start_ts else start_ts
+            end_ts = ts if end_ts is None or ts > end_ts else end_ts
+    return {"n": len(events), "start_ts": start_ts, "end_ts": end_ts, "counts": counts}
+
+# Escribe eventos como .apb (temporal + os.replace). compress=True comprime cada bloque con zlib.
+# Regresa el indice.
+def write_file(
+    path: Path,
+    events: Iterable[Dict[str, Any]],
+    compress: bool = True,
+    block_size: int = BLOCK_SIZE,
+) -> Dict[str, Any]:
+    path = Path(path)
+    index: Dict[str, Any] = {
+        "version": FORMAT_VERSION,
+        "compression": "zlib" if compress else "none",
+        "codes": CODE_TABLES,
+        "blocks": [],
+    }
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("wb") as f:
+        f.write(MAGIC)
+
+        def flush(block: List[Dict[str, Any]]) -> None:
+            payload = encode_block(block)
+            if compress:
+                payload = zlib.compress(payload, 6)
+            stats = _block_stats(block)
+            stats.update(offset=f.tell(), length=len(payload), crc32=zlib.crc32(payload))
+            f.write(payload)
+            index["blocks"].append(stats)
+
+        block: List[Dict[str, Any]] = []
+        for e in events:
+            block.append(e)
+            if len(block) >= block_size:
+                flush(block)
+                block = []
+        if block:
+            flush(block)
+
+        index["n"] = sum(b["n"] for b in index["blocks"])
+        raw = json.dumps(index, ensure_ascii=False).encode("utf-8")
+        f.write(raw)
+        f.write(_TRAILER.pack(len(raw), MAGIC))
+    os.replace(tmp, path)
+    return index
+
+# Indice de un archivo .apb (se lee del final, sin tocar los bloques)
+def read_index(path: Path) -> Dict[str, Any]:
+    with Path(path).open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < len(MAGIC) + _TRAILER.size:
+            raise ValueError(f"archivo .apb incompleto: {path}")
+        f.seek(size - _TRAILER.size)
+        length, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f"no es un archivo .apb: {path}")
+        f.seek(size - _TRAILER.size - length)
+        index = json.loads(f.read(length))
+    if index.get("version") != FORMAT_VERSION:
+        raise ValueError(f"version .apb no soportada ({index.get('version')}): {path}")
+    return index
+
+# Recorre los eventos de un .apb abriendo solo los bloques que pueden traer algo del rango/tipos pedidos
+# (start_s / end_s: ts ISO UTC como texto, igual que en storage)
+def iter_file(
+    path: Path,
+    start_s: Optional[str] = None,
+    end_s: Optional[str] = None,
+    types: Optional[set] = None,
+) -> Iterator[Dict[str, Any]]:
+    index = read_index(path)
+    compressed = index.get("compression") == "zlib"
+    tables = index.get("codes", CODE_TABLES)
+    with Path(path).open("rb") as f:
+        for block in index["blocks"]:
+            if end_s is not None and block["start_ts"] is not None and block["start_ts"] > end_s:
+                continue
+            if start_s is not None and block["end_ts"] is not None and block["end_ts"] < start_s:
+                continue
+            if types is not None and not types.intersection(block["counts"]):
+                continue
+            f.seek(block["offset"])
+            payload = f.read(block["length"])
+            if zlib.crc32(payload) != block["crc32"]:
+                raise ValueError(f"bloque corrupto en {path} (offset {block['offset']})")
+            if compressed:
+                payload = zlib.decompress(payload)
+            yield from decode_block(payload, tables, types)
+
+
+# ===== Benchmark =====
+
+# Eventos sinteticos parecidos a los del historial (run, shadow, trace, feedback)
+def _synthetic_events(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    import random
+
+    rng = random.Random(seed)
+    personas = CODE_TABLES["persona"]
+    t0 = datetime(2026, 9, 1, tzinfo=timezone.utc)
+    events = []
+    for i in range(n):
+        ts = (t0 + timedelta(seconds=i * 7.3)).isoformat()
+        run_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        session_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        kind = i % 4
+        if kind == 0:
+            e = {
+                "type": "run",
+                "run_id": run_id,
+                "respuestas": {
+                    "ahorro_mensual_pct": rng.randint(0, 50),
+                    "compras_impulsivas_sem": rng.randint(0, 10),
+                    "registra_gastos": rng.random() < 0.5,
+                    "fondo_emergencia_meses": rng.randint(0, 12),
+                },
+                "resultado": {"persona": rng.choice(personas), "score": rng.randint(0, 100), "resumen": "Buen habito de ahorro."},
+            }
+        elif kind == 1:
+            p = [rng.random() for _ in personas]
+            s = sum(p)
+            p = [x / s for x in p]
+            e = {
+                "type": "shadow",
+                "run_id": run_id,
+                "v3": {"ok": True, "pred_persona": rng.choice(personas), "confidence": max(p), "probs": p, "model_version": "a1b2c3d4e5f6"},
+                "v2_persona": rng.choice(personas),
+                "sample": {"rate": 1.0, "weight": 1.0, "reason": "rate"},
+            }
+        elif kind == 2:
+            e = {
+                "type": "trace",
+                "run_id": run_id,
+                "total_ms": rng.random() * 50,
+                "spans": [["clasificar", 0.0, rng.random()], ["predict_v3", 1.2, rng.random() * 10]],
+            }
+        else:
+            e = {"type": "feedback", "run_id": run_id, "rating": rng.randint(1, 5), "comentario": ""}
+        e["session_id"] = session_id
+        e["ts"] = ts
+        events.append(e)
+    return events
+
+# Tamaño y throughput de lectura/escritura: formato anterior (json con indent=2), JSON Lines
+# (segmentos abiertos), .jsonl.gz (sellados de hoy) y .apb con y sin zlib
+def _bench(n: int, folder: Path) -> None:
+    events = _synthetic_events(n)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    def write_pretty(p: Path) -> None:
+        p.write_text(json.dumps(events, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def read_pretty(p: Path) -> list:
+        return json.loads(p.read_text(encoding="utf-8"))
+
+    def write_jsonl(p: Path) -> None:
+        with p.open("w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events))
+
+    def read_jsonl(p: Path) -> list:
+        with p.open("r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def write_gz(p: Path) -> None:
+        with gzip.open(p, "wt", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events))
+
+    def read_gz(p: Path) -> list:
+        with gzip.open(p, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    formats = [
+        ("json indent=2 (anterior)", "bench.json", write_pretty, read_pretty),
+        ("jsonl (abierto)", "bench.jsonl", write_jsonl, read_jsonl),
+        ("jsonl.gz (sellado)", "bench.jsonl.gz", write_gz, read_gz),
+        ("apb sin compresion", "bench-raw.apb", lambda p: write_file(p, events, compress=False), lambda p: list(iter_file(p))),
+        ("apb + zlib por bloque", "bench.apb", lambda p: write_file(p, events), lambda p: list(iter_file(p))),
+    ]
+
+    print(f"bench: {n:,} eventos sinteticos")
+    print(f"{'formato':<26} {'MB':>8} {'escritura ev/s':>15} {'lectura ev/s':>14}")
+    for label, name, write, read in formats:
+        p = folder / name
+        t0 = time.perf_counter()
+        write(p)
+        tw = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        out = read(p)
+        tr = time.perf_counter() - t0
+        assert out == events, label
+        print(f"{label:<26} {p.stat().st_size / 1e6:>8.2f} {n / tw:>15,.0f} {n / tr:>14,.0f}")
+
+    # Lecturas parciales: solo un tipo, y un rango de tiempo de ~1 bloque
+    p = folder / "bench.apb"
+    t0 = time.perf_counter()
+    shadows = sum(1 for _ in iter_file(p, types={"shadow"}))
+    tt = time.perf_counter() - t0
+    mid = events[n // 2]["ts"]
+    end = events[min(n - 1, n // 2 + BLOCK_SIZE // 2)]["ts"]
+    t0 = time.perf_counter()
+    in_range = sum(1 for _ in iter_file(p, start_s=mid, end_s=end))
+    tg = time.perf_counter() - t0
+    print(f"apb solo shadow: {shadows:,} eventos en {tt * 1000:.0f} ms | rango {mid[:19]}..{end[:19]}: {in_range:,} en {tg * 1000:.0f} ms")
+
+    for p in folder.glob("bench*"):
+        p.unlink()
+
+
+# Punto de entrada: python -m apim.codec [--bench N] [--dir CARPETA]
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Codificacion compacta del historial frio (.apb)")
+    parser.add_argument("--bench", type=int, default=100000, help="eventos sinteticos para medir")
+    parser.add_argument("--dir", default=None, help="carpeta para los archivos de prueba (default: temporal)")
+    args = parser.parse_args()
+
+    if args.dir:
+        _bench(args.bench, Path(args.dir))
+    else:
+        with tempfile.TemporaryDirectory() as d:
+            _bench(args.bench, Path(d))
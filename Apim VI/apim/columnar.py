@@ -0,0 +1,280 @@
+from __future__ import annotations
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from apim import features, sharding, storage
+from apim.features import PROFILE_TO_ID
+
+# Export columnar del historial
+# (columnar = un arreglo NumPy por campo en lugar de una lista de dicts; se analiza con operaciones vectorizadas)
+#
+# Data/columnar/
+#   state.json                 -> marca de agua: hasta que linea/byte de cada segmento ya se exporto
+#                                 (+ generacion del sharding: si el historial se rebalancea, se reexporta todo)
+#   run/part-000001.npz        -> un "part" por cada sync (o .parquet si pyarrow esta instalado)
+#   shadow/part-000001.npz
+#   feedback/part-000001.npz
+#
+# Cada sync solo lee lo que crecio desde la ultima vez y agrega un part nuevo.
+# sync y load_columns van con un lock de archivo (Data/columnar/sync.lock, entre procesos: la app al
+# arrancar, metrics_offline, el sweep): dos sync a la vez duplicarian parts o perderian la marca de agua.
+
+COLUMNAR_DIR = storage.DATA_DIR / "columnar"
+STATE_NAME = "state.json"
+LOCK_NAME = "sync.lock"
+
+KINDS = ("run", "shadow", "feedback")
+
+# run_id es un uuid4 de 36 caracteres
+RUN_ID_DTYPE = "S36"
+
+# Persona desconocida o vacia
+UNKNOWN_ID = -1
+
+# Valor para columnas que no existian cuando se escribio un part viejo
+# (weight: shadows anteriores al muestreo valen 1)
+COLUMN_DEFAULTS = {"weight": 1.0}
+
+# pyarrow es opcional: si esta, los parts se guardan como Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def _state_path() -> Path:
+    return COLUMNAR_DIR / STATE_NAME
+
+
+def _empty_state(generation: str) -> Dict[str, Any]:
+    return {"version": 1, "generation": generation, "offsets": {}, "parts": {k: 0 for k in KINDS}}
+
+
+# Estado del export; si el historial se rebalanceo (otra generacion) los parts viejos ya no sirven
+def _load_state() -> Dict[str, Any]:
+    generation = sharding.load_map(storage.HISTORY_DIR)["generation"]
+    try:
+        state = json.loads(_state_path().read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty_state(generation)
+
+    if state.get("generation", "0") != generation:
+        for kind in KINDS:
+            for part in (COLUMNAR_DIR / kind).glob("part-*"):
+                part.unlink()
+        return _empty_state(generation)
+    return state
+
+
+def _save_state(state: Dict[str, Any]) -> None:
+    COLUMNAR_DIR.mkdir(parents=True, exist_ok=True)
+    path = _state_path()
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# ts ISO -> microsegundos desde epoch (int64); 0 si no hay ts valido
+def _ts_us(ts: Optional[str]) -> int:
+    if not ts:
+        return 0
+    try:
+        return int(datetime.fromisoformat(ts).timestamp() * 1_000_000)
+    except ValueError:
+        return 0
+
+
+def _persona_id(persona: Optional[str]) -> int:
+    return PROFILE_TO_ID.get(persona or "", UNKNOWN_ID)
+
+
+def _num(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# ===== Eventos -> columnas =====
+
+def _run_columns(events: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    res = [e.get("resultado", {}) for e in events]
+    # Respuestas validadas y limitadas con el codificador de features (sin escalar)
+    resp = features.raw_columns(e.get("respuestas", {}) for e in events)
+    return {
+        "run_id": np.array([e.get("run_id", "") for e in events], dtype=RUN_ID_DTYPE),
+        "ts": np.array([_ts_us(e.get("ts")) for e in events], dtype=np.int64),
+        "ahorro_mensual_pct": resp["ahorro_mensual_pct"].astype(np.float32),
+        "compras_impulsivas_sem": resp["compras_impulsivas_sem"].astype(np.float32),
+        "registra_gastos": resp["registra_gastos"],
+        "fondo_emergencia_meses": resp["fondo_emergencia_meses"].astype(np.float32),
+        "v2_id": np.array([_persona_id(r.get("persona")) for r in res], dtype=np.int8),
+        "score": np.array([int(r.get("score") or 0) for r in res], dtype=np.int16),
+    }
+
+
+def _shadow_columns(events: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    v3 = [e.get("v3", {}) or {} for e in events]
+    probs = np.zeros((len(events), len(PROFILE_TO_ID)), dtype=np.float32)
+    for i, p in enumerate(v3):
+        row = p.get("probs") or []
+        if len(row) == probs.shape[1]:
+            probs[i] = row
+    cols = {
+        "run_id": np.array([e.get("run_id", "") for e in events], dtype=RUN_ID_DTYPE),
+        "ts": np.array([_ts_us(e.get("ts")) for e in events], dtype=np.int64),
+        "ok": np.array([p.get("ok") is True for p in v3], dtype=bool),
+        "v2_id": np.array([_persona_id(e.get("v2_persona")) for e in events], dtype=np.int8),
+        "v3_id": np.array([_persona_id(p.get("pred_persona")) for p in v3], dtype=np.int8),
+        "confidence": np.array([_num(p.get("confidence", 0.0)) for p in v3], dtype=np.float32),
+        # Peso del muestreo shadow (1/rate); 1 si no hubo muestreo
+        "weight": np.array([_num((e.get("sample") or {}).get("weight", 1.0)) for e in events], dtype=np.float32),
+    }
+    for j in range(probs.shape[1]):
+        cols[f"p{j}"] = probs[:, j]
+    return cols
+
+
+def _feedback_columns(events: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    return {
+        "run_id": np.array([e.get("run_id", "") for e in events], dtype=RUN_ID_DTYPE),
+        "ts": np.array([_ts_us(e.get("ts")) for e in events], dtype=np.int64),
+        "rating": np.array([int(e.get("rating", 0)) for e in events], dtype=np.int8),
+    }
+
+
+_BUILDERS = {"run": _run_columns, "shadow": _shadow_columns, "feedback": _feedback_columns}
+
+
+# ===== Parts =====
+
+def _write_part(kind: str, index: int, cols: Dict[str, np.ndarray]) -> Path:
+    folder = COLUMNAR_DIR / kind
+    folder.mkdir(parents=True, exist_ok=True)
+
+    if pa is not None:
+        path = folder / f"part-{index:06d}.parquet"
+        table = pa.table({
+            k: pa.array(v.tolist(), pa.binary(36)) if v.dtype.kind == "S" else pa.array(v)
+            for k, v in cols.items()
+        })
+        tmp = path.with_name(f".{path.name}.tmp")
+        pq.write_table(table, tmp)
+    else:
+        path = folder / f"part-{index:06d}.npz"
+        tmp = path.with_name(f".{path.name}.tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, **cols)
+
+    os.replace(tmp, path)
+    return path
+
+
+def _read_part(path: Path) -> Dict[str, np.ndarray]:
+    if path.suffix == ".npz":
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+
+    table = pq.read_table(path)
+    out = {}
+    for name in table.column_names:
+        col = table.column(name)
+        if pa.types.is_fixed_size_binary(col.type) or pa.types.is_binary(col.type):
+            out[name] = np.array(col.to_pylist(), dtype=RUN_ID_DTYPE)
+        else:
+            out[name] = col.to_numpy()
+    return out
+
+
+def _lock():
+    return storage.file_lock(COLUMNAR_DIR / LOCK_NAME)
+
+
+# Trae lo nuevo del historial y lo agrega como parts. Regresa cuantos eventos se exportaron por tipo.
+def sync() -> Dict[str, int]:
+    with _lock():
+        return _sync()
+
+
+# Marca de agua, parts y state.json (llamar con _lock tomado)
+def _sync() -> Dict[str, int]:
+    state = _load_state()
+    offsets = state.setdefault("offsets", {})
+    parts = state.setdefault("parts", {k: 0 for k in KINDS})
+
+    new_events: Dict[str, List[Dict[str, Any]]] = {k: [] for k in KINDS}
+
+    for seg in storage.list_segments():
+        # La llave no cambia si el segmento luego se compacta (.jsonl -> .jsonl.gz / .jsonl.apb)
+        key = seg["name"].removesuffix(".gz").removesuffix(".apb")
+        if seg.get("shard"):
+            key = f"{seg['shard']}/{key}"
+        mark = offsets.get(key, {"lines": 0, "bytes": 0, "done": False})
+        if mark.get("done"):
+            continue
+
+        events, lines, byte_offset = storage.read_segment_tail(seg, mark["lines"], mark["bytes"])
+        for e in events:
+            kind = e.get("type")
+            if kind in new_events:
+                new_events[kind].append(e)
+
+        # Un segmento sellado que ya se leyo completo no se vuelve a abrir
+        offsets[key] = {"lines": lines, "bytes": byte_offset, "done": bool(seg.get("sealed"))}
+
+    exported = {}
+    for kind, events in new_events.items():
+        exported[kind] = len(events)
+        if not events:
+            continue
+        parts[kind] = parts.get(kind, 0) + 1
+        _write_part(kind, parts[kind], _BUILDERS[kind](events))
+
+    # La marca se mueve solo despues de escribir los parts
+    _save_state(state)
+    return exported
+
+
+# Todas las columnas de un tipo (concatena los parts). Con refresh=True hace sync antes.
+def load_columns(kind: str, refresh: bool = False) -> Dict[str, np.ndarray]:
+    if kind not in KINDS:
+        raise ValueError(f"tipo desconocido: {kind}")
+
+    # Con el lock: un sync de otro proceso no borra ni agrega parts a media lectura
+    with _lock():
+        if refresh:
+            _sync()
+        folder = COLUMNAR_DIR / kind
+        paths = sorted(list(folder.glob("part-*.npz")) + list(folder.glob("part-*.parquet")))
+        chunks = [_read_part(p) for p in paths]
+    empty = _BUILDERS[kind]([])
+    if not chunks:
+        return empty
+
+    out = {}
+    for k, template in empty.items():
+        pieces = []
+        for c in chunks:
+            if k in c:
+                pieces.append(c[k])
+            else:
+                n = len(next(iter(c.values())))
+                pieces.append(np.full(n, COLUMN_DEFAULTS.get(k, 0), dtype=template.dtype))
+        out[k] = np.concatenate(pieces)
+    return out
+
+
+# Punto de entrada: python -m apim.columnar [sync]
+if __name__ == "__main__":
+    exported = sync()
+    fmt = "parquet" if pa is not None else "npz"
+    print(f"Export columnar ({fmt}) en {COLUMNAR_DIR}")
+    for kind in KINDS:
+        print(f"- {kind}: +{exported.get(kind, 0)}")
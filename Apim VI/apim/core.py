@@ -2,6 +2,8 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Dict, Any, List
 
+from apim.metrics import timed
+
 # Estructura final que usa la app (Streamlit)
 @dataclass
 class Result:
@@ -10,6 +12,7 @@ class Result:
     resumen: str
 
 # 1) Clasificador Principal (V1)
+@timed("clasificar")
 def clasificar(respuestas: Dict[str, Any]) -> Result:
     score = 0
  # Extraemos valores 
@@ -84,6 +87,7 @@ def detectar_debilidades(respuestas: Dict[str, Any]) -> List[str]:
     return debilidades
 
 # 3) Recomendaciones (V2)
+@timed("recomendaciones")
 def recomendaciones(persona: str, respuestas: Dict[str, Any]) -> Dict[str, Any]:
     """
     V2 recomendaciones basadas en tus notas de educacion financiera:
@@ -1,7 +1,12 @@
 # V2
 from __future__ import annotations
+from functools import lru_cache
+
 import numpy as np
 
+from apim import features
+from apim.metrics import timed
+
 
 class DenseLayer:
     """
@@ -15,6 +20,14 @@ class DenseLayer:
         # Sesgos: el “empujoncito” que permite activar neuronas aunque la señal sea baja
         self.biases = np.zeros((1, n_neurons), dtype=float)
 
+    # Capa con pesos ya entrenados (ej. exportados desde PyTorch), sin inicializacion aleatoria
+    @classmethod
+    def from_weights(cls, weights: np.ndarray, biases: np.ndarray) -> "DenseLayer":
+        layer = cls.__new__(cls)
+        layer.weights = np.asarray(weights)
+        layer.biases = np.asarray(biases).reshape(1, -1)
+        return layer
+
     def forward(self, inputs: np.ndarray) -> np.ndarray:
         return inputs @ self.weights + self.biases
 
@@ -28,6 +41,16 @@ class ReLU:
         return np.maximum(0, inputs)
 
 
+class Softmax:
+    """
+    Softmax: convierte la salida en probabilidades (cada fila suma 1).
+    Restamos el maximo por fila para que exp() no se desborde.
+    """
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        e = np.exp(inputs - np.max(inputs, axis=1, keepdims=True))
+        return e / np.sum(e, axis=1, keepdims=True)
+
+
 # Semilla fija para que la demo sea estable
 _rng = np.random.default_rng(7)
 
@@ -36,38 +59,115 @@ _relu1 = ReLU()
 _dense2 = DenseLayer(n_inputs=6, n_neurons=3, rng=_rng)
 
 
-def _vectorizar_respuestas(respuestas: dict) -> np.ndarray:
-    """
-    Convertimos respuestas a números 0 y 1 para que sea “estable” segun orden: [ahorro, impulsivas, registra, fondo]
-    """
-    ahorro = float(respuestas.get("ahorro_mensual_pct", 0)) / 50.0
-    impulsivas = float(respuestas.get("compras_impulsivas_sem", 0)) / 14.0
-    registra = 1.0 if respuestas.get("registra_gastos", False) else 0.0
-    fondo = float(respuestas.get("fondo_emergencia_meses", 0)) / 12.0
+# Objetivo demo para explicar el concepto de mejora
+DEMO_TARGET = np.array([[0.6, 0.3, 0.7]], dtype=float)
+
 
-    return np.array([[ahorro, impulsivas, registra, fondo]], dtype=float)
+# Dense -> ReLU -> Dense sobre una matriz (N, 4); regresa salidas (N, 3) y medidor (MSE) por renglon
+def _demo_forward(x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    out = _dense2.forward(_relu1.forward(_dense1.forward(x)))
+    return out, np.mean((out - DEMO_TARGET) ** 2, axis=1)
 
 
+@timed("demo_forward_pass")
 def demo_forward_pass(respuestas: dict) -> tuple[list, float]:
 
 # salida: 3 numeritos la “huella” que produce la red con tus respuestas
     """
     - medidor: un numero que te dice qué tan cerca estuvo de un objetivo de demo
     """
-    x = _vectorizar_respuestas(respuestas)
+    # Respuestas a numeros ~0..1 (apim.features) en orden: [ahorro, impulsivas, registra, fondo]
+    x = features.encode_one(respuestas)[None, :]
 
     # Forward pass: Dense -> ReLU -> Dense
-    z1 = _dense1.forward(x)
-    a1 = _relu1.forward(z1)
-    out = _dense2.forward(a1) 
+    # Medidor de cercania, entre mas pequeño, mas cerca.
+    out, medidor = _demo_forward(x)
 
-    # Objetivo demo para explicar el concepto de mejora
-    objetivo_demo = np.array([[0.6, 0.3, 0.7]], dtype=float)
+    return out.tolist(), float(medidor[0])
 
-    # Medidor de cercania, entre mas pequeño, mas cerca.
-    medidor = float(np.mean((out - objetivo_demo) ** 2))
 
-    return out.tolist(), medidor
+# ===== BARRIDO DEL DEMO (GRID) =====
+# (grid = todas las combinaciones de dos sliders, con las otras dos respuestas fijas)
+# Se arma la matriz completa de entradas y pasa por la red en un solo forward (una cadena de matmuls),
+# en vez de un forward por punto. Los pesos del demo son fijos (semilla), asi que el resultado solo
+# depende de la especificacion del grid y se guarda en cache.
+
+# Valores por default de cada slider del formulario (minimo, maximo); se recorre de 1 en 1
+DEMO_GRID_RANGES = {
+    "ahorro_mensual_pct": (0, 50),
+    "compras_impulsivas_sem": (0, 50),
+    "registra_gastos": (0, 1),
+    "fondo_emergencia_meses": (0, 12),
+}
+
+DEMO_GRID_CACHE_MAX = 64
+
+
+def _grid_values(key: str, values) -> tuple:
+    if key not in features.FEATURE_KEYS:
+        raise ValueError(f"respuesta desconocida para el grid: {key}")
+    if values is None:
+        lo, hi = DEMO_GRID_RANGES[key]
+        return tuple(float(v) for v in range(lo, hi + 1))
+    values = tuple(float(v) for v in values)
+    if not values:
+        raise ValueError(f"grid vacio para {key}")
+    return values
+
+
+@lru_cache(maxsize=DEMO_GRID_CACHE_MAX)
+def _demo_grid_cached(x_key: str, xs: tuple, y_key: str, ys: tuple, fixed: tuple) -> dict:
+    gx, gy = np.meshgrid(np.asarray(xs), np.asarray(ys))
+    cols = dict(fixed)
+    cols[x_key] = gx.ravel()
+    cols[y_key] = gy.ravel()
+
+    # Mismo codificador que demo_forward_pass, sobre columnas (las fijas se repiten en todo el grid)
+    out, medidor = _demo_forward(features.encode_columns(cols))
+    grid = {
+        "x_key": x_key,
+        "y_key": y_key,
+        "x": np.asarray(xs),
+        "y": np.asarray(ys),
+        "outputs": out.reshape(len(ys), len(xs), out.shape[1]),
+        "medidor": medidor.reshape(len(ys), len(xs)),
+    }
+    # Los arreglos viven en el cache: solo lectura para que nadie los modifique
+    for v in grid.values():
+        if isinstance(v, np.ndarray):
+            v.setflags(write=False)
+    return grid
+
+
+@timed("demo_grid_forward")
+def demo_grid_forward(
+    x_key: str = "ahorro_mensual_pct",
+    y_key: str = "fondo_emergencia_meses",
+    fixed: dict | None = None,
+    x_values=None,
+    y_values=None,
+) -> dict:
+    """
+    Forward del demo sobre el grid x_key × y_key (las demas respuestas salen de `fixed`, default 0).
+    Regresa arreglos: x (nx,), y (ny,), outputs (ny, nx, 3) y medidor (ny, nx); renglon = y, columna = x.
+    """
+    if x_key == y_key:
+        raise ValueError("el grid necesita dos respuestas distintas")
+    xs = _grid_values(x_key, x_values)
+    ys = _grid_values(y_key, y_values)
+    # Solo cuentan las respuestas que no son ejes; asi la llave del cache no cambia por valores que se ignoran
+    fixed_key = tuple(
+        (k, float(bool(v)) if k == "registra_gastos" else float(v))
+        for k, v in sorted((fixed or {}).items())
+        if k in features.FEATURE_KEYS and k not in (x_key, y_key)
+    )
+    return _demo_grid_cached(x_key, xs, y_key, ys, fixed_key)
+
+
+# Contadores del cache del grid (hits/misses) para monitoreo
+def demo_grid_cache_info() -> dict:
+    info = _demo_grid_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
     
     
     
@@ -78,61 +178,130 @@ def demo_forward_pass(respuestas: dict) -> tuple[list, float]:
 # (training loop = ciclo donde aprende)
 
 import json
-import torch
-import torch.nn as nn
-import torch.optim as optim
-import torch.nn.functional as F
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
-from torch.utils.data import Dataset, DataLoader
-
-# label mapping = convertir perfil texto → id numérico
-PROFILE_TO_ID = {
-    "Comprador impulsivo": 0,
-    "Ahorrador disciplinado": 1,
-    "Genio financiero": 2,
-    "Jefe de jefes": 3,
-}
+
+from apim import registry, storage
+from apim.tracing import span
+
+# torch solo hace falta para entrenar; los workers de serving pueden correr solo con NumPy (pesos .npz)
+try:
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    import torch.nn.functional as F
+    from torch.utils.data import Dataset, DataLoader
+    TORCH_AVAILABLE = True
+except ImportError:
+    torch = None
+    Dataset = object
+    TORCH_AVAILABLE = False
+
+# label mapping = convertir perfil texto → id numérico (definido en apim.features, sin torch)
+PROFILE_TO_ID = features.PROFILE_TO_ID
 
 # ruta segura
 _PROJECT_ROOT = Path(__file__).resolve().parents[1]
-HIST_PATH = _PROJECT_ROOT / "Data" / "historial.json"
 MODEL_PATH = _PROJECT_ROOT / "Data" / "dojo_v3.pt"
 
-
-def _vectorizar_respuestas_torch(respuestas: dict) -> list[float]:
-    """
-    (features = entradas numericas)
-    Orden: [ahorro, impulsivas, registra, fondo]
-    """
-    ahorro = float(respuestas.get("ahorro_mensual_pct", 0)) / 50.0
-    impulsivas = float(respuestas.get("compras_impulsivas_sem", 0)) / 14.0
-    registra = 1.0 if respuestas.get("registra_gastos", False) else 0.0
-    fondo = float(respuestas.get("fondo_emergencia_meses", 0)) / 12.0
-    return [ahorro, impulsivas, registra, fondo]
+# Pesos exportados para inferencia solo NumPy
+NPZ_PATH = _PROJECT_ROOT / "Data" / "dojo_v3.npz"
+
+# MODEL_PATH/NPZ_PATH quedan como respaldo "legacy"; los modelos nuevos se publican en apim.registry
+MODEL_FILE = "dojo_v3.pt"
+NPZ_FILE = "dojo_v3.npz"
+LEGACY_VERSION = "legacy"
+
+# Hiperparametros por defecto del entrenador; sweep_v3.py escribe la mejor config en TRAIN_CONFIG_PATH
+# (early stopping = cortar cuando la loss en un split de validacion deja de mejorar por `patience` epochs;
+#  con early stopping, `epochs` pasa a ser el maximo)
+DEFAULT_TRAIN_CONFIG = {
+    "epochs": 20,
+    "batch_size": 8,
+    "lr": 1e-3,
+    "n_hidden": 16,
+    "early_stopping": False,
+    "patience": 10,
+    "val_frac": 0.2,
+    "full_batch": False,
+}
+TRAIN_CONFIG_PATH = _PROJECT_ROOT / "Data" / "dojo_v3_config.json"
 
 
 class FinancialDataset(Dataset):
-    def __init__(self, data_file: Path):
-        with data_file.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        self.X = []
-        self.y = []
+    """
+    Filas unicas (features, etiqueta) con su peso = cuantas veces aparecieron.
+    Las respuestas son discretas, asi que casi todo el historial son repeticiones:
+    el costo de entrenar depende de entradas distintas, no del trafico.
+    - len(dataset): filas unicas
+    - dataset.n_samples: corridas originales
+    Sin data_file lee del historial por segmentos (solo los que caen en [start, end]).
+    """
+    def __init__(
+        self,
+        data_file: Path | None = None,
+        start: storage.TimeBound = None,
+        end: storage.TimeBound = None,
+    ):
+        if data_file is not None:
+            with data_file.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            data = storage.iter_events(start, end, types={"run"})
+
+        respuestas: list = []
+        labels: list = []
 
         for record in data:
             if record.get("type") != "run":
                 continue
 
-            respuestas = record.get("respuestas", {})
-            resultado = record.get("resultado", {})
-            persona = resultado.get("persona", "")
-
+            persona = record.get("resultado", {}).get("persona", "")
             if persona not in PROFILE_TO_ID:
                 continue
 
-            x = _vectorizar_respuestas_torch(respuestas)
-            self.X.append(x)
-            self.y.append(PROFILE_TO_ID[persona])
+            respuestas.append(record.get("respuestas", {}))
+            labels.append(PROFILE_TO_ID[persona])
+
+        # Todo el lote se codifica de una vez (apim.features) y se deduplica con np.unique
+        self._set_rows(features.encode(respuestas), np.array(labels, dtype=np.float32))
+
+    # Filas unicas (features, etiqueta) con su conteo como peso
+    def _set_rows(self, X: np.ndarray, y: np.ndarray) -> None:
+        rows, counts = np.unique(np.column_stack([X, y]), axis=0, return_counts=True)
+        self.X = rows[:, :features.N_FEATURES].tolist()
+        self.y = rows[:, features.N_FEATURES].astype(np.int64).tolist()
+        self.w = counts.astype(np.float64).tolist()
+        self.n_samples = int(len(y))
+
+    # Dataset desde el export columnar (apim.columnar): features y dedup vectorizados con np.unique
+    @classmethod
+    def from_columnar(
+        cls,
+        start: storage.TimeBound = None,
+        end: storage.TimeBound = None,
+        refresh: bool = True,
+    ) -> "FinancialDataset":
+        from apim import columnar
+
+        cols = columnar.load_columns("run", refresh=refresh)
+        keep = cols["v2_id"] >= 0
+        if start is not None:
+            keep &= cols["ts"] >= columnar._ts_us(storage._iso_bound(start))
+        if end is not None:
+            keep &= cols["ts"] <= columnar._ts_us(storage._iso_bound(end))
+
+        # Mismo codificador que el historial, directo sobre las columnas
+        X = features.encode_columns({k: cols[k][keep] for k in features.FEATURE_KEYS})
+        y = cols["v2_id"][keep].astype(np.float32)
+
+        ds = cls.__new__(cls)
+        ds._set_rows(X, y)
+        return ds
 
     def __len__(self):
         return len(self.X)
@@ -140,64 +309,419 @@ class FinancialDataset(Dataset):
     def __getitem__(self, idx):
         x = torch.tensor(self.X[idx], dtype=torch.float32)
         y = torch.tensor(self.y[idx], dtype=torch.long)
-        return x, y
+        w = torch.tensor(self.w[idx], dtype=torch.float32)
+        return x, y, w
 
 
-class DojoNet(nn.Module):
-    def __init__(self, n_in: int = 4, n_hidden: int = 16, n_out: int = 4):
-        super().__init__()
-        self.fc1 = nn.Linear(n_in, n_hidden)
-        self.relu = nn.ReLU()
-        self.fc2 = nn.Linear(n_hidden, n_out)
+if TORCH_AVAILABLE:
+    class DojoNet(nn.Module):
+        def __init__(self, n_in: int = 4, n_hidden: int = 16, n_out: int = 4):
+            super().__init__()
+            self.fc1 = nn.Linear(n_in, n_hidden)
+            self.relu = nn.ReLU()
+            self.fc2 = nn.Linear(n_hidden, n_out)
 
-    def forward(self, x):
-        x = self.fc1(x)
-        x = self.relu(x)
-        x = self.fc2(x)
-        return x
+        def forward(self, x):
+            x = self.fc1(x)
+            x = self.relu(x)
+            x = self.fc2(x)
+            return x
 
 
-def train_on_startup(
-    data_file: Path = HIST_PATH,
-    epochs: int = 20,
-    batch_size: int = 8,
-    lr: float = 1e-3,
-) -> dict:
+class DojoNetNumpy:
     """
-    Entrena al iniciar la app y regresa metricas básicas
+    La misma DojoNet (fc1 -> ReLU -> fc2 -> softmax) pero solo con NumPy,
+    usando las capas del Dojo V2. Sirve para predecir sin cargar torch.
     """
-    if not data_file.exists():
-        return {"ok": False, "reason": "no_historial", "path": str(data_file)}
+    def __init__(self, weights: dict):
+        # torch guarda Linear.weight como (salidas, entradas); DenseLayer usa (entradas, salidas)
+        self.fc1 = DenseLayer.from_weights(weights["fc1.weight"].T, weights["fc1.bias"])
+        self.relu = ReLU()
+        self.fc2 = DenseLayer.from_weights(weights["fc2.weight"].T, weights["fc2.bias"])
+        self.softmax = Softmax()
+
+    @classmethod
+    def load(cls, path: Path) -> "DojoNetNumpy":
+        with np.load(path) as data:
+            return cls({k: data[k] for k in data.files})
+
+    # Logits, igual que DojoNet.forward
+    def forward(self, x: np.ndarray) -> np.ndarray:
+        return self.fc2.forward(self.relu.forward(self.fc1.forward(x)))
+
+    # Probabilidades por clase (una fila por ejemplo)
+    def predict_proba(self, x: np.ndarray) -> np.ndarray:
+        return self.softmax.forward(self.forward(x))
+
+
+# Exporta el state_dict entrenado a un .npz compacto (float32) para serving sin torch
+def export_npz(model_path: Path | None = None, npz_path: Path | None = None) -> Path:
+    model_path = model_path or MODEL_PATH
+    npz_path = npz_path or NPZ_PATH
+
+    state = torch.load(model_path, map_location="cpu")
+    arrays = {k: v.detach().cpu().numpy().astype(np.float32) for k, v in state.items()}
+
+    # Escribimos a un temporal y reemplazamos, asi nadie lee un .npz a medias
+    npz_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = npz_path.with_suffix(".npz.tmp")
+    with tmp.open("wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, npz_path)
+    return npz_path
+
+
+# Config de entrenamiento: defaults + lo que haya dejado el ultimo sweep
+def load_train_config() -> dict:
+    config = dict(DEFAULT_TRAIN_CONFIG)
+    try:
+        saved = json.loads(TRAIN_CONFIG_PATH.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return config
+
+    for k, default in DEFAULT_TRAIN_CONFIG.items():
+        if k in saved.get("config", {}):
+            config[k] = type(default)(saved["config"][k])
+    return config
+
+
+# Todo el dataset como tensores (X, y, w); el dataset es chico y asi no se arma cada batch item por item.
+# Si el dataset no trae pesos (ej. TensorDataset(X, y)), cada fila pesa 1.
+def _as_tensors(dataset: Dataset) -> tuple["torch.Tensor", "torch.Tensor", "torch.Tensor"]:
+    batch = next(iter(DataLoader(dataset, batch_size=len(dataset))))
+    X, y = batch[0], batch[1]
+    w = batch[2].float() if len(batch) > 2 else torch.ones(len(X))
+    return X, y, w
+
+
+# Loss ponderada: promedio de la loss por fila pesado por cuantas veces aparecio.
+# Con full batch es igual a la loss sobre las filas originales; con mini-batches lo es en esperanza.
+def _weighted_loss(criterion, outputs, labels, weights) -> "torch.Tensor":
+    per_row = criterion(outputs, labels)
+    return (per_row * weights).sum() / weights.sum()
+
+
+# Training loop compartido por train_on_startup y sweep_v3.py
+def fit_dojonet(
+    dataset: Dataset,
+    epochs: int,
+    batch_size: int,
+    lr: float,
+    n_hidden: int,
+    seed: int | None = None,
+    early_stopping: bool = False,
+    patience: int = 10,
+    val_frac: float = 0.2,
+    full_batch: bool = False,
+    min_delta: float = 1e-4,
+) -> tuple["DojoNet", dict]:
+    """
+    Regresa (modelo, info) con info = last_loss, epochs_run, stop_reason y val_loss.
+    - full_batch: un paso del optimizer por epoch con todos los ejemplos
+    - early_stopping: separa val_frac para validar y se queda con los mejores pesos
+    """
+    if seed is not None:
+        torch.manual_seed(seed)
 
-    dataset = FinancialDataset(data_file)
+    X, y, w = _as_tensors(dataset)
 
-    # Si hay muy pocos ejemplos, no entrenamos
-    if len(dataset) < 8:
-        return {"ok": False, "reason": "insufficient_data", "n": len(dataset)}
+    # Split de validacion (solo si hay early stopping)
+    X_val = y_val = w_val = None
+    if early_stopping and len(X) >= 2:
+        perm = torch.randperm(len(X))
+        n_val = min(len(X) - 1, max(1, int(len(X) * val_frac)))
+        X_val, y_val, w_val = X[perm[:n_val]], y[perm[:n_val]], w[perm[:n_val]]
+        X, y, w = X[perm[n_val:]], y[perm[n_val:]], w[perm[n_val:]]
 
-    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    step = len(X) if full_batch else max(1, batch_size)
 
-    model = DojoNet()
-    criterion = nn.CrossEntropyLoss()
+    model = DojoNet(n_hidden=n_hidden)
+    criterion = nn.CrossEntropyLoss(reduction="none")
     optimizer = optim.Adam(model.parameters(), lr=lr)
 
     last_loss = None
+    best_val = None
+    best_state = None
+    bad_epochs = 0
+    epochs_run = 0
+    stop_reason = "max_epochs"
 
     for _ in range(epochs):
-        for inputs, labels in loader:
+        # shuffle = True, igual que el DataLoader de antes
+        order = torch.randperm(len(X)) if step < len(X) else None
+        for start in range(0, len(X), step):
+            if order is None:
+                inputs, labels, weights = X, y, w
+            else:
+                idx = order[start:start + step]
+                inputs, labels, weights = X[idx], y[idx], w[idx]
             optimizer.zero_grad()
             outputs = model(inputs)
-            loss = criterion(outputs, labels)
+            loss = _weighted_loss(criterion, outputs, labels, weights)
             loss.backward()
             optimizer.step()
             last_loss = float(loss.item())
 
-    # Guardamos pesos (state_dict = parámetros aprendidos)
-    MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
-    torch.save(model.state_dict(), MODEL_PATH)
+        epochs_run += 1
+
+        if X_val is None:
+            continue
+
+        with torch.no_grad():
+            val_loss = float(_weighted_loss(criterion, model(X_val), y_val, w_val).item())
+
+        # Mejoro: guardamos pesos; no mejoro en `patience` epochs seguidas: paramos
+        if best_val is None or val_loss < best_val - min_delta:
+            best_val = val_loss
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            bad_epochs = 0
+        else:
+            bad_epochs += 1
+            if bad_epochs >= patience:
+                stop_reason = "early_stopping"
+                break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+
+    return model, {
+        "last_loss": last_loss,
+        "epochs_run": epochs_run,
+        "stop_reason": stop_reason,
+        "val_loss": best_val,
+    }
+
+
+# Accuracy contra las etiquetas V2 del dataset (held-out en el sweep), pesada por repeticiones
+def evaluate_accuracy(model: "DojoNet", dataset: Dataset) -> float:
+    if len(dataset) == 0:
+        return 0.0
+    inputs, labels, weights = _as_tensors(dataset)
+    model.eval()
+    with torch.no_grad():
+        pred = model(inputs).argmax(dim=1)
+    return float(((pred == labels).float() * weights).sum().item() / weights.sum().item())
+
+
+@timed("train_on_startup")
+def train_on_startup(
+    data_file: Path | None = None,
+    epochs: int | None = None,
+    batch_size: int | None = None,
+    lr: float | None = None,
+    n_hidden: int | None = None,
+    early_stopping: bool | None = None,
+    patience: int | None = None,
+    full_batch: bool | None = None,
+    only_if_drift: bool = False,
+) -> dict:
+    """
+    Entrena al iniciar la app y regresa metricas básicas.
+    Los hiperparametros que no se pasen salen de load_train_config().
+    Con only_if_drift=True y un modelo ya publicado, solo entrena si apim.drift dice que la
+    poblacion cambio desde su entrenamiento (si no, regresa reason="no_drift" con el reporte).
+    """
+    if not TORCH_AVAILABLE:
+        return {"ok": False, "reason": "no_torch"}
+
+    if only_if_drift and registry.current_version():
+        from apim import drift
+
+        rep = drift.report()
+        if not rep["retrain"]:
+            return {"ok": False, "reason": "no_drift", "drift": rep}
+
+    t0 = time.perf_counter()
 
-    return {"ok": True, "n": len(dataset), "last_loss": last_loss, "model_path": str(MODEL_PATH)}
+    if data_file is not None and not data_file.exists():
+        return {"ok": False, "reason": "no_historial", "path": str(data_file)}
+
+    config = load_train_config()
+    overrides = {
+        "epochs": epochs,
+        "batch_size": batch_size,
+        "lr": lr,
+        "n_hidden": n_hidden,
+        "early_stopping": early_stopping,
+        "patience": patience,
+        "full_batch": full_batch,
+    }
+    config.update({k: v for k, v in overrides.items() if v is not None})
+
+    # Sin archivo explicito, el export columnar es la entrada estandar (sync incremental antes de leer)
+    dataset = FinancialDataset(data_file) if data_file is not None else FinancialDataset.from_columnar()
+
+    # Si hay muy pocos ejemplos, no entrenamos
+    if dataset.n_samples < 8:
+        return {"ok": False, "reason": "insufficient_data", "n": dataset.n_samples}
+
+    model, info = fit_dojonet(dataset, **config)
+    last_loss = info["last_loss"]
+
+    train_seconds = time.perf_counter() - t0
+
+    # Guardamos pesos (state_dict = parámetros aprendidos) en una version nueva del registro;
+    # los lectores siguen usando la version anterior hasta que se mueve el puntero CURRENT
+    version, staging = registry.stage_version()
+    try:
+        torch.save(model.state_dict(), staging / MODEL_FILE)
+
+        # Y la version NumPy para los workers que no cargan torch
+        export_npz(staging / MODEL_FILE, staging / NPZ_FILE)
+
+        final = registry.publish(version, staging, {
+            "n": dataset.n_samples,
+            "n_unique": len(dataset),
+            "last_loss": last_loss,
+            "trained_at": datetime.now(timezone.utc).isoformat(),
+            "train_seconds": train_seconds,
+            "features_version": features.FEATURES_VERSION,
+            "config": config,
+            "epochs_run": info["epochs_run"],
+            "stop_reason": info["stop_reason"],
+            "val_loss": info["val_loss"],
+        })
+    except Exception:
+        registry.discard(staging)
+        raise
+
+    return {
+        "ok": True,
+        "n": dataset.n_samples,
+        "n_unique": len(dataset),
+        "last_loss": last_loss,
+        "epochs_run": info["epochs_run"],
+        "train_seconds": train_seconds,
+        "stop_reason": info["stop_reason"],
+        "val_loss": info["val_loss"],
+        "model_version": version,
+        "model_path": str(final / MODEL_FILE),
+        "npz_path": str(final / NPZ_FILE),
+    }
 
+# ===== CACHE DE PREDICCIONES V3 =====
+# (cache LRU = guarda las ultimas N predicciones y tira la menos usada cuando se llena)
+# Las features vienen de respuestas discretas, asi que las mismas entradas se repiten mucho.
+# La llave incluye la huella del modelo: si se publica otra version, las entradas viejas ya no sirven.
+PRED_CACHE_MAX = 4096
+
+_pred_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_pred_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_pred_cache_lock = threading.Lock()
+
+# Modelo ya cargado para la huella actual (evita torch.load en cada prediccion)
+_loaded_model: dict = {"fingerprint": None, "model": None}
+
+
+# Motor de inferencia: "torch" o "numpy" (APIM_V3_ENGINE=numpy fuerza NumPy aunque haya torch)
+def _inference_engine() -> str:
+    if not TORCH_AVAILABLE or os.environ.get("APIM_V3_ENGINE", "").lower() == "numpy":
+        return "numpy"
+    return "torch"
+
+
+# Archivo de pesos que usa cada motor: version activa del registro o, si no hay, los archivos legacy
+def _weights_path(engine: str) -> tuple[str, Path]:
+    name = NPZ_FILE if engine == "numpy" else MODEL_FILE
+    version = registry.current_version()
+    if version:
+        return version, registry.artifact_path(name, version)
+    return LEGACY_VERSION, (NPZ_PATH if engine == "numpy" else MODEL_PATH)
+
+
+# Huella del modelo activo: cambia cuando se publica otra version (o se reemplaza el archivo legacy)
+def _model_fingerprint() -> tuple | None:
+    engine = _inference_engine()
+    version, path = _weights_path(engine)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (engine, str(path), version, st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+# Si la huella cambio, vaciamos cache y modelo cargado (llamar con el lock tomado)
+def _check_fingerprint(fingerprint: tuple) -> None:
+    if _loaded_model["fingerprint"] == fingerprint:
+        return
+    if _pred_cache:
+        _pred_cache_stats["invalidations"] += 1
+    _pred_cache.clear()
+    _loaded_model["fingerprint"] = fingerprint
+    _loaded_model["model"] = None
+
+
+# Carga (una sola vez por huella) el modelo entrenado
+def _get_model(fingerprint: tuple):
+    with _pred_cache_lock:
+        _check_fingerprint(fingerprint)
+        model = _loaded_model["model"]
+    if model is not None:
+        return model
+
+    engine, path = fingerprint[0], Path(fingerprint[1])
+    with span("model_load"):
+        if engine == "numpy":
+            model = DojoNetNumpy.load(path)
+        else:
+            state = torch.load(path, map_location="cpu")
+            model = DojoNet(n_hidden=state["fc1.weight"].shape[0])
+            model.load_state_dict(state)
+            model.eval()
+
+    with _pred_cache_lock:
+        if _loaded_model["fingerprint"] == fingerprint:
+            _loaded_model["model"] = model
+    return model
+
+
+def _cache_get(key: tuple) -> dict | None:
+    with _pred_cache_lock:
+        _check_fingerprint(key[0])
+        pred = _pred_cache.get(key)
+        if pred is None:
+            _pred_cache_stats["misses"] += 1
+            return None
+        _pred_cache.move_to_end(key)
+        _pred_cache_stats["hits"] += 1
+    # Copia para que quien llame no modifique lo guardado
+    return {**pred, "probs": list(pred["probs"])}
+
+
+def _cache_put(key: tuple, pred: dict) -> None:
+    with _pred_cache_lock:
+        if _loaded_model["fingerprint"] != key[0]:
+            return
+        _pred_cache[key] = {**pred, "probs": list(pred["probs"])}
+        _pred_cache.move_to_end(key)
+        while len(_pred_cache) > PRED_CACHE_MAX:
+            _pred_cache.popitem(last=False)
+            _pred_cache_stats["evictions"] += 1
+
+
+# Contadores del cache (hits/misses) para monitoreo
+def prediction_cache_info() -> dict:
+    with _pred_cache_lock:
+        total = _pred_cache_stats["hits"] + _pred_cache_stats["misses"]
+        return {
+            **_pred_cache_stats,
+            "size": len(_pred_cache),
+            "maxsize": PRED_CACHE_MAX,
+            "hit_rate": (_pred_cache_stats["hits"] / total) if total else 0.0,
+        }
+
+
+# Vacia cache, modelo cargado y contadores
+def clear_prediction_cache() -> None:
+    with _pred_cache_lock:
+        _pred_cache.clear()
+        _loaded_model["fingerprint"] = None
+        _loaded_model["model"] = None
+        for k in _pred_cache_stats:
+            _pred_cache_stats[k] = 0
+
+
+@timed("predict_v3")
 def predict_v3(respuestas: dict) -> dict:
     """
     (inference = usar el modelo ya entrenado para predecir, sin entrenar)
@@ -210,34 +734,76 @@ def predict_v3(respuestas: dict) -> dict:
 
 
     # Si aun no existe el archivo entrenado, no fallamos: solo decimos "no_model"
-    if not MODEL_PATH.exists():
+    fingerprint = _model_fingerprint()
+    if fingerprint is None:
         return {"ok": False, "reason": "no_model"}
 
-       # Si aan no existe el archivo entrenado, no fallamos: solo decimos "no_model"
-    if not MODEL_PATH.exists():
-        return {"ok": False, "reason": "no_model"}
+    # Convertimos respuestas a features (apim.features)
+    x = features.encode_one(respuestas)
 
-    # Convertimos respuestas a features 
-    x_list = _vectorizar_respuestas_torch(respuestas)
-    x = torch.tensor([x_list], dtype=torch.float32)
+    # Respuestas repetidas con el mismo modelo: nos saltamos forward pass y softmax
+    key = (fingerprint, tuple(x.tolist()))
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
 
-    # Cargamos modelo y pesos
-    model = DojoNet()
-    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
-    model.eval()
+    # Modelo con pesos ya cargados
+    model = _get_model(fingerprint)
 
     # Inference = usar el modelo sin entrenar
-    with torch.no_grad():  
-        logits = model(x) 
-        probs = F.softmax(logits, dim=1).squeeze(0) 
+    probs = [float(p) for p in _forward_probs(model, fingerprint[0], x[None, :])[0]]
+    pred = _pred_from_probs(probs, fingerprint[2])
+    _cache_put(key, pred)
+    return pred
 
-    pred_id = int(torch.argmax(probs).item())
-    conf = float(probs[pred_id].item())
 
+# Probabilidades de un lote (n, 4) con el motor que corresponda
+def _forward_probs(model, engine: str, X: np.ndarray) -> np.ndarray:
+    if engine == "numpy":
+        return model.predict_proba(X)
+    with torch.no_grad():
+        logits = model(torch.from_numpy(X))
+        return F.softmax(logits, dim=1).numpy()
+
+
+def _pred_from_probs(probs: list, model_version: str) -> dict:
+    pred_id = int(np.argmax(probs))
     ID_TO_PROFILE = {v: k for k, v in PROFILE_TO_ID.items()}
     return {
         "ok": True,
         "pred_persona": ID_TO_PROFILE.get(pred_id, ""),
-        "confidence": conf,
-        "probs": [float(p.item()) for p in probs],
+        "confidence": probs[pred_id],
+        "probs": probs,
+        "model_version": model_version,
     }
+
+
+# Igual que predict_v3 pero para muchas respuestas: un solo forward pass para todo el lote.
+# Por default no pasa por el cache (scoring masivo); con use_cache=True solo los misses van al forward
+# (lo usa el servidor de micro-batching, apim.inference). Regresa un dict por respuesta, en orden.
+@timed("predict_v3_batch")
+def predict_v3_batch(respuestas_list: list, use_cache: bool = False) -> list:
+    if not respuestas_list:
+        return []
+
+    fingerprint = _model_fingerprint()
+    if fingerprint is None:
+        return [{"ok": False, "reason": "no_model"} for _ in respuestas_list]
+
+    X = features.encode(respuestas_list)
+    if not use_cache:
+        model = _get_model(fingerprint)
+        P = _forward_probs(model, fingerprint[0], X)
+        return [_pred_from_probs([float(p) for p in row], fingerprint[2]) for row in P]
+
+    # Misma llave que predict_v3: comparten cache
+    keys = [(fingerprint, tuple(x)) for x in X.tolist()]
+    preds = [_cache_get(key) for key in keys]
+    misses = [i for i, pred in enumerate(preds) if pred is None]
+    if misses:
+        model = _get_model(fingerprint)
+        P = _forward_probs(model, fingerprint[0], X[misses])
+        for i, row in zip(misses, P):
+            preds[i] = _pred_from_probs([float(p) for p in row], fingerprint[2])
+            _cache_put(keys[i], preds[i])
+    return preds
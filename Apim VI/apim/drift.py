@@ -0,0 +1,344 @@
+from __future__ import annotations
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from apim import features, registry, storage
+from apim.features import PROFILE_TO_ID
+
+# Monitor de drift de las respuestas
+# (drift = la poblacion que llega hoy ya no se parece a la que vio el modelo al entrenar)
+#
+# Histogramas por dia (UTC) con bins fijos de las 4 respuestas y de la persona V2. Se actualizan con cada
+# lote que escribe storage (listener de commit: save_run dentro o fuera del pipeline) y se guardan en
+# Data/drift.json. El reporte compara la ventana de entrenamiento del modelo activo contra los ultimos dias:
+#   PSI (population stability index) = sum((r - b) * ln(r / b))
+#   KL (divergencia de Kullback-Leibler, reciente contra entrenamiento) = sum(r * ln(r / b))
+# Ya con los conteos sumados, cada comparacion es O(bins).
+#
+# Regla usual del PSI: < 0.1 estable, 0.1-0.2 moderado, >= 0.2 cambio fuerte (vale la pena reentrenar).
+#
+# Configuracion por entorno:
+#   APIM_DRIFT_PSI=0.2            PSI a partir del cual se marca reentrenar
+#   APIM_DRIFT_MIN_RECENT=200     corridas minimas en la ventana reciente para opinar
+#   APIM_DRIFT_FLUSH_EVERY=50     corridas acumuladas en memoria antes de escribir el archivo
+#
+# Con varios procesos escribiendo el conteo es best-effort; `python -m apim.drift rebuild` lo recalcula
+# exacto desde el historial.
+
+DRIFT_NAME = "drift.json"
+BINS_VERSION = 1
+
+# Bordes de los bins (np.digitize: bin i = edges[i-1] <= x < edges[i]; el primero y el ultimo son abiertos)
+BIN_EDGES: Dict[str, List[float]] = {
+    "ahorro_mensual_pct": [5, 10, 15, 20, 25, 30, 35, 40, 45, 50],
+    "compras_impulsivas_sem": [1, 2, 3, 4, 5, 7, 10, 14, 21, 30],
+    "registra_gastos": [1],
+    "fondo_emergencia_meses": [1, 2, 3, 4, 6, 9, 12],
+}
+# Persona V2: una columna por persona conocida + una para desconocida o vacia
+PERSONA_FIELD = "persona"
+N_PERSONAS = len(PROFILE_TO_ID) + 1
+
+FIELDS = tuple(BIN_EDGES) + (PERSONA_FIELD,)
+N_BINS = {**{k: len(v) + 1 for k, v in BIN_EDGES.items()}, PERSONA_FIELD: N_PERSONAS}
+
+PSI_WARN = 0.1
+PSI_RETRAIN = float(os.environ.get("APIM_DRIFT_PSI", 0.2))
+MIN_RECENT = int(os.environ.get("APIM_DRIFT_MIN_RECENT", 200))
+FLUSH_EVERY = int(os.environ.get("APIM_DRIFT_FLUSH_EVERY", 50))
+
+# Suavizado para bins vacios (sin esto ln(r / 0) explota)
+EPS = 1e-4
+
+# _lock cuida solo lo pendiente en memoria (lo toman los commits, debe ser rapido);
+# _io_lock serializa leer-sumar-escribir Data/drift.json (para no perder conteos entre dos flush)
+_lock = threading.Lock()
+_io_lock = threading.Lock()
+# Conteos aun no escritos: dia -> campo -> arreglo de bins
+_pending: Dict[str, Dict[str, np.ndarray]] = {}
+_pending_runs = 0
+# Sube con cada rebuild: un flush que tomo su parte antes del rebuild ya esta contado en el archivo nuevo
+_generation = 0
+_installed = False
+
+
+def _drift_path() -> Path:
+    return storage.DATA_DIR / DRIFT_NAME
+
+
+# Identifica los bins con los que se armo el archivo; si cambian, los conteos viejos ya no sirven
+def _spec() -> Dict[str, Any]:
+    return {
+        "bins_version": BINS_VERSION,
+        "features_version": features.FEATURES_VERSION,
+        "edges": BIN_EDGES,
+        "personas": list(PROFILE_TO_ID),
+    }
+
+
+def _empty_day() -> Dict[str, np.ndarray]:
+    return {f: np.zeros(N_BINS[f], dtype=np.int64) for f in FIELDS}
+
+
+# Corridas -> {dia: {campo: conteos}} (un bincount por campo y dia)
+def _histograms(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, np.ndarray]]:
+    days = np.array([str(e.get("ts") or storage._now_iso())[:10] for e in runs])
+    cols = features.raw_columns(e.get("respuestas") or {} for e in runs)
+    cols[PERSONA_FIELD] = np.array(
+        [PROFILE_TO_ID.get((e.get("resultado") or {}).get("persona") or "", N_PERSONAS - 1) for e in runs],
+        dtype=np.int64,
+    )
+    bins = {f: np.digitize(cols[f], BIN_EDGES[f]) for f in BIN_EDGES}
+    bins[PERSONA_FIELD] = cols[PERSONA_FIELD]
+
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    for day in np.unique(days):
+        mask = days == day
+        out[str(day)] = {f: np.bincount(bins[f][mask], minlength=N_BINS[f]).astype(np.int64) for f in FIELDS}
+    return out
+
+
+def _add(target: Dict[str, Dict[str, np.ndarray]], hists: Dict[str, Dict[str, np.ndarray]]) -> None:
+    for day, h in hists.items():
+        acc = target.setdefault(day, _empty_day())
+        for f in FIELDS:
+            acc[f] += h[f]
+
+
+# Registra corridas recien escritas (lo llama storage despues de cada commit)
+def observe(runs: List[Dict[str, Any]]) -> None:
+    global _pending_runs
+    if not runs:
+        return
+    hists = _histograms(runs)
+    with _lock:
+        _add(_pending, hists)
+        _pending_runs += len(runs)
+        due = _pending_runs >= FLUSH_EVERY
+    if due:
+        flush()
+
+
+def _on_commit(events: List[Tuple[str, Dict[str, Any]]]) -> None:
+    observe([e for ns, e in events if ns == "historial" and e.get("type") == "run"])
+
+
+# Conecta el monitor a storage (idempotente); lo hace el pipeline post-submit al arrancar
+def install() -> None:
+    global _installed
+    if not _installed:
+        storage.add_commit_listener(_on_commit)
+        atexit.register(flush)
+        _installed = True
+
+
+def _load() -> Dict[str, Any]:
+    try:
+        data = json.loads(_drift_path().read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"spec": _spec(), "days": {}}
+    if data.get("spec") != _spec():
+        return {"spec": _spec(), "days": {}, "stale": True}
+    return data
+
+
+def _save(data: Dict[str, Any]) -> None:
+    path = _drift_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# Suma lo pendiente al archivo (lee, suma y reemplaza de forma atomica); bajo _lock solo se toma lo pendiente
+def flush() -> None:
+    global _pending_runs
+    with _lock:
+        if not _pending:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _pending_runs = 0
+        generation = _generation
+    with _io_lock:
+        if generation != _generation:
+            return
+        data = _load()
+        data.pop("stale", None)
+        for day, h in pending.items():
+            acc = data["days"].setdefault(day, {f: [0] * N_BINS[f] for f in FIELDS})
+            for f in FIELDS:
+                acc[f] = (np.asarray(acc[f], dtype=np.int64) + h[f]).tolist()
+        data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        _save(data)
+
+
+# Recalcula todos los histogramas desde el historial (tambien sirve si cambian los bins)
+def rebuild(chunk: int = 50_000) -> Dict[str, Any]:
+    global _pending_runs, _generation
+    days: Dict[str, Dict[str, np.ndarray]] = {}
+    buf: List[Dict[str, Any]] = []
+    n = 0
+    for e in storage.iter_events(types={"run"}):
+        buf.append(e)
+        if len(buf) >= chunk:
+            _add(days, _histograms(buf))
+            n += len(buf)
+            buf = []
+    if buf:
+        _add(days, _histograms(buf))
+        n += len(buf)
+
+    with _io_lock:
+        with _lock:
+            _pending.clear()
+            _pending_runs = 0
+            _generation += 1
+        _save({
+            "spec": _spec(),
+            "days": {d: {f: h[f].tolist() for f in FIELDS} for d, h in sorted(days.items())},
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        })
+    return {"runs": n, "days": len(days)}
+
+
+# Conteos por dia ya sumados con lo pendiente en memoria
+def load_days() -> Dict[str, Dict[str, np.ndarray]]:
+    flush()
+    with _io_lock:
+        data = _load()
+    return {d: {f: np.asarray(h[f], dtype=np.int64) for f in FIELDS} for d, h in data["days"].items()}
+
+
+def _window(days: Dict[str, Dict[str, np.ndarray]], start: str, end: str) -> Tuple[Dict[str, np.ndarray], int]:
+    acc = _empty_day()
+    for day, h in days.items():
+        if start <= day <= end:
+            for f in FIELDS:
+                acc[f] += h[f]
+    return acc, int(acc[PERSONA_FIELD].sum())
+
+
+# PSI y KL entre dos histogramas de un campo (O(bins))
+def psi_kl(baseline: np.ndarray, recent: np.ndarray) -> Tuple[float, float]:
+    b = baseline.astype(np.float64) + EPS
+    r = recent.astype(np.float64) + EPS
+    b /= b.sum()
+    r /= r.sum()
+    log_ratio = np.log(r / b)
+    return float(((r - b) * log_ratio).sum()), float((r * log_ratio).sum())
+
+
+def _status(psi: float) -> str:
+    if psi >= PSI_RETRAIN:
+        return "alto"
+    if psi >= PSI_WARN:
+        return "moderado"
+    return "estable"
+
+
+# Fin de la ventana de entrenamiento: dia en que se entreno el modelo activo (None si no hay modelo)
+def _trained_day() -> Optional[str]:
+    version = registry.current_version()
+    if not version:
+        return None
+    trained_at = registry.read_meta(version).get("trained_at")
+    return str(trained_at)[:10] if trained_at else None
+
+
+def report(recent_days: int = 7, baseline_start: Optional[str] = None, baseline_end: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Compara la ventana de entrenamiento contra los ultimos `recent_days` dias (UTC, incluye hoy).
+    Sin baseline_end se usa el dia en que se entreno el modelo activo; sin modelo, todo lo anterior
+    a la ventana reciente. La ventana reciente nunca se traslapa con la de entrenamiento.
+    """
+    days = load_days()
+    today = datetime.now(timezone.utc).date()
+    recent_start = (today - timedelta(days=max(1, recent_days) - 1)).isoformat()
+    recent_end = today.isoformat()
+
+    day_before_recent = (today - timedelta(days=max(1, recent_days))).isoformat()
+    end = baseline_end or _trained_day() or day_before_recent
+    end = min(end, day_before_recent)
+    start = baseline_start or (min(days) if days else end)
+
+    base, n_base = _window(days, start, end)
+    recent, n_recent = _window(days, recent_start, recent_end)
+    out: Dict[str, Any] = {
+        "baseline": {"start": start, "end": end, "n": n_base},
+        "recent": {"start": recent_start, "end": recent_end, "n": n_recent},
+        "psi_retrain": PSI_RETRAIN,
+        "min_recent": MIN_RECENT,
+    }
+    if n_base == 0 or n_recent == 0:
+        return {**out, "ok": False, "reason": "sin_datos", "retrain": False}
+
+    fields: Dict[str, Dict[str, Any]] = {}
+    for f in FIELDS:
+        psi, kl = psi_kl(base[f], recent[f])
+        fields[f] = {"psi": psi, "kl": kl, "status": _status(psi)}
+    max_field = max(fields, key=lambda f: fields[f]["psi"])
+
+    reasons = [f"{f}: PSI={fields[f]['psi']:.3f}" for f in FIELDS if fields[f]["psi"] >= PSI_RETRAIN]
+    enough = n_recent >= MIN_RECENT
+    if reasons and not enough:
+        reasons.append(f"pero solo {n_recent} corridas recientes (< {MIN_RECENT})")
+    return {
+        **out,
+        "ok": True,
+        "fields": fields,
+        "max_psi": fields[max_field]["psi"],
+        "max_field": max_field,
+        "retrain": bool(reasons) and enough,
+        "reasons": reasons,
+    }
+
+
+def render_text(rep: Dict[str, Any]) -> str:
+    b, r = rep["baseline"], rep["recent"]
+    lines = [
+        f"Entrenamiento: {b['start']} .. {b['end']} (n={b['n']})",
+        f"Reciente:      {r['start']} .. {r['end']} (n={r['n']})",
+    ]
+    if not rep["ok"]:
+        lines.append(f"Sin comparacion: {rep['reason']}")
+        return "\n".join(lines)
+    lines += ["", f"{'campo':<26} {'PSI':>8} {'KL':>8}  estado"]
+    for f, m in rep["fields"].items():
+        lines.append(f"{f:<26} {m['psi']:>8.4f} {m['kl']:>8.4f}  {m['status']}")
+    lines += ["", f"Reentrenar: {'SI' if rep['retrain'] else 'no'}"]
+    lines += [f"- {reason}" for reason in rep["reasons"]]
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drift de las respuestas: PSI y KL contra la ventana de entrenamiento")
+    parser.add_argument("command", nargs="?", default="report", choices=["report", "rebuild"])
+    parser.add_argument("--recent-days", type=int, default=7, help="dias de la ventana reciente")
+    parser.add_argument("--baseline-start", default=None, help="primer dia de la ventana de entrenamiento (YYYY-MM-DD)")
+    parser.add_argument("--baseline-end", default=None, help="ultimo dia de la ventana de entrenamiento (YYYY-MM-DD)")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        t0 = time.perf_counter()
+        r = rebuild()
+        print(f"Histogramas recalculados: {r['runs']} corridas en {r['days']} dias ({time.perf_counter() - t0:.2f}s)")
+        return
+
+    rep = report(args.recent_days, args.baseline_start, args.baseline_end)
+    print(json.dumps(rep, ensure_ascii=False, indent=2) if args.json else render_text(rep))
+
+
+# Punto de entrada para revisar el drift desde terminal
+if __name__ == "__main__":
+    main()
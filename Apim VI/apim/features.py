@@ -0,0 +1,108 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Mapping
+
+import numpy as np
+
+from apim.utils import clamp_float
+
+# Codificador de features de las respuestas del formulario (uno solo para dojo y analitica)
+# (features = entradas numericas del modelo; encoder = lo que convierte respuestas en esas entradas)
+#
+# Orden de columnas: [ahorro, impulsivas, registra, fondo]
+# Cada respuesta se valida (lo que no es numero -> default), se limita a su rango y se escala a ~0..1.
+# Las reglas V2 de apim.core no pasan por aqui: leen las respuestas tal cual (el limite a rango es solo para V3).
+# Un lote (lista o iterador de respuestas) se codifica en una sola pasada: una lista por campo y
+# despues todo con NumPy; solo un campo con valores raros (texto, None) cae al camino lento de clamp_float.
+#
+# FEATURES_VERSION va en la metadata de cada modelo publicado (apim.registry): subirla si cambian
+# campos, orden, escalas o rangos de forma que cambie lo que ve un modelo ya entrenado.
+# v1 = los vectorizadores que este modulo reemplaza (modelos publicados sin features_version en su metadata).
+# v2 = este encoder: dentro de rango da exactamente lo mismo que v1, pero valida y limita a rango lo demas.
+FEATURES_VERSION = 2
+
+# Campos numericos: (minimo, maximo, default, escala)
+NUMERIC_FEATURES: Dict[str, tuple] = {
+    "ahorro_mensual_pct": (0.0, 100.0, 0.0, 50.0),
+    "compras_impulsivas_sem": (0.0, 100.0, 0.0, 14.0),
+    "fondo_emergencia_meses": (0.0, 120.0, 0.0, 12.0),
+}
+# Perfiles V2 -> id de clase (salidas de los modelos V3 y bins de persona en drift); vive aqui y no en
+# apim.dojo para que quien solo necesita las etiquetas no cargue torch
+PROFILE_TO_ID: Dict[str, int] = {
+    "Comprador impulsivo": 0,
+    "Ahorrador disciplinado": 1,
+    "Genio financiero": 2,
+    "Jefe de jefes": 3,
+}
+
+FEATURE_KEYS = ("ahorro_mensual_pct", "compras_impulsivas_sem", "registra_gastos", "fondo_emergencia_meses")
+N_FEATURES = len(FEATURE_KEYS)
+
+
+# Una respuesta ya validada y limitada (valores sin escalar)
+def clean(respuestas: Mapping[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for key in FEATURE_KEYS:
+        if key in NUMERIC_FEATURES:
+            lo, hi, default, _ = NUMERIC_FEATURES[key]
+            out[key] = clamp_float(respuestas.get(key, default), lo, hi, default)
+        else:
+            out[key] = bool(respuestas.get(key, False))
+    return out
+
+
+# Una columna numerica validada y limitada; el camino rapido es la conversion de NumPy
+def _numeric_column(values: list, key: str) -> np.ndarray:
+    lo, hi, default, _ = NUMERIC_FEATURES[key]
+    try:
+        col = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        col = np.array([clamp_float(v, lo, hi, default) for v in values], dtype=np.float64)
+    if col.ndim != 1:
+        col = np.array([clamp_float(v, lo, hi, default) for v in values], dtype=np.float64)
+    col = np.where(np.isnan(col), default, col)
+    return np.clip(col, lo, hi)
+
+
+# Lote de respuestas -> columnas validadas y limitadas, sin escalar (float64; registra como bool)
+def raw_columns(batch: Iterable[Mapping[str, Any]]) -> Dict[str, np.ndarray]:
+    batch = batch if isinstance(batch, list) else list(batch)
+    cols: Dict[str, np.ndarray] = {}
+    for key in FEATURE_KEYS:
+        if key in NUMERIC_FEATURES:
+            default = NUMERIC_FEATURES[key][2]
+            cols[key] = _numeric_column([r.get(key, default) for r in batch], key)
+        else:
+            cols[key] = np.fromiter((bool(r.get(key, False)) for r in batch), dtype=bool, count=len(batch))
+    return cols
+
+
+# Columnas (de raw_columns, del export columnar o de un grid) -> matriz (n, 4) float32
+# Se vuelve a limitar: columnas de parts viejos no pasaron por la validacion.
+def encode_columns(cols: Mapping[str, Any]) -> np.ndarray:
+    n = max((np.size(v) for v in cols.values()), default=0)
+    X = np.empty((n, N_FEATURES), dtype=np.float32)
+    for j, key in enumerate(FEATURE_KEYS):
+        v = np.broadcast_to(np.asarray(cols.get(key, 0.0)), (n,))
+        if key in NUMERIC_FEATURES:
+            lo, hi, default, scale = NUMERIC_FEATURES[key]
+            v = v.astype(np.float64)
+            v = np.clip(np.where(np.isnan(v), default, v), lo, hi) / scale
+            X[:, j] = v
+        else:
+            X[:, j] = v.astype(bool)
+    return X
+
+
+# Lote de respuestas -> matriz (n, 4) float32
+def encode(batch: Iterable[Mapping[str, Any]]) -> np.ndarray:
+    return encode_columns(raw_columns(batch))
+
+
+# Una sola respuesta -> vector (4,) float32; mismos numeros que encode() sin el costo de armar columnas
+def encode_one(respuestas: Mapping[str, Any]) -> np.ndarray:
+    c = clean(respuestas)
+    return np.array(
+        [c[k] / NUMERIC_FEATURES[k][3] if k in NUMERIC_FEATURES else float(c[k]) for k in FEATURE_KEYS],
+        dtype=np.float32,
+    )
@@ -0,0 +1,245 @@
+from __future__ import annotations
+import bisect
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from apim import metrics
+from apim.dojo import predict_v3_batch
+
+# Servidor de inferencia V3 con micro-batching
+# (micro-batching = juntar las peticiones que llegan casi al mismo tiempo y resolverlas en un solo forward)
+# Muchas sesiones llamando predict_v3 a la vez hacen cada una su forward chiquito y se pelean los hilos de torch.
+# Aqui un solo hilo junta peticiones durante una ventana corta (o hasta max_batch), corre un forward
+# con predict_v3_batch (que usa el mismo cache que predict_v3) y resuelve el future de cada quien.
+#
+# Configuracion por entorno:
+#   APIM_V3_BATCH_WINDOW_MS=0.5 cuanto se espera a que lleguen mas peticiones despues de la primera
+#   APIM_V3_MAX_BATCH=64        tamaño maximo de un lote (si se llena, se corre sin esperar la ventana)
+#   APIM_V3_MAX_QUEUE=4096      peticiones en espera; si se llena, submit truena con queue.Full
+# Con 0 no se espera: cada lote se lleva lo que ya este en cola (bajo carga igual se forman lotes grandes).
+# predict() espera a lo mas PREDICT_TIMEOUT_S (un hilo del pipeline no se queda colgado si el servidor se atora).
+
+log = logging.getLogger(__name__)
+
+# Limites del histograma de tamaño de lote (el ultimo bucket es "mas grande que el ultimo limite")
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+PREDICT_TIMEOUT_S = 30.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class InferenceServer:
+    """
+    Cola de peticiones + un hilo que las resuelve por lotes.
+    - submit() regresa un Future; predict() espera el resultado (mismo dict que predict_v3).
+    - Si el forward truena, todos los futures del lote reciben la excepcion.
+    - Despues de close(), submit truena y lo que no alcanzo a correr recibe RuntimeError.
+    """
+    def __init__(self, window_ms: float = 0.5, max_batch: int = 64, max_queue: int = 4096):
+        self.window_ms = max(0.0, float(window_ms))
+        self.max_batch = max(1, int(max_batch))
+        self.max_queue = max(1, int(max_queue))
+        self._queue: "queue.Queue[Optional[Tuple[Dict[str, Any], Future, float]]]" = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "requests": 0,
+            "batches": 0,
+            "served": 0,
+            "errors": 0,
+            "max_depth": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "forward_ms_total": 0.0,
+            "batch_sizes": [0] * (len(BATCH_BUCKETS) + 1),
+        }
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="apim-v3-inference", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> "InferenceServer":
+        return cls(
+            window_ms=_env_float("APIM_V3_BATCH_WINDOW_MS", 0.5),
+            max_batch=int(_env_float("APIM_V3_MAX_BATCH", 64)),
+            max_queue=int(_env_float("APIM_V3_MAX_QUEUE", 4096)),
+        )
+
+    # Encola una prediccion; el Future se resuelve con el dict de predict_v3
+    # (revisar _closed y encolar van juntos con el lock: nada entra a la cola despues del aviso de cierre)
+    def submit(self, respuestas: Dict[str, Any]) -> Future:
+        fut: Future = Future()
+        item = (dict(respuestas), fut, time.perf_counter())
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("el servidor de inferencia ya esta cerrado")
+            self._queue.put_nowait(item)
+            self._stats["requests"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+        return fut
+
+    # Prediccion bloqueante (reemplazo directo de predict_v3 para hilos concurrentes)
+    def predict(self, respuestas: Dict[str, Any], timeout: Optional[float] = PREDICT_TIMEOUT_S) -> dict:
+        return self.submit(respuestas).result(timeout)
+
+    # Junta un lote: espera la primera peticion y despues las que lleguen dentro de la ventana
+    def _collect(self) -> Tuple[List[Tuple[Dict[str, Any], Future, float]], bool]:
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.perf_counter() + self.window_ms / 1000.0
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run_batch(self, batch: List[Tuple[Dict[str, Any], Future, float]]) -> None:
+        now = time.perf_counter()
+        waits = [(now - t) * 1000.0 for _, _, t in batch]
+        # Quien cancelo su future ya no espera respuesta
+        live = [(r, f) for r, f, _ in batch if f.set_running_or_notify_cancel()]
+
+        t0 = time.perf_counter()
+        error: Optional[BaseException] = None
+        if live:
+            try:
+                preds = predict_v3_batch([r for r, _ in live], use_cache=True)
+            except Exception as exc:
+                log.exception("inferencia V3: fallo el lote de %d", len(live))
+                error = exc
+        forward_ms = (time.perf_counter() - t0) * 1000.0
+
+        for i, (_, fut) in enumerate(live):
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(preds[i])
+
+        with self._lock:
+            s = self._stats
+            s["batches"] += 1
+            s["served"] += len(batch)
+            s["errors"] += 1 if error is not None else 0
+            s["wait_ms_total"] += sum(waits)
+            s["wait_ms_max"] = max(s["wait_ms_max"], max(waits))
+            s["forward_ms_total"] += forward_ms
+            s["batch_sizes"][bisect.bisect_left(BATCH_BUCKETS, len(batch))] += 1
+        for w in waits:
+            metrics.observe("v3_batch_wait", w / 1000.0)
+        metrics.incr("v3_batches")
+
+    def _worker(self) -> None:
+        while True:
+            batch, stop = self._collect()
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    # Resuelve lo pendiente y detiene el hilo; si algo quedo en la cola (el hilo ya no corre), falla su future
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and not item[1].done():
+                item[1].set_exception(RuntimeError("el servidor de inferencia se cerro antes de resolver la peticion"))
+
+    # Metricas: profundidad de cola, histograma de tamaño de lote y espera en cola
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            sizes = list(self._stats["batch_sizes"])
+        labels = [str(b) for b in BATCH_BUCKETS] + [f">{BATCH_BUCKETS[-1]}"]
+        s["batch_sizes"] = dict(zip(labels, sizes))
+        s["depth"] = self._queue.qsize()
+        s["avg_batch"] = s["served"] / s["batches"] if s["batches"] else 0.0
+        s["avg_wait_ms"] = s["wait_ms_total"] / s["served"] if s["served"] else 0.0
+        s["window_ms"] = self.window_ms
+        s["max_batch"] = self.max_batch
+        return s
+
+
+_server: Dict[str, Optional[InferenceServer]] = {"server": None}
+_server_lock = threading.Lock()
+
+
+# Servidor compartido del proceso (se crea con la configuracion del entorno la primera vez)
+def get_server() -> InferenceServer:
+    with _server_lock:
+        if _server["server"] is None:
+            _server["server"] = InferenceServer.from_env()
+        return _server["server"]
+
+
+# Benchmark: N hilos pidiendo predicciones distintas (sin cache) directo vs por el servidor
+def _bench(n: int, threads: List[int]) -> None:
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    from apim import dojo
+
+    rng = random.Random(0)
+    reqs = [
+        {
+            "ahorro_mensual_pct": rng.randint(0, 50),
+            "compras_impulsivas_sem": rng.randint(0, 50),
+            "registra_gastos": rng.random() < 0.5,
+            "fondo_emergencia_meses": rng.randint(0, 12) + rng.random(),
+        }
+        for _ in range(n)
+    ]
+    if not dojo.predict_v3(reqs[0]).get("ok"):
+        print("bench: no hay modelo V3 entrenado")
+        return
+
+    for k in threads:
+        for name in ("directo", "servidor"):
+            dojo.clear_prediction_cache()
+            server = InferenceServer.from_env() if name == "servidor" else None
+            fn = server.predict if server else dojo.predict_v3
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=k) as pool:
+                list(pool.map(fn, reqs))
+            dt = time.perf_counter() - t0
+            extra = ""
+            if server:
+                s = server.stats()
+                server.close()
+                extra = f" | lote promedio={s['avg_batch']:.1f} | espera promedio={s['avg_wait_ms']:.2f} ms"
+            print(f"{k:>3} hilos | {name:<8} | {n / dt:>9,.0f} pred/s{extra}")
+
+
+# Punto de entrada para medir el servidor desde terminal
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del servidor de micro-batching V3")
+    parser.add_argument("--bench", type=int, default=20000, help="numero de predicciones")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16, 64], help="hilos concurrentes")
+    args = parser.parse_args()
+    _bench(args.bench, args.threads)
@@ -1,9 +1,16 @@
 from __future__ import annotations
+import hashlib
+import heapq
 import json
+import re
 from dataclasses import asdict, is_dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from apim import sharding, storage
+from apim.metrics import timed
+from apim.rules import RULES_VERSION, compute_zone
 
 # Ubicacion del proyecto
 def _project_root() -> Path:
@@ -16,19 +23,49 @@ def _project_root() -> Path:
 # Carpeta datos
 def _data_dir() -> Path:
 
-    # Apunta a la carpeta /data
-    d = _project_root() / "data"
+    # La misma carpeta Data/ del motor de almacenamiento (lo que habia en data/ se mueve solo)
+    storage._ready()
+    d = storage.DATA_DIR
 
     # Si no existe, la crea automaticamente
     d.mkdir(parents=True, exist_ok=True)
 
     return d
 
+# Memoria por usuario, repartida por hash en shards (ver apim.sharding):
+# Data/memory/shards.json, Data/memory/shard-03/<user_id>.json
+# Sin user_id se usa la memoria unica de siempre (Data/apim_memory.json).
+def _memory_dir() -> Path:
+    _data_dir()
+    return storage.namespace_dir("memory")
+
+# Archivos propios de la carpeta de memoria que un usuario no puede pisar
+# (se compara sin mayusculas: en Windows "Shards.json" es el mismo archivo)
+RESERVED_FILE_NAMES = {sharding.SHARD_MAP_NAME.lower()}
+
+# Nombre de archivo seguro para un user_id (si trae caracteres raros o choca con un reservado, su hash)
+def _user_file_name(user_id: str) -> str:
+    name = f"{user_id}.json"
+    if (
+        re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", user_id)
+        and not user_id.startswith(".")
+        and name.lower() not in RESERVED_FILE_NAMES
+    ):
+        return name
+    return hashlib.blake2b(user_id.encode("utf-8"), digest_size=16).hexdigest() + ".json"
+
 # Ruta del archivo de memoria
-def _memory_path() -> Path:
+def _memory_path(user_id: Optional[str] = None) -> Path:
+
+    # Data/apim_memory.json
+    if user_id is None:
+        return _data_dir() / "apim_memory.json"
 
-    # data/apim_memory.json
-    return _data_dir() / "apim_memory.json"
+    # Data/memory/<shard>/<user_id>.json
+    base = _memory_dir()
+    n = sharding.load_map(base)["n_shards"]
+    shard = sharding.shard_name(sharding.shard_of(user_id, n), n)
+    return (base / shard if shard else base) / _user_file_name(user_id)
 
 
 # Primer uso de la memoria base 
@@ -80,17 +117,20 @@ def _json_safe(obj: Any) -> Any:
 
 
 # Cargar memoria
-def load_memory() -> Dict[str, Any]:
+@timed("memory_json.load_memory")
+def load_memory(user_id: Optional[str] = None) -> Dict[str, Any]:
     """
-    Carga la memoria desde data/apim_memory.json.
+    Carga la memoria desde Data/apim_memory.json (o la del usuario, en su shard).
     Si no existe (primer uso), la crea automaticamente.
     """
-    path = _memory_path()
+    path = _memory_path(user_id)
 
     # Primer uso: no existe el archivo
     if not path.exists():
         memory = _default_memory()
-        save_memory(memory)
+        if user_id is not None:
+            memory["user"]["id"] = user_id
+        save_memory(memory, user_id)
         return memory
 
     # Intentamos leer el archivo
@@ -107,7 +147,9 @@ def load_memory() -> Dict[str, Any]:
 
         # Se crea una memoria nueva
         memory = _default_memory()
-        save_memory(memory)
+        if user_id is not None:
+            memory["user"]["id"] = user_id
+        save_memory(memory, user_id)
         return memory
 
     # Si faltan llaves (compatibilidad futura)
@@ -115,8 +157,11 @@ def load_memory() -> Dict[str, Any]:
     return memory
 
 # Guardar memoria
-def save_memory(memory: Dict[str, Any]) -> None:
-    path = _memory_path()
+@timed("memory_json.save_memory")
+def save_memory(memory: Dict[str, Any], user_id: Optional[str] = None) -> None:
+    path = _memory_path(user_id)
+    if user_id is not None:
+        memory.setdefault("user", {})["id"] = user_id
 
     # Actualiza fecha de modificacion
     memory["updated_at"] = datetime.now().isoformat()
@@ -124,15 +169,18 @@ def save_memory(memory: Dict[str, Any]) -> None:
     # Asegura estructura completa
     memory = _ensure_schema(memory)
 
-    # Escribe el archivo json
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(
-            memory,
-            f,
-            ensure_ascii=False,
-            indent=2,
-            default=_json_safe
-        )
+    _write_memory_file(path, memory)
+
+# Escribe el json por el motor de almacenamiento (temporal + os.replace, con journal):
+# un corte a media escritura no deja la memoria rota, y dentro de storage.batch() va en el mismo fsync
+def _write_memory_file(path: Path, memory: Dict[str, Any]) -> None:
+    text = json.dumps(
+        memory,
+        ensure_ascii=False,
+        indent=2,
+        default=_json_safe
+    )
+    storage.write_doc(path, text)
 
 # Si el json viene incompleto, rellena lo que falte sin borrar datos existentes.
 def _ensure_schema(memory: Dict[str, Any]) -> Dict[str, Any]:
@@ -163,6 +211,11 @@ def add_event(memory: Dict[str, Any], event: Dict[str, Any]) -> None:
     e.setdefault("emotion", "")
 
     memory.setdefault("events", [])
+
+    # La zona se calcula una vez, al insertar (la tendencia depende de la ventana del reporte)
+    e["zone"] = compute_zone(e)
+    e["rules_version"] = RULES_VERSION
+
     memory["events"].append(e)
 
 
@@ -173,3 +226,75 @@ def clear_events(memory: Dict[str, Any]) -> None:
 # Devuelve copia de los eventos
 def get_events(memory: Dict[str, Any]) -> list[Dict[str, Any]]:
     return list(memory.get("events", []))
+
+
+# ===== Shards de memoria =====
+
+# Todos los archivos de memoria por usuario, esten en el shard que esten
+def _user_files() -> List[Path]:
+    base = _memory_dir()
+    if not base.exists():
+        return []
+    files = sorted(base.glob("*.json")) + sorted(base.glob("shard-*/*.json"))
+    return [p for p in files if p.name != sharding.SHARD_MAP_NAME]
+
+# Archivos de memoria para procesos batch: la memoria unica (si existe) + las de cada usuario
+def list_memory_files() -> List[Path]:
+    legacy = _memory_path()
+    return ([legacy] if legacy.exists() else []) + _user_files()
+
+# Carga/guarda una memoria por ruta (procesos batch que reparten archivos entre workers)
+def load_memory_file(path: Path) -> Dict[str, Any]:
+    with Path(path).open("r", encoding="utf-8") as f:
+        return _ensure_schema(json.load(f))
+
+def save_memory_file(path: Path, memory: Dict[str, Any]) -> None:
+    memory["updated_at"] = datetime.now().isoformat()
+    _write_memory_file(Path(path), _ensure_schema(memory))
+
+def _read_user_file(path: Path) -> Tuple[str, Dict[str, Any]]:
+    memory = load_memory_file(path)
+    return memory["user"].get("id") or path.stem, memory
+
+# (nombre de archivo, user_id, memoria) de un shard, en orden de nombre de archivo
+def _iter_shard_dir(folder: Path) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    for path in sorted(folder.glob("*.json")):
+        if path.name == sharding.SHARD_MAP_NAME:
+            continue
+        try:
+            yield (path.name, *_read_user_file(path))
+        except (json.JSONDecodeError, OSError):
+            continue
+
+# Recorre (user_id, memoria) de todos los shards, mezclados por nombre de archivo (orden estable
+# sin importar cuantos shards haya; para analitica global)
+def iter_memories() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    base = _memory_dir()
+    n = sharding.load_map(base)["n_shards"]
+    folders = [base / sharding.shard_name(i, n) if n > 1 else base for i in range(n)]
+    for _, user_id, memory in heapq.merge(*(_iter_shard_dir(f) for f in folders), key=lambda item: item[0]):
+        yield user_id, memory
+
+# Reparte las memorias por usuario en n_shards (herramienta offline; se puede repetir si se corta)
+def rebalance(n_shards: int) -> Dict[str, Any]:
+    base = _memory_dir()
+    n_shards = max(1, int(n_shards))
+    moved = 0
+    # El journal no debe apuntar a archivos que se van a mover
+    storage.checkpoint()
+    files = _user_files()
+    for path in files:
+        try:
+            user_id, _ = _read_user_file(path)
+        except (json.JSONDecodeError, OSError):
+            continue
+        shard = sharding.shard_name(sharding.shard_of(user_id, n_shards), n_shards)
+        dst = (base / shard if shard else base) / _user_file_name(user_id)
+        if dst != path:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            path.replace(dst)
+            moved += 1
+
+    # El mapa se cambia al final: si se corta a medias, volver a correr termina de mover
+    new_map = sharding.save_map(base, n_shards)
+    return {"users": len(files), "moved": moved, "n_shards": new_map["n_shards"]}
@@ -0,0 +1,207 @@
+from __future__ import annotations
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Metricas de latencia por etapa
+# (histograma = cuantas llamadas cayeron en cada rango de tiempo)
+# Se activan con APIM_METRICS=1 (o enable()). Apagadas, cada llamada solo revisa un booleano.
+# Se exportan cada cierto tiempo a texto Prometheus y a JSON.
+
+ROOT = Path(__file__).resolve().parents[1]
+PROM_PATH = ROOT / "Data" / "metrics.prom"
+JSON_PATH = ROOT / "Data" / "metrics.json"
+
+# Limites de los buckets en segundos (estilo Prometheus; el ultimo es +Inf)
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+_enabled = os.environ.get("APIM_METRICS", "").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+_histograms: Dict[str, Dict[str, Any]] = {}
+_counters: Dict[str, int] = {}
+_collectors: List[Callable[[], Dict[str, float]]] = []
+_exporter: Dict[str, Any] = {"thread": None, "stop": None}
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(flag: bool = True) -> None:
+    global _enabled
+    _enabled = flag
+
+
+# Registra una duracion (segundos) en el histograma de la etapa
+def observe(stage: str, seconds: float) -> None:
+    if not _enabled:
+        return
+    i = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        h = _histograms.get(stage)
+        if h is None:
+            h = {"counts": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0, "max": 0.0}
+            _histograms[stage] = h
+        h["counts"][i] += 1
+        h["sum"] += seconds
+        h["count"] += 1
+        if seconds > h["max"]:
+            h["max"] = seconds
+
+
+# Suma a un contador (ej. errores, cache hits)
+def incr(name: str, n: int = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+# Decorador: mide latencia y numero de llamadas de una funcion
+def timed(stage: str) -> Callable:
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+# Funcion que regresa gauges {nombre: valor} al momento de exportar (ej. profundidad de cola)
+def register_collector(fn: Callable[[], Dict[str, float]]) -> None:
+    with _lock:
+        if fn not in _collectors:
+            _collectors.append(fn)
+
+
+def _collect_gauges() -> Dict[str, float]:
+    gauges: Dict[str, float] = {}
+    for fn in list(_collectors):
+        try:
+            gauges.update({k: float(v) for k, v in fn().items()})
+        except Exception:
+            continue
+    return gauges
+
+
+# Copia de todo lo medido hasta ahora
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        stages = {
+            name: {
+                "count": h["count"],
+                "sum": h["sum"],
+                "avg": h["sum"] / h["count"] if h["count"] else 0.0,
+                "max": h["max"],
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h["counts"])),
+            }
+            for name, h in _histograms.items()
+        }
+        counters = dict(_counters)
+    return {
+        "ts": time.time(),
+        "enabled": _enabled,
+        "stages": stages,
+        "counters": counters,
+        "gauges": _collect_gauges(),
+    }
+
+
+# Limpia todo (para pruebas)
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _prom_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+# Formato de texto de Prometheus (se puede leer con el textfile collector de node_exporter)
+def render_prometheus(snap: Optional[Dict[str, Any]] = None) -> str:
+    snap = snap or snapshot()
+    lines = [
+        "# HELP apim_stage_duration_seconds Latencia por etapa.",
+        "# TYPE apim_stage_duration_seconds histogram",
+    ]
+    for stage, h in sorted(snap["stages"].items()):
+        cumulative = 0
+        for le, n in h["buckets"].items():
+            cumulative += n
+            lines.append(f'apim_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'apim_stage_duration_seconds_sum{{stage="{stage}"}} {h["sum"]:.9f}')
+        lines.append(f'apim_stage_duration_seconds_count{{stage="{stage}"}} {h["count"]}')
+
+    if snap["counters"]:
+        lines.append("# TYPE apim_events_total counter")
+        for name, n in sorted(snap["counters"].items()):
+            lines.append(f'apim_events_total{{name="{name}"}} {n}')
+
+    for name, v in sorted(snap["gauges"].items()):
+        metric = f"apim_{_prom_name(name)}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {v}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Escribe a un temporal y reemplaza, para que quien lea nunca vea un archivo a medias
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# Exporta una vez a Prometheus + JSON
+def export(prom_path: Optional[Path] = None, json_path: Optional[Path] = None) -> None:
+    snap = snapshot()
+    _write_atomic(prom_path or PROM_PATH, render_prometheus(snap))
+    _write_atomic(json_path or JSON_PATH, json.dumps(snap, ensure_ascii=False, indent=2))
+
+
+# Hilo que exporta cada `interval` segundos (no hace nada si las metricas estan apagadas)
+def start_exporter(
+    interval: float = 15.0,
+    prom_path: Optional[Path] = None,
+    json_path: Optional[Path] = None,
+) -> bool:
+    if not _enabled:
+        return False
+    with _lock:
+        if _exporter["thread"] is not None:
+            return True
+        stop = threading.Event()
+
+        def loop() -> None:
+            while not stop.wait(interval):
+                try:
+                    export(prom_path, json_path)
+                except OSError:
+                    continue
+
+        t = threading.Thread(target=loop, name="apim-metrics-exporter", daemon=True)
+        _exporter["thread"], _exporter["stop"] = t, stop
+    t.start()
+    return True
+
+
+def stop_exporter() -> None:
+    with _lock:
+        t, stop = _exporter["thread"], _exporter["stop"]
+        _exporter["thread"] = _exporter["stop"] = None
+    if t is not None:
+        stop.set()
+        t.join()
@@ -0,0 +1,235 @@
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from apim import drift, metrics, storage, tracing
+from apim.dojo import predict_v3
+from apim.inference import InferenceServer
+from apim.sampling import ShadowSampler
+from apim.storage import save_run, save_shadow, save_trace
+
+# Pipeline post-submit en segundo plano
+# Despues de clasificar, la app solo encola el trabajo y sigue pintando resultados.
+# Un hilo aparte hace: guardar corrida -> prediccion V3 (shadow) -> guardar shadow.
+# El shadow se muestrea y tiene presupuesto de latencia (ver apim.sampling).
+# Con varios hilos de trabajo, la prediccion puede ir por el servidor de micro-batching (apim.inference).
+# Cada corrida escrita actualiza los histogramas del monitor de drift (apim.drift).
+# Corrida, shadow y traza de un trabajo van en un solo lote de storage: un fsync por submit.
+# (backpressure = que hacer cuando llega mas trabajo del que el hilo alcanza a procesar)
+
+log = logging.getLogger(__name__)
+
+STAGES = ("save_run", "predict_v3", "save_shadow", "save_trace", "commit")
+
+
+class PostSubmitPipeline:
+    """
+    Cola acotada + hilos de trabajo.
+    - Si la cola esta llena, la corrida se guarda en el mismo hilo (no se pierde) y el shadow se omite.
+    - Los errores se cuentan por etapa en lugar de tragarse en silencio.
+    - El shadow solo corre para las corridas que elige el sampler y dentro de su presupuesto.
+    - Con `inference`, las predicciones de todos los hilos se juntan en lotes (un forward por lote).
+    """
+    def __init__(
+        self,
+        max_queue: int = 256,
+        workers: int = 1,
+        sampler: Optional[ShadowSampler] = None,
+        inference: Optional[InferenceServer] = None,
+    ):
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "submitted": 0,
+            "processed": 0,
+            "overflow": 0,
+            "max_depth": 0,
+            "errors": {stage: 0 for stage in STAGES},
+            "last_error": None,
+            "wait_ms_total": 0.0,
+            "shadow_sampled": 0,
+            "shadow_skipped": 0,
+            "shadow_over_budget": 0,
+        }
+        self.max_queue = max_queue
+        self.sampler = sampler or ShadowSampler.from_env()
+        self.inference = inference
+        drift.install()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"apim-post-submit-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    # Encola el trabajo de una corrida ya clasificada. Regresa un Future de ese trabajo: se resuelve con
+    # True cuando la corrida quedo guardada (False si fallo), para esperar solo a esta corrida.
+    # Con la cola llena se degrada: la corrida se guarda aqui mismo y el Future ya viene resuelto.
+    # Si viene una traza, el hilo de trabajo le agrega sus spans y la guarda al terminar.
+    # `ts` es el momento del submit: la corrida queda con ese ts aunque se escriba despues que su traza.
+    def submit(
+        self,
+        run_id: str,
+        respuestas: Dict[str, Any],
+        result: Any,
+        trace: Optional[tracing.Trace] = None,
+        session_id: Optional[str] = None,
+        ts: Optional[str] = None,
+    ) -> Future:
+        done: Future = Future()
+        job = {
+            "run_id": run_id,
+            "session_id": session_id,
+            "ts": ts,
+            "respuestas": dict(respuestas),
+            "result": result,
+            "trace": trace,
+            "enqueued_at": time.perf_counter(),
+            "done": done,
+        }
+        with self._lock:
+            self._stats["submitted"] += 1
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._stats["overflow"] += 1
+            # La corrida si se guarda (la necesita el feedback); el shadow es prescindible
+            with tracing.activate(trace):
+                ok, _ = self._run_stage(
+                    "save_run",
+                    lambda: save_run(respuestas, result, run_id=run_id, session_id=session_id, ts=ts),
+                )
+            self._finish_trace(trace, session_id)
+            done.set_result(ok)
+            return done
+
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth)
+        return done
+
+    # Corre una etapa (como span de la traza activa) y cuenta el error si falla; regresa (ok, valor)
+    def _run_stage(self, stage: str, fn: Callable[[], Any]) -> tuple[bool, Any]:
+        try:
+            with tracing.span(stage):
+                return True, fn()
+        except Exception as exc:
+            log.exception("post-submit: fallo la etapa %s", stage)
+            with self._lock:
+                self._stats["errors"][stage] += 1
+                self._stats["last_error"] = f"{stage}: {type(exc).__name__}: {exc}"
+            return False, None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+        metrics.incr(name)
+
+    # Regresa True si el shadow quedo en el lote (el sampler lo cuenta hasta que el commit pasa)
+    # job["saved"] queda en True si la corrida entro al lote
+    def _process(self, job: Dict[str, Any]) -> bool:
+        run_id = job["run_id"]
+        session_id = job["session_id"]
+        respuestas = job["respuestas"]
+        result = job["result"]
+        persona = getattr(result, "persona", None)
+
+        ok, _ = self._run_stage(
+            "save_run",
+            lambda: save_run(respuestas, result, run_id=run_id, session_id=session_id, ts=job["ts"]),
+        )
+        if not ok:
+            return False
+        job["saved"] = True
+
+        sample = self.sampler.decide(persona)
+        if sample is None:
+            self._count("shadow_skipped")
+            return False
+
+        # Si la corrida ya espero en cola mas que el presupuesto, ni se intenta la inferencia
+        if self.sampler.over_budget((time.perf_counter() - job["enqueued_at"]) * 1000.0):
+            self._count("shadow_over_budget")
+            return False
+
+        # Prediccion silenciosa V3 en modo shadow
+        predict = self.inference.predict if self.inference is not None else predict_v3
+        ok, v3_pred = self._run_stage("predict_v3", lambda: predict(respuestas))
+        if not ok:
+            return False
+
+        # Una prediccion que llego tarde se descarta (no se puede interrumpir a medias)
+        if self.sampler.over_budget((time.perf_counter() - job["enqueued_at"]) * 1000.0):
+            self._count("shadow_over_budget")
+            return False
+
+        self._count("shadow_sampled")
+        ok, _ = self._run_stage(
+            "save_shadow",
+            lambda: save_shadow(run_id, v3_pred, v2_persona=persona, sample=sample, session_id=session_id),
+        )
+        return ok
+
+    # Guarda la traza (si hay); un fallo aqui no debe tumbar el pipeline
+    def _finish_trace(self, trace: Optional[tracing.Trace], session_id: Optional[str] = None) -> None:
+        if trace is not None:
+            self._run_stage("save_trace", lambda: save_trace(trace.to_record(), session_id=session_id))
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            committed = False
+            try:
+                if job is None:
+                    return
+                now = time.perf_counter()
+                wait_ms = (now - job["enqueued_at"]) * 1000.0
+                with self._lock:
+                    self._stats["wait_ms_total"] += wait_ms
+
+                trace = job["trace"]
+                if trace is not None:
+                    trace.add("queue_wait", job["enqueued_at"], now)
+                # Las etapas save_* solo encolan en el lote; la escritura real (y su error) es la etapa commit
+                with storage.batch() as b:
+                    with tracing.activate(trace):
+                        shadow = self._process(job)
+                    self._finish_trace(trace, job["session_id"])
+                    committed, _ = self._run_stage("commit", b.commit)
+                if shadow and committed:
+                    self.sampler.record(getattr(job["result"], "persona", None))
+
+                with self._lock:
+                    self._stats["processed"] += 1
+            finally:
+                if job is not None:
+                    job["done"].set_result(committed and job.get("saved", False))
+                self._queue.task_done()
+
+    # Espera a que se vacie toda la cola (para pruebas o antes de apagar; para una corrida, su Future)
+    def drain(self) -> None:
+        self._queue.join()
+
+    # Detiene los hilos despues de procesar lo pendiente
+    def close(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    # Metricas: profundidad de cola, overflow (backpressure), errores por etapa
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s["errors"] = dict(self._stats["errors"])
+        s["depth"] = self._queue.qsize()
+        s["max_queue"] = self.max_queue
+        s["avg_wait_ms"] = (s["wait_ms_total"] / s["processed"]) if s["processed"] else 0.0
+        s["sampler"] = self.sampler.config()
+        return s
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Registro de modelos V3
+# (registry = carpeta con versiones inmutables del modelo + un puntero "CURRENT" a la version activa)
+#
+# Data/models/
+#   CURRENT                      -> texto con la version activa
+#   20261019T120000000000Z-1a2b3c/
+#       dojo_v3.pt               -> state_dict de torch
+#       dojo_v3.npz              -> pesos para serving solo NumPy
+#       meta.json                -> n, last_loss, tiempo de entrenamiento, version de features...
+
+ROOT = Path(__file__).resolve().parents[1]
+REGISTRY_DIR = ROOT / "Data" / "models"
+
+CURRENT_FILE = "CURRENT"
+META_FILE = "meta.json"
+_STAGING_PREFIX = ".staging-"
+
+# Ultima lectura del puntero: (mtime_ns, inode) -> version, para no releer el archivo en cada prediccion
+_current_cache: Dict[str, Any] = {"stat": None, "version": None}
+_current_lock = threading.Lock()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _pointer_path() -> Path:
+    return REGISTRY_DIR / CURRENT_FILE
+
+
+# Nombre de version ordenable por fecha + sufijo corto para que no choquen
+def _new_version() -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return f"{stamp}-{uuid.uuid4().hex[:6]}"
+
+
+# Carpeta de una version publicada
+def version_dir(version: str) -> Path:
+    return REGISTRY_DIR / version
+
+
+# Crea una carpeta temporal donde el entrenador escribe sus archivos antes de publicar
+def stage_version() -> Tuple[str, Path]:
+    version = _new_version()
+    staging = REGISTRY_DIR / f"{_STAGING_PREFIX}{version}"
+    staging.mkdir(parents=True, exist_ok=False)
+    return version, staging
+
+
+# Escribe texto a un temporal y lo cambia de lugar de un golpe (os.replace es atomico)
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:6]}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# Cambia el puntero CURRENT a otra version
+def _set_current(version: str) -> None:
+    _atomic_write_text(_pointer_path(), version + "\n")
+
+
+# Publica una version: guarda metadata, la vuelve inmutable y mueve el puntero
+def publish(version: str, staging: Path, meta: Dict[str, Any], make_current: bool = True) -> Path:
+    meta = dict(meta)
+    meta["version"] = version
+    meta.setdefault("published_at", _now_iso())
+    meta["files"] = sorted(p.name for p in staging.iterdir())
+
+    (staging / META_FILE).write_text(
+        json.dumps(meta, ensure_ascii=False, indent=2),
+        encoding="utf-8"
+    )
+
+    # Renombrar la carpeta completa: nadie ve una version a medias
+    final = version_dir(version)
+    os.replace(staging, final)
+
+    if make_current:
+        _set_current(version)
+    return final
+
+
+# Si el entrenamiento falla a medias, tiramos la carpeta temporal
+def discard(staging: Path) -> None:
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+# Version activa (None si el registro aun no tiene modelos)
+def current_version() -> Optional[str]:
+    pointer = _pointer_path()
+    try:
+        st = pointer.stat()
+    except FileNotFoundError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_ino, st.st_size)
+    with _current_lock:
+        if _current_cache["stat"] == key:
+            return _current_cache["version"]
+
+    version = pointer.read_text(encoding="utf-8").strip() or None
+    with _current_lock:
+        _current_cache["stat"] = key
+        _current_cache["version"] = version
+    return version
+
+
+# Ruta a un archivo de la version activa (o de una version dada)
+def artifact_path(name: str, version: Optional[str] = None) -> Optional[Path]:
+    version = version or current_version()
+    if not version:
+        return None
+    return version_dir(version) / name
+
+
+# Lista versiones publicadas, de la mas vieja a la mas nueva
+def list_versions() -> List[str]:
+    if not REGISTRY_DIR.exists():
+        return []
+    return sorted(
+        p.name for p in REGISTRY_DIR.iterdir()
+        if p.is_dir() and not p.name.startswith(".") and (p / META_FILE).exists()
+    )
+
+
+# Metadata de una version
+def read_meta(version: str) -> Dict[str, Any]:
+    path = version_dir(version) / META_FILE
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Regresa a una version anterior (por defecto, la publicada justo antes de la activa)
+def rollback(version: Optional[str] = None) -> Dict[str, Any]:
+    versions = list_versions()
+    current = current_version()
+
+    if version is None:
+        older = [v for v in versions if current is None or v < current]
+        if not older:
+            return {"ok": False, "reason": "no_previous_version", "current": current}
+        version = older[-1]
+
+    if version not in versions:
+        return {"ok": False, "reason": "unknown_version", "version": version}
+
+    _set_current(version)
+    return {"ok": True, "previous": current, "current": version}
+
+
+# Punto de entrada: python -m apim.registry [list|rollback [version]]
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    if args and args[0] == "rollback":
+        print(rollback(args[1] if len(args) > 1 else None))
+    else:
+        current = current_version()
+        for v in list_versions():
+            meta = read_meta(v)
+            mark = "*" if v == current else " "
+            print(f"{mark} {v} | n={meta.get('n')} | last_loss={meta.get('last_loss')} | features=v{meta.get('features_version')}")
@@ -1,10 +1,13 @@
 from __future__ import annotations
+import csv
+import json
+import sys
 from datetime import datetime
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
 
 # Importamos la logica
-from apim_vi.rules import (
-    compute_zone,
+from apim.rules import (
+    cached_zone,
     compute_trend,
     build_feedback,
     ZONE_GREEN,
@@ -42,8 +45,8 @@ def _make_rows(events: List[Dict[str, Any]]) -> List[Dict[str, str]]:
 
     for e in events:
 
-        # Zona por evento
-        z = compute_zone(e)
+        # Zona por evento (la guardada al insertar; solo se recalcula si cambiaron las reglas)
+        z = cached_zone(e)
 
         # Tendencia dentro del reporte (comparando evento anterior)
         t = compute_trend(prev_zone, z) if prev_zone else "➖"
@@ -102,58 +105,107 @@ def _overall_trend(memory: Dict[str, Any], overall_zone: str) -> str:
 
     return compute_trend(prev_zone, overall_zone)
 
+# ===== Render =====
+# Todo se escribe a un solo stream (archivo, stdout o io.StringIO) en bloques, no print por linea.
+# Formatos: "table" (texto con anchos fijos), "csv" y "jsonl" (una fila por linea, para otras herramientas).
+
+ROW_FIELDS = ["date", "event", "amount", "context", "emotion", "zone", "trend"]
+TABLE_HEADERS = ["Fecha", "Evento", "Monto", "Contexto", "Emoción", "Zona", "Tend."]
+TABLE_WIDTHS = [10, 24, 10, 18, 12, 4, 5]
+FORMATS = ("table", "csv", "jsonl")
+
+# Filas que se juntan antes de escribir al stream
+_WRITE_BATCH = 1024
+
+
+# Corta texto largo para que no rompa la tabla
+def _cut(text: str, width: int) -> str:
+    t = text or ""
+    if len(t) > width:
+        t = t[: width - 1] + "…"
+    return f"{t:<{width}}"
+
+
+def _write_batched(out: TextIO, lines: Iterable[str]) -> None:
+    buf: List[str] = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= _WRITE_BATCH:
+            out.write("".join(buf))
+            buf.clear()
+    if buf:
+        out.write("".join(buf))
+
+
+_FIELD_WIDTHS = list(zip(ROW_FIELDS, TABLE_WIDTHS))
+
+
+# Tabla de texto (mismo formato que la impresion de siempre)
+def render_table(rows: Iterable[Dict[str, str]], out: TextIO) -> None:
+    header = " | ".join(_cut(h, w) for h, w in zip(TABLE_HEADERS, TABLE_WIDTHS))
+    sep = "-+-".join("-" * w for w in TABLE_WIDTHS)
+    out.write(f"\n{header}\n{sep}\n")
+
+    # Mismo corte que _cut, en linea (es el loop caliente con miles de filas)
+    _write_batched(out, (
+        " | ".join([
+            (r[f] or "").ljust(w) if len(r[f] or "") <= w else r[f][: w - 1] + "…"
+            for f, w in _FIELD_WIDTHS
+        ]) + "\n"
+        for r in rows
+    ))
+
+
+def write_csv(rows: Iterable[Dict[str, str]], out: TextIO) -> None:
+    writer = csv.DictWriter(out, fieldnames=ROW_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_jsonl(rows: Iterable[Dict[str, str]], out: TextIO) -> None:
+    _write_batched(out, (json.dumps(r, ensure_ascii=False) + "\n" for r in rows))
+
+
+# Filas en el formato pedido
+def render_rows(rows: Iterable[Dict[str, str]], out: TextIO, fmt: str = "table") -> None:
+    if fmt == "table":
+        render_table(rows, out)
+    elif fmt == "csv":
+        write_csv(rows, out)
+    elif fmt == "jsonl":
+        write_jsonl(rows, out)
+    else:
+        raise ValueError(f"formato desconocido: {fmt} (opciones: {', '.join(FORMATS)})")
+
+
+# Resumen semanal como texto (para el formato tabla)
+def render_summary(snapshot: Dict[str, Any], out: TextIO) -> None:
+    counts = snapshot["counts"]
+    out.write(
+        "\n📌 Resumen semanal\n"
+        f"- Eventos analizados: {snapshot['n_events']}\n"
+        f"- Conteo zonas: 🟢{counts['green']}  🟡{counts['yellow']}  🔴{counts['red']}\n"
+        f"- Zona global: {snapshot['overall_zone']}\n"
+        f"- Tendencia: {snapshot['overall_trend']}\n"
+        f"- Insight: {snapshot['insight']}\n"
+        f"- Sugerencia: {snapshot['suggestion']}\n"
+    )
+
+
 # Impresion de tabla 
 def _print_table(rows: List[Dict[str, str]]) -> None:
+    render_table(rows, sys.stdout)
 
-    # Encabezados y anchos fijos 
-    headers = ["Fecha", "Evento", "Monto", "Contexto", "Emoción", "Zona", "Tend."]
-    col_widths = [10, 24, 10, 18, 12, 4, 5]
-
-    # Corta texto largo para que no rompa la tabla
-    def cut(text: str, width: int) -> str:
-        t = (text or "")
-        if len(t) <= width:
-            return t.ljust(width)
-        return (t[: width - 1] + "…").ljust(width)
-
-    # Linea de encabezado
-    line = " | ".join(h.ljust(w) for h, w in zip(headers, col_widths))
-    sep = "-+-".join("-" * w for w in col_widths)
-
-    print("\n" + line)
-    print(sep)
-
-    # Filas
-    for r in rows:
-        print(" | ".join([
-            cut(r["date"], col_widths[0]),
-            cut(r["event"], col_widths[1]),
-            cut(r["amount"], col_widths[2]),
-            cut(r["context"], col_widths[3]),
-            cut(r["emotion"], col_widths[4]),
-            cut(r["zone"], col_widths[5]),
-            cut(r["trend"], col_widths[6]),
-        ]))
-
-
-# Usa los últimos N eventos, imprime tabla + resumen, ademas, guarda snapshot si se pide para generar el reporte semanal 
-def weekly_report(
-    memory: Dict[str, Any],
-    n_events: int = 5,
-    save_snapshot: bool = True
-) -> Dict[str, Any]:
+
+# Calcula el reporte semanal sin imprimir nada (lo usan weekly_report y el batch de reportes)
+def build_weekly_report(memory: Dict[str, Any], n_events: int = 5) -> Dict[str, Any]:
 
     events = _last_n_events(memory, n=n_events)
     if not events:
-        print("\n📊 APIM VI — Reporte semanal")
-        print("No hay eventos registrados aún.")
         return {"ok": False, "reason": "no_events"}
 
-    # Construimos filas y mostramos tabla
+    # Filas, zona y tendencia global
     rows = _make_rows(events)
-    _print_table(rows)
-
-    # Zona y tendencia global
     overall_zone = _overall_zone(rows)
     overall_trend = _overall_trend(memory, overall_zone)
 
@@ -161,15 +213,6 @@ def weekly_report(
     fb = build_feedback(memory, overall_zone, overall_trend)
     g, y, r = _zone_counts(rows)
 
-    # Resumen final
-    print("\n📌 Resumen semanal")
-    print(f"- Eventos analizados: {len(rows)}")
-    print(f"- Conteo zonas: 🟢{g}  🟡{y}  🔴{r}")
-    print(f"- Zona global: {overall_zone}")
-    print(f"- Tendencia: {overall_trend}")
-    print(f"- Insight: {fb['comment']}")
-    print(f"- Sugerencia: {fb['suggestion']}")
-
     # Snapshot que se guarda en memoria
     snapshot = {
         "timestamp": datetime.now().isoformat(),
@@ -181,8 +224,38 @@ def weekly_report(
         "suggestion": fb["suggestion"],
     }
 
+    return {"ok": True, "rows": rows, "snapshot": snapshot}
+
+
+# Usa los últimos N eventos, muestra tabla + resumen, ademas, guarda snapshot si se pide para generar el reporte semanal.
+# Regresa las filas ya estructuradas; con render=False no escribe nada (quien llama decide que hacer con ellas).
+def weekly_report(
+    memory: Dict[str, Any],
+    n_events: int = 5,
+    save_snapshot: bool = True,
+    out: Optional[TextIO] = None,
+    fmt: str = "table",
+    render: bool = True,
+) -> Dict[str, Any]:
+
+    out = out or sys.stdout
+    report = build_weekly_report(memory, n_events=n_events)
+    if not report["ok"]:
+        if render and fmt == "table":
+            out.write("\n📊 APIM VI — Reporte semanal\nNo hay eventos registrados aún.\n")
+        return report
+
+    rows = report["rows"]
+    snapshot = report["snapshot"]
+
+    # Tabla + resumen (csv/jsonl solo llevan filas; el resumen va en el snapshot que se regresa)
+    if render:
+        render_rows(rows, out, fmt)
+        if fmt == "table":
+            render_summary(snapshot, out)
+
     if save_snapshot:
         memory.setdefault("weekly_snapshots", [])
         memory["weekly_snapshots"].append(snapshot)
 
-    return {"ok": True, "snapshot": snapshot}
+    return {"ok": True, "rows": rows, "snapshot": snapshot}
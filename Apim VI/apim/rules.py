@@ -1,4 +1,6 @@
 from __future__ import annotations
+import hashlib
+import json
 from typing import Any, Dict, List, Tuple
 
 # Zonas financieras/emocionales
@@ -64,6 +66,23 @@ EMOTION_TO_ZONE = {
     "desesperacion": ZONE_RED,
 }
 
+# Version de las reglas: hash de las palabras clave y de EMOTION_TO_ZONE.
+# Cada evento guarda la zona calculada al insertarlo junto con esta version; si las reglas cambian,
+# la version cambia y la zona se recalcula al leerla.
+def _rules_version() -> str:
+    spec = {
+        "red": sorted(RED_KEYWORDS),
+        "yellow": sorted(YELLOW_KEYWORDS),
+        "green": sorted(GREEN_KEYWORDS),
+        "emotion": sorted(EMOTION_TO_ZONE.items()),
+    }
+    raw = json.dumps(spec, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+
+RULES_VERSION = _rules_version()
+
+
 # Funciones Auxiliares
 def _norm(s: str) -> str:
 
@@ -112,6 +131,14 @@ def compute_zone(event: Dict[str, Any]) -> str:
     # 4) El monto aun no manda (MVP)
     return base
 
+# Zona ya guardada en el evento si es de estas reglas; si no (evento viejo o reglas nuevas), se recalcula.
+# Solo lee: el evento no se modifica
+def cached_zone(event: Dict[str, Any]) -> str:
+    zone = event.get("zone")
+    if zone and event.get("rules_version") == RULES_VERSION:
+        return zone
+    return compute_zone(event)
+
 # Compara zona anterior vs actual para saber si mejora, empeora o sigue igual
 def compute_trend(prev_zone: str | None, current_zone: str) -> str:
     if not prev_zone:
@@ -133,7 +160,7 @@ def evaluate_zone_and_trend(memory: Dict[str, Any]) -> Tuple[str, str]:
         return ZONE_YELLOW, TREND_FLAT
 
     last_event = events[-1]
-    current_zone = compute_zone(last_event)
+    current_zone = cached_zone(last_event)
     prev_zone = memory.get("last_zone")
     trend = compute_trend(prev_zone, current_zone)
 
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import os
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Muestreo del trafico shadow de V3
+# (shadow = V3 predice en silencio para compararlo con V2; no hace falta hacerlo en el 100% de los submits)
+#
+# - rate fijo: cada submit entra al shadow con probabilidad `rate`
+# - adaptativo: las primeras `target_per_day` corridas de cada persona en el dia (UTC) entran siempre;
+#   despues se cae al `rate` fijo
+# - presupuesto: si el shadow ya va tarde (cola + inferencia > budget_ms) se descarta y se cuenta
+#
+# Cada shadow guardado lleva {"rate", "weight", "reason"} con weight = 1/rate,
+# para que metrics_offline.py repondere (un shadow con rate 0.1 "vale" por 10 corridas).
+#
+# Configuracion por entorno:
+#   APIM_SHADOW_RATE=1.0            probabilidad fija (0..1)
+#   APIM_SHADOW_TARGET_PER_DAY=0    muestras garantizadas por persona por dia (0 = sin adaptativo)
+#   APIM_SHADOW_BUDGET_MS=0         presupuesto de latencia del shadow en ms (0 = sin limite)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class ShadowSampler:
+    def __init__(
+        self,
+        rate: float = 1.0,
+        target_per_day: int = 0,
+        budget_ms: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.rate = min(1.0, max(0.0, float(rate)))
+        self.target_per_day = max(0, int(target_per_day))
+        self.budget_ms = max(0.0, float(budget_ms))
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # Muestras tomadas hoy por persona (se reinicia al cambiar el dia)
+        self._day = ""
+        self._taken: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "ShadowSampler":
+        return cls(
+            rate=_env_float("APIM_SHADOW_RATE", 1.0),
+            target_per_day=int(_env_float("APIM_SHADOW_TARGET_PER_DAY", 0)),
+            budget_ms=_env_float("APIM_SHADOW_BUDGET_MS", 0.0),
+        )
+
+    # Reinicia los conteos si cambio el dia (llamar con self._lock tomado)
+    def _roll_day(self) -> None:
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if today != self._day:
+            self._day, self._taken = today, {}
+
+    # Decide si esta corrida entra al shadow. Regresa la decision a guardar, o None si se omite.
+    # No cuenta la muestra: eso lo hace record() cuando el shadow ya quedo guardado, para que los
+    # shadows descartados (presupuesto, fallo de V3 o del commit) no gasten el cupo del dia.
+    # Sesgo conocido: decisiones concurrentes de la misma persona antes de su record() pueden pasar
+    # del cupo como "target" (unas pocas de mas, con weight 1 en lugar de 1/rate).
+    def decide(self, persona: Optional[str]) -> Optional[Dict[str, Any]]:
+        key = persona or ""
+        with self._lock:
+            self._roll_day()
+            if self._taken.get(key, 0) < self.target_per_day:
+                p, reason = 1.0, "target"
+            else:
+                p, reason = self.rate, "rate"
+
+            if p <= 0.0 or (p < 1.0 and self._rng.random() >= p):
+                return None
+
+        return {"rate": p, "weight": 1.0 / p, "reason": reason}
+
+    # Cuenta una muestra ya guardada para el cupo diario de su persona
+    def record(self, persona: Optional[str]) -> None:
+        key = persona or ""
+        with self._lock:
+            self._roll_day()
+            self._taken[key] = self._taken.get(key, 0) + 1
+
+    # True si ya no alcanza el presupuesto (elapsed_ms = tiempo desde el submit)
+    def over_budget(self, elapsed_ms: float) -> bool:
+        return self.budget_ms > 0.0 and elapsed_ms > self.budget_ms
+
+    def config(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "target_per_day": self.target_per_day, "budget_ms": self.budget_ms}
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Reparto por hash (sharding) de los almacenes por usuario/sesion
+# (shard = una carpeta independiente con sus propios archivos y su propio lock;
+#  escrituras de sesiones distintas ya no se pelean por un solo archivo)
+#
+# Cada almacen guarda su mapa en <carpeta>/shards.json:
+#   {"version": 1, "n_shards": 4, "generation": "<hex>"}
+# Sin mapa = 1 shard = el layout de siempre (compatibilidad).
+# `generation` cambia en cada rebalanceo, para que los derivados (ej. el export columnar) sepan que
+# hay que recalcular.
+
+SHARD_MAP_NAME = "shards.json"
+
+_cache_lock = threading.Lock()
+_cache: Dict[Path, Dict[str, Any]] = {}
+
+
+def _default_map() -> Dict[str, Any]:
+    return {"version": 1, "n_shards": 1, "generation": "0"}
+
+
+# Shard de una llave: hash estable entre procesos y versiones de Python (hash() cambia por proceso)
+def shard_of(key: Optional[str], n_shards: int) -> int:
+    if n_shards <= 1:
+        return 0
+    digest = hashlib.blake2b((key or "").encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+# Nombre de la carpeta de un shard ("" cuando hay un solo shard: se usa la carpeta base)
+def shard_name(index: int, n_shards: int) -> str:
+    return "" if n_shards <= 1 else f"shard-{index:02d}"
+
+
+# Mapa de shards de un almacen (cacheado por stat del archivo)
+def load_map(base: Path) -> Dict[str, Any]:
+    path = base / SHARD_MAP_NAME
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return _default_map()
+
+    key = (st.st_mtime_ns, st.st_ino, st.st_size)
+    with _cache_lock:
+        hit = _cache.get(path)
+        if hit is not None and hit["stat"] == key:
+            return dict(hit["map"])
+
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return _default_map()
+    shard_map = dict(_default_map(), **data)
+    with _cache_lock:
+        _cache[path] = {"stat": key, "map": shard_map}
+    return dict(shard_map)
+
+
+# Escribe el mapa (temporal + os.replace) con una generacion nueva
+def save_map(base: Path, n_shards: int) -> Dict[str, Any]:
+    base.mkdir(parents=True, exist_ok=True)
+    shard_map = {"version": 1, "n_shards": max(1, int(n_shards)), "generation": uuid.uuid4().hex[:12]}
+    path = base / SHARD_MAP_NAME
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(shard_map, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return shard_map
+
+
+# Punto de entrada: python -m apim.sharding [status | rebalance historial|memoria N]
+if __name__ == "__main__":
+    import sys
+
+    from apim import memory_json, storage
+
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == "rebalance":
+        store, n = args[1], int(args[2])
+        if store == "historial":
+            out = storage.rebalance(n)
+        elif store == "memoria":
+            out = memory_json.rebalance(n)
+        else:
+            raise SystemExit(f"almacen desconocido: {store} (historial | memoria)")
+        print(json.dumps(out, ensure_ascii=False, indent=2))
+    else:
+        for name, base in (("historial", storage.HISTORY_DIR), ("memoria", memory_json._memory_dir())):
+            m = load_map(base)
+            print(f"- {name}: {m['n_shards']} shard(s) | generacion {m['generation']} | {base}")
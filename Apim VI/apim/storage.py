@@ -1,96 +1,1370 @@
 from __future__ import annotations
+import atexit
+import gzip
+import hashlib
+import heapq
 import json
+import os
+import threading
 import uuid
-from datetime import datetime, timezone
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from apim import codec, metrics, sharding
+from apim.metrics import timed
 
 # carpeta raiz del proyecto
-ROOT = Path(__file__).resolve().parents[1]     
+ROOT = Path(__file__).resolve().parents[1]
+
+# respeta carpeta "Data"
+DATA_DIR = ROOT / "Data"
 
-# respeta carpeta "Data" 
-DATA_DIR = ROOT / "Data"                        
+# Carpeta "data" (minuscula) que usaban utils.py (history.json) y memory_json.py (apim_memory.json).
+# Todo vive ahora en Data/; lo que quede aqui se mueve la primera vez (ver _migrate_legacy_data_dir).
+LEGACY_DATA_DIR = ROOT / "data"
+
+# Historial anterior: un solo JSON con todos los eventos. Se migra a segmentos la primera vez.
 HISTORY_FILE = DATA_DIR / "historial.json"
 
+# Historial por segmentos: un archivo JSON Lines por mes (o mas si el mes pasa el tope de tamaño)
+# + un manifest con rango de tiempo, conteo por tipo y checksum de cada segmento.
+#
+# Data/historial/
+#   manifest.json
+#   2026-08.000.jsonl.apb  -> sellado en formato compacto por bloques (ver apim.codec)
+#   2026-09.000.jsonl.gz   -> sellado (inmutable) y comprimido
+#   2026-10.000.jsonl      -> abierto: solo se le agregan lineas al final
+#
+# Con sharding (ver apim.sharding) cada shard es una subcarpeta con su propio manifest y segmentos;
+# el evento cae en el shard de hash(session_id o run_id):
+#
+# Data/historial/
+#   shards.json
+#   shard-00/manifest.json, shard-00/2026-10.000.jsonl ...
+#   shard-01/...
+HISTORY_DIR = DATA_DIR / "historial"
+MANIFEST_NAME = "manifest.json"
+
+# Tope de tamaño por segmento; al pasarlo se sella y se abre el siguiente del mismo mes
+MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# El ts de una corrida es el del submit y los hilos del pipeline hacen commit en el orden en que terminan:
+# un mes se sella hasta que llega un evento con ts de al menos APIM_SEAL_GRACE_S segundos del mes siguiente,
+# para que las corridas tardias del mes anterior todavia entren a su segmento abierto
+SEAL_GRACE_S = int(os.environ.get("APIM_SEAL_GRACE_S", 600))
+
+# Formato de los segmentos sellados al compactar (compress_sealed):
+#   gzip     -> .jsonl.gz, el de siempre
+#   apb      -> .jsonl.apb, compacto y con zlib por bloque (se lee solo el bloque que hace falta)
+#   apb-raw  -> .jsonl.apb compacto sin compresion (lectura sin descomprimir)
+COLD_FORMATS = ("gzip", "apb", "apb-raw")
+COLD_FORMAT = os.environ.get("APIM_COLD_FORMAT", "gzip")
+
+# Motor comun: un solo camino de escritura para todas las colecciones (namespaces)
+# (namespace = carpeta de una coleccion dentro de Data/)
+#   "historial" -> Data/historial/  eventos de la app (run, feedback, shadow, trace); segmentos por mes
+#   "history"   -> Data/history/    registros de utils.append_history; mismos segmentos
+#   "memory"    -> Data/memory/     documentos json por usuario (apim.memory_json)
+#
+# Las escrituras se juntan en un lote (batch) y se aplican de un jalon:
+#   1. el lote completo se agrega como una linea al journal (Data/journal.jsonl) -> un solo fsync
+#   2. se aplica a los archivos de cada coleccion (append a segmentos, temporal + os.replace a documentos)
+#   3. cada JOURNAL_MAX_BYTES: fsync de los archivos tocados y se vacia el journal (checkpoint)
+# Si el proceso se cae entre 1 y 3, al arrancar se vuelve a aplicar el journal (idempotente:
+# cada append lleva el byte donde va).
+# Varios procesos pueden compartir Data/ (la app y una herramienta offline): elegir el byte de cada
+# append, escribir el journal, aplicarlo, el checkpoint y la recuperacion van con un lock de archivo
+# (Data/journal.lock), asi nadie reaplica ni trunca un lote que otro proceso no ha terminado.
+#
+# APIM_FSYNC=batch (default) usa el journal; APIM_FSYNC=off escribe directo sin fsync (como antes).
+LOG_NAMESPACES = ("historial", "history")
+DOC_NAMESPACES = ("memory",)
+JOURNAL_NAME = "journal.jsonl"
+JOURNAL_LOCK_NAME = "journal.lock"
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+FSYNC_MODE = os.environ.get("APIM_FSYNC", "batch")
+
+# Mantenimiento (migracion, rebalanceo) dentro del proceso
+_lock = threading.RLock()
+
+# Un escritor a la vez por shard (el pipeline de post-submit escribe desde otro hilo);
+# shards distintos preparan su parte del lote en paralelo
+_shard_locks: Dict[str, threading.RLock] = {}
+_shard_locks_guard = threading.Lock()
+
+# El journal es uno solo: escribir + fsync + aplicar un lote va con este lock
+# (dentro del proceso; entre procesos, ademas el lock de archivo de _journal_guard)
+_journal_lock = threading.RLock()
+_journal_flock: Dict[str, Any] = {"depth": 0, "fd": None}
+# Archivos aplicados desde el ultimo checkpoint (les falta fsync)
+_dirty: set = set()
+# Data/ ya revisada (migracion de data/ y recuperacion del journal), por carpeta
+_ready_dirs: set = set()
+
+# Lote abierto del hilo actual (ver batch())
+_local = threading.local()
+
+TimeBound = Union[str, datetime, None]
+
 # Devuelve la fecha y hora actual
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-# Asegura que existe la carpeta
-def _ensure_data_dir() -> None:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
+# Asegura que existe la carpeta del shard
+def _ensure_data_dir(shard: str = "", base: Optional[Path] = None) -> None:
+    _shard_dir(shard, base).mkdir(parents=True, exist_ok=True)
+
+# Limites de tiempo como texto ISO en UTC (los ts guardados son ISO UTC, asi se comparan como texto)
+def _iso_bound(t: TimeBound) -> Optional[str]:
+    if t is None:
+        return None
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.astimezone(timezone.utc).isoformat()
+
+
+# ===== Shards =====
+
+# Shards del historial ("" = un solo shard en la carpeta base, el layout de siempre)
+def _shards(base: Optional[Path] = None) -> List[str]:
+    n = sharding.load_map(base or HISTORY_DIR)["n_shards"]
+    return [sharding.shard_name(i, n) for i in range(n)]
+
+def _shard_dir(shard: str = "", base: Optional[Path] = None) -> Path:
+    base = base or HISTORY_DIR
+    return base / shard if shard else base
+
+# Llave de sharding de un evento: la sesion si la hay; si no, la corrida
+def _shard_key(event: Dict[str, Any]) -> str:
+    return event.get("session_id") or event.get("run_id") or ""
+
+# Shard donde cae una llave con el mapa actual
+def shard_for(key: Optional[str], base: Optional[Path] = None) -> str:
+    n = sharding.load_map(base or HISTORY_DIR)["n_shards"]
+    return sharding.shard_name(sharding.shard_of(key, n), n)
+
+# Lock por nombre: carpeta de un shard (de cualquier coleccion) o ruta de un documento
+def _named_lock(key: str) -> threading.RLock:
+    with _shard_locks_guard:
+        lock = _shard_locks.get(key)
+        if lock is None:
+            lock = _shard_locks[key] = threading.RLock()
+        return lock
 
-# Si el archivo no existe, devuelve lista vacía.  Si el JSON está corrupto, crea respaldo y reinicia
-def _load_events() -> List[Dict[str, Any]]:
-    _ensure_data_dir()
+def _shard_lock(shard: str, base: Optional[Path] = None) -> threading.RLock:
+    return _named_lock(str(_shard_dir(shard, base)))
 
-    if not HISTORY_FILE.exists():
-        return []
 
+# ===== Manifest =====
+
+def _manifest_path(shard: str = "", base: Optional[Path] = None) -> Path:
+    return _shard_dir(shard, base) / MANIFEST_NAME
+
+def _load_manifest(shard: str = "", base: Optional[Path] = None) -> Dict[str, Any]:
     try:
-        return json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-
-        # Si se corrompe el json, lo respaldamos y empezamos limpio
-        backup = HISTORY_FILE.with_suffix(".json.bak")
-        HISTORY_FILE.replace(backup)
-        return []
-
-# Guarda la lista completa de eventos en historial.json.
-def _save_events(events: List[Dict[str, Any]]) -> None:
-    _ensure_data_dir()
-    HISTORY_FILE.write_text(
-        json.dumps(events, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+        manifest = json.loads(_manifest_path(shard, base).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {"version": 1, "segments": []}
+    # Manifests de antes del sharding no traen el shard en cada segmento
+    for seg in manifest["segments"]:
+        seg.setdefault("shard", shard)
+    return manifest
+
+# El manifest se reescribe completo pero es chico; temporal + os.replace para no dejarlo a medias
+def _save_manifest(manifest: Dict[str, Any], shard: str = "", base: Optional[Path] = None) -> None:
+    _ensure_data_dir(shard, base)
+    path = _manifest_path(shard, base)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _segment_path(seg: Dict[str, Any], base: Optional[Path] = None) -> Path:
+    return _shard_dir(seg.get("shard", ""), base) / seg["name"]
+
+# Formato en disco de un segmento: jsonl (abierto o sellado sin compactar), gzip, apb o apb-raw
+def _segment_format(seg: Dict[str, Any]) -> str:
+    if seg["name"].endswith(".apb"):
+        return seg.get("format", "apb")
+    return "gzip" if seg["name"].endswith(".gz") else "jsonl"
+
+def _open_segment_file(path: Path, binary: bool = False):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb") if binary else gzip.open(path, "rt", encoding="utf-8")
+    return path.open("rb") if binary else path.open("r", encoding="utf-8")
+
+# Lee un segmento linea por linea; una linea rota (ej. corte a media escritura) se salta.
+# Los .apb se leen por bloques: con rango/tipos solo se abren los bloques que pueden traer algo.
+def _read_segment(
+    path: Path,
+    start_s: Optional[str] = None,
+    end_s: Optional[str] = None,
+    types: Optional[set] = None,
+) -> Iterator[Dict[str, Any]]:
+    if path.suffix == ".apb":
+        if path.exists():
+            yield from codec.iter_file(path, start_s, end_s, types)
+        return
+    try:
+        f = _open_segment_file(path)
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+# Rango de tiempo, conteo por tipo y checksum de un segmento (se calcula al sellar)
+def _segment_stats(path: Path) -> Dict[str, Any]:
+    counts: Dict[str, int] = {}
+    start_ts = end_ts = None
+    n = 0
+    for e in _read_segment(path):
+        n += 1
+        t = e.get("type", "")
+        counts[t] = counts.get(t, 0) + 1
+        ts = e.get("ts")
+        if ts:
+            start_ts = ts if start_ts is None or ts < start_ts else start_ts
+            end_ts = ts if end_ts is None or ts > end_ts else end_ts
+
+    h = hashlib.sha256()
+    with _open_segment_file(path, binary=True) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return {
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "n_events": n,
+        "counts": counts,
+        "sha256": h.hexdigest(),
+    }
+
+# Sella un segmento: ya no recibe eventos y su manifest queda con conteos y checksum (llamar con el lock)
+def _seal(seg: Dict[str, Any], base: Optional[Path] = None) -> None:
+    path = _segment_path(seg, base)
+    stats = _segment_stats(path) if path.exists() else {"n_events": 0, "counts": {}, "sha256": None}
+    start_ts = seg.get("start_ts")
+    seg.update(stats)
+    if seg.get("start_ts") is None:
+        seg["start_ts"] = start_ts
+    seg["bytes"] = path.stat().st_size if path.exists() else 0
+    seg["sealed"] = True
+
+# Mes antes del cual ya se puede sellar, visto desde un evento con este ts (ver SEAL_GRACE_S)
+def _seal_month(ts: str) -> str:
+    try:
+        return (datetime.fromisoformat(ts) - timedelta(seconds=SEAL_GRACE_S)).isoformat()[:7]
+    except ValueError:
+        return ts[:7]
+
+# Segmento abierto del shard donde van eventos de un mes (ts = el menor del grupo; crea uno nuevo si hace
+# falta; llamar con el lock del shard)
+def _segment_for_write(ts: str, shard: str = "", base: Optional[Path] = None) -> Dict[str, Any]:
+    month = ts[:7]
+    seal_before = _seal_month(ts)
+    manifest = _load_manifest(shard, base)
+    changed = False
+    target = None
+
+    for seg in manifest["segments"]:
+        if seg.get("sealed"):
+            continue
+        # Meses anteriores (pasada la gracia) ya no reciben eventos nuevos: se sellan
+        if seg["month"] < seal_before and seg["month"] < month:
+            _seal(seg, base)
+            changed = True
+            continue
+        if seg["month"] == month:
+            path = _segment_path(seg, base)
+            if path.exists() and path.stat().st_size >= MAX_SEGMENT_BYTES:
+                _seal(seg, base)
+                changed = True
+            else:
+                target = seg
+
+    # Un evento tardio puede traer un ts anterior al primero del segmento: el rango del manifest lo cubre
+    if target is not None and target.get("start_ts") and ts < target["start_ts"]:
+        target["start_ts"] = ts
+        changed = True
+
+    if target is None:
+        seq = sum(1 for seg in manifest["segments"] if seg["month"] == month)
+        target = {
+            "name": f"{month}.{seq:03d}.jsonl",
+            "shard": shard,
+            "month": month,
+            "start_ts": ts,
+            "end_ts": None,
+            "sealed": False,
+            "compressed": False,
+        }
+        manifest["segments"].append(target)
+        changed = True
+
+    if changed:
+        _save_manifest(manifest, shard, base)
+    return target
+
+# Pasa el historial.json anterior a segmentos (una sola vez; el original queda como .migrated)
+def migrate_legacy() -> int:
+    with _lock:
+        if not HISTORY_FILE.exists():
+            return 0
+        try:
+            events = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            # Si se corrompe el json, lo respaldamos y empezamos limpio
+            HISTORY_FILE.replace(HISTORY_FILE.with_suffix(".json.bak"))
+            return 0
+
+        events.sort(key=lambda e: e.get("ts", ""))
+        for e in events:
+            e.setdefault("ts", _now_iso())
+        _commit_events("historial", events)
+
+        HISTORY_FILE.replace(HISTORY_FILE.with_suffix(".json.migrated"))
+        return len(events)
+
+# Mueve a Data/ lo que quedaba en data/: history.json de utils pasa a la coleccion "history"
+# y la memoria (apim_memory.json, memory/) se mueve tal cual. Nada se sobreescribe.
+def _migrate_legacy_data_dir() -> None:
+    old = LEGACY_DATA_DIR
+    if not old.is_dir():
+        return
+
+    legacy_history = old / "history.json"
+    if legacy_history.exists():
+        try:
+            records = json.loads(legacy_history.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            records = []
+        records = [dict(r) for r in records if isinstance(r, dict)] if isinstance(records, list) else []
+        for r in records:
+            # timestamp de utils es hora local sin zona; los segmentos van por ts en UTC
+            try:
+                r.setdefault("ts", datetime.fromisoformat(r["timestamp"]).astimezone(timezone.utc).isoformat())
+            except (KeyError, TypeError, ValueError):
+                r.setdefault("ts", _now_iso())
+        records.sort(key=lambda r: r["ts"])
+        _commit_events("history", records)
+        legacy_history.replace(legacy_history.with_suffix(".json.migrated"))
+
+    # En Windows/macOS "data" y "Data" pueden ser la misma carpeta
+    if os.path.samefile(old, DATA_DIR):
+        return
+    for name in ("apim_memory.json", "memory"):
+        src, dst = old / name, DATA_DIR / name
+        if src.exists() and not dst.exists():
+            os.replace(src, dst)
+
+# Primer uso de Data/ en el proceso: aplica lo que haya quedado en el journal y migra data/
+def _ready() -> None:
+    key = str(DATA_DIR)
+    if key in _ready_dirs:
+        return
+    with _lock:
+        if key in _ready_dirs:
+            return
+        _ready_dirs.add(key)
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        if FSYNC_MODE != "off":
+            recover()
+        _migrate_legacy_data_dir()
+
+
+# ===== Escritura (motor comun) =====
+
+# Carpeta de una coleccion
+def namespace_dir(ns: str) -> Path:
+    if ns == "historial":
+        return HISTORY_DIR
+    if ns not in LOG_NAMESPACES + DOC_NAMESPACES:
+        raise ValueError(f"namespace desconocido: {ns}")
+    return DATA_DIR / ns
+
+# Id nuevo de corrida (se puede pedir antes de guardar, ej. para el pipeline en segundo plano)
+def new_run_id() -> str:
+    return str(uuid.uuid4())
+
+
+class Batch:
+    """
+    Escrituras pendientes de una o varias colecciones; commit() las aplica con un solo fsync.
+    Los eventos se escriben en el orden en que llegaron; de un documento queda la ultima version.
+    """
+    def __init__(self):
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.docs: Dict[Path, str] = {}
+
+    def append(self, ns: str, event: Dict[str, Any]) -> None:
+        self.events.append((ns, event))
+
+    def write_doc(self, path: Path, text: str) -> None:
+        self.docs[Path(path)] = text
+
+    def __len__(self) -> int:
+        return len(self.events) + len(self.docs)
+
+    # Aplica lo pendiente y deja el lote vacio (se puede seguir usando); regresa cuantas escrituras hubo
+    def commit(self) -> int:
+        n = len(self)
+        if n:
+            events, docs = self.events, self.docs
+            self.events, self.docs = [], {}
+            _commit(events, docs)
+        return n
+
+# Abre un lote en este hilo: lo que se guarde adentro (save_run, save_shadow, append, write_doc...)
+# se escribe junto al salir. Un lote anidado se suma al de afuera; si adentro truena, no se escribe nada.
+# Lo pendiente no se ve en las lecturas hasta el commit.
+@contextmanager
+def batch() -> Iterator[Batch]:
+    outer = getattr(_local, "batch", None)
+    if outer is not None:
+        yield outer
+        return
+    b = _local.batch = Batch()
+    try:
+        yield b
+    finally:
+        _local.batch = None
+    b.commit()
+
+# Agrega un registro a una coleccion de eventos (al lote abierto del hilo, o como lote de uno)
+def append(ns: str, event: Dict[str, Any]) -> None:
+    b = getattr(_local, "batch", None)
+    if b is not None:
+        b.append(ns, event)
+    else:
+        _commit([(ns, event)], {})
+
+# Reemplaza un documento completo (ej. la memoria de un usuario) por el mismo camino que los eventos
+def write_doc(path: Path, text: str) -> None:
+    b = getattr(_local, "batch", None)
+    if b is not None:
+        b.write_doc(path, text)
+    else:
+        _commit([], {Path(path): text})
+
+# Escribe muchos eventos ya armados en lotes de `chunk` (migraciones y rebalanceo)
+# No avisa a los listeners: son eventos que ya existian, solo cambian de lugar
+def _commit_events(ns: str, events: List[Dict[str, Any]], chunk: int = 5000) -> None:
+    for i in range(0, len(events), chunk):
+        _commit([(ns, e) for e in events[i:i + chunk]], {}, notify=False)
+
+# Funciones que reciben [(ns, evento)] de cada lote ya escrito (ej. apim.drift); un fallo ahi no tumba la escritura
+_commit_listeners: List[Callable[[List[Tuple[str, Dict[str, Any]]]], None]] = []
+
+def add_commit_listener(fn: Callable[[List[Tuple[str, Dict[str, Any]]]], None]) -> None:
+    if fn not in _commit_listeners:
+        _commit_listeners.append(fn)
+
+def _notify(events: List[Tuple[str, Dict[str, Any]]]) -> None:
+    for fn in list(_commit_listeners):
+        try:
+            fn(events)
+        except Exception:
+            metrics.incr("storage.listener_errors")
+
+# Aplica un lote: con los locks de sus shards elige segmento y byte de cada append, lo pasa al journal
+# con un fsync y luego lo escribe en las colecciones. Los eventos que ya traen ts (el del submit) pueden
+# llegar fuera de orden: los lectores ordenan cada segmento (ver _iter_shard)
+@timed("storage.commit")
+def _commit(events: List[Tuple[str, Dict[str, Any]]], docs: Dict[Path, str], notify: bool = True) -> None:
+    _ready()
+
+    groups: Dict[Tuple[Path, str], List[Dict[str, Any]]] = {}
+    for ns, e in events:
+        base = namespace_dir(ns)
+        groups.setdefault((base, shard_for(_shard_key(e), base)), []).append(e)
+
+    with ExitStack() as stack:
+        # Locks en orden fijo para que dos lotes no se esperen en cruz
+        for key in sorted({str(_shard_dir(s, b)) for b, s in groups} | {str(p) for p in docs}):
+            stack.enter_context(_named_lock(key))
+
+        # Normalmente un solo mes por shard: un append por segmento con todas sus lineas
+        prepared: List[Tuple[Path, str, List[Dict[str, Any]], str]] = []
+        for (base, shard), group in groups.items():
+            by_month: Dict[str, List[Dict[str, Any]]] = {}
+            for e in group:
+                e.setdefault("ts", _now_iso())
+                by_month.setdefault(e["ts"][:7], []).append(e)
+            for month_events in by_month.values():
+                data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in month_events)
+                prepared.append((base, shard, month_events, data))
+
+        # El segmento y el byte de cada append se eligen con el lock entre procesos tomado
+        with _journal_guard():
+            ops: List[Tuple[str, Path, Optional[int], str]] = []
+            ends: Dict[Path, int] = {}
+            appended: List[Tuple[Path, int, int, List[Dict[str, Any]]]] = []
+            for base, shard, month_events, data in prepared:
+                _ensure_data_dir(shard, base)
+                first_ts = min(e["ts"] for e in month_events)
+                path = _segment_path(_segment_for_write(first_ts, shard, base), base)
+                offset = ends.get(path)
+                if offset is None:
+                    offset = path.stat().st_size if path.exists() else 0
+                ops.append(("append", path, offset, data))
+                ends[path] = offset + len(data.encode("utf-8"))
+                appended.append((path, offset, ends[path], month_events))
+
+            for path, text in docs.items():
+                ops.append(("replace", path, None, text))
+
+            size = _journal_write(ops) if FSYNC_MODE != "off" else 0
+            for kind, path, _, data in ops:
+                _apply(kind, path, data)
+            # El cache del proceso se pone al dia con lo que se acaba de escribir, sin releer
+            for path, offset, end, written in appended:
+                _cache_appended(path, offset, end, written)
+            if size >= JOURNAL_MAX_BYTES:
+                checkpoint()
+
+    if notify and events and _commit_listeners:
+        _notify(events)
+
+
+# ===== Journal =====
+
+def _journal_path() -> Path:
+    return DATA_DIR / JOURNAL_NAME
+
+def _lock_fd(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    # msvcrt reintenta ~10 s y truena; se sigue esperando
+    while True:
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+def _unlock_fd(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+# Abre (o crea) un archivo de lock y lo bloquea; regresa el descriptor
+def _open_locked(path: Path) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        _lock_fd(fd)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+# Lock entre procesos (y entre hilos) sobre un archivo, con el mismo mecanismo que el journal.
+# Para derivados de Data/ (ej. el export columnar) que no deben frenar los commits con el lock del journal.
+# No es reentrante: no volver a pedir el mismo lock desde adentro.
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    with _named_lock(str(path)):
+        fd = _open_locked(path)
+        try:
+            yield
+        finally:
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+
+# Lock del journal entre procesos (y entre hilos). Reentrante: el archivo se bloquea solo en la vuelta de afuera.
+@contextmanager
+def _journal_guard() -> Iterator[None]:
+    with _journal_lock:
+        if _journal_flock["depth"] == 0:
+            _journal_flock["fd"] = _open_locked(DATA_DIR / JOURNAL_LOCK_NAME)
+        _journal_flock["depth"] += 1
+        try:
+            yield
+        finally:
+            _journal_flock["depth"] -= 1
+            if _journal_flock["depth"] == 0:
+                fd, _journal_flock["fd"] = _journal_flock["fd"], None
+                try:
+                    _unlock_fd(fd)
+                finally:
+                    os.close(fd)
+
+# Rutas del journal relativas a Data/ (siguen sirviendo si se mueve la carpeta del proyecto)
+def _rel(path: Path) -> str:
+    try:
+        return path.relative_to(DATA_DIR).as_posix()
+    except ValueError:
+        return str(path)
+
+def _abs(rel: str) -> Path:
+    path = Path(rel)
+    return path if path.is_absolute() else DATA_DIR / path
+
+# Un lote = una linea del journal, escrita con un solo write y un fsync. Regresa el tamaño del journal.
+def _journal_write(ops: List[Tuple[str, Path, Optional[int], str]]) -> int:
+    entry = {"id": uuid.uuid4().hex, "ops": [[kind, _rel(path), offset, data] for kind, path, offset, data in ops]}
+    line = memoryview((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+    fd = os.open(_journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        while line:
+            line = line[os.write(fd, line):]
+        os.fsync(fd)
+        size = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    metrics.incr("storage.fsync")
+    return size
+
+# Escribe una operacion del lote en su coleccion (sin fsync: de eso se encarga el journal)
+def _apply(kind: str, path: Path, data: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if kind == "append":
+        with path.open("ab") as f:
+            f.write(data.encode("utf-8"))
+    else:
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data.encode("utf-8"))
+        os.replace(tmp, path)
+    _dirty.add(path)
+
+# Reaplica un append del journal: si sus bytes ya estan donde iban no se toca; si no, va al final
+# (despues de un salto de linea si quedo una linea a medias, que la lectura se salta)
+def _replay_append(path: Path, offset: int, data: str) -> None:
+    raw = data.encode("utf-8")
+    size = path.stat().st_size if path.exists() else 0
+    if size >= offset + len(raw):
+        with path.open("rb") as f:
+            f.seek(offset)
+            if f.read(len(raw)) == raw:
+                return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("ab+") as f:
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(raw)
+    _dirty.add(path)
+
+def _fsync_path(path: Path, directory: bool = False) -> None:
+    flags = os.O_RDONLY | (getattr(os, "O_DIRECTORY", 0) if directory else getattr(os, "O_BINARY", 0))
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        # Borrado despues (ej. segmento comprimido) o carpetas que no se pueden abrir (Windows)
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Lotes confirmados del journal, en orden. Una linea sin salto final es un lote que nunca se confirmo: ahi se para.
+def _journal_entries(journal: Path) -> Iterator[Dict[str, Any]]:
+    if not journal.exists():
+        return
+    with journal.open("rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                return
+            try:
+                yield json.loads(raw)
+            except json.JSONDecodeError:
+                return
+
+# Checkpoint: fsync de lo aplicado desde el anterior y se vacia el journal. Regresa cuantos archivos.
+# El journal puede traer lotes de otros procesos: se hace fsync de todo lo que menciona, no solo de _dirty.
+def checkpoint() -> int:
+    with _journal_guard():
+        journal = _journal_path()
+        paths = set(_dirty)
+        for entry in _journal_entries(journal):
+            paths.update(_abs(rel) for _, rel, _, _ in entry["ops"])
+        for path in paths:
+            _fsync_path(path)
+        for folder in {p.parent for p in paths}:
+            _fsync_path(folder, directory=True)
+        _dirty.clear()
+
+        if journal.exists() and journal.stat().st_size:
+            with journal.open("r+b") as f:
+                f.truncate(0)
+                os.fsync(f.fileno())
+        return len(paths)
+
+# Vuelve a aplicar los lotes que quedaron en el journal (el proceso se cayo antes del checkpoint).
+# Con el lock entre procesos tomado, todo lote del journal de un proceso vivo ya esta aplicado
+# (se escribe y se aplica sin soltar el lock): solo se reaplica lo de un proceso que se cayo.
+def recover() -> int:
+    with _journal_guard():
+        journal = _journal_path()
+        if not journal.exists() or not journal.stat().st_size:
+            return 0
+        n = 0
+        for entry in _journal_entries(journal):
+            for kind, rel, offset, data in entry["ops"]:
+                if kind == "append":
+                    _replay_append(_abs(rel), offset, data)
+                else:
+                    _apply(kind, _abs(rel), data)
+            n += 1
+        checkpoint()
+        return n
+
+# Al salir, lo aplicado queda en disco y el journal vacio
+@atexit.register
+def _checkpoint_at_exit() -> None:
+    if _dirty and FSYNC_MODE != "off":
+        checkpoint()
+
+# Agrega un evento al final del segmento del mes en su shard: ya no se reescribe todo el historial
+def _append_event(event: Dict[str, Any]) -> None:
+    if HISTORY_FILE.exists():
+        migrate_legacy()
+    append("historial", event)
+
+
+# ===== Cache de eventos del proceso =====
+
+# Eventos ya parseados por segmento (LRU). Se revalida con stat (inodo, tamaño, mtime):
+# - sin cambios -> la misma lista, sin leer el archivo
+# - un .jsonl que solo crecio -> se leen las lineas nuevas desde el ultimo byte leido
+# - otra cosa (se reescribio, se compacto) -> se vuelve a leer completo
+# Lo que escribe este mismo proceso entra directo por su offset (_cache_appended), sin releer.
+# APIM_EVENT_CACHE_MAX = tope de eventos en cache (0 = sin cache)
+EVENT_CACHE_MAX = int(os.environ.get("APIM_EVENT_CACHE_MAX", 1_000_000))
+
+_cache_lock = threading.RLock()
+_seg_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_cache_stats = {"events": 0, "hits": 0, "tail_reads": 0, "full_reads": 0, "appended": 0}
+
+# Lineas completas de un JSON Lines desde un byte; regresa (eventos, byte donde terminaron)
+def _read_tail(path: Path, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+    events: List[Dict[str, Any]] = []
+    pos = offset
+    with path.open("rb") as f:
+        f.seek(offset)
+        for raw in f:
+            # Linea sin salto final: se esta escribiendo, se lee en la siguiente pasada
+            if not raw.endswith(b"\n"):
+                break
+            pos += len(raw)
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                events.append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+    return events, pos
+
+def _cache_put(key: str, entry: Dict[str, Any]) -> None:
+    old = _seg_cache.pop(key, None)
+    if old is not None:
+        _cache_stats["events"] -= len(old["events"])
+    _seg_cache[key] = entry
+    _cache_stats["events"] += len(entry["events"])
+    # Se sueltan los menos usados (nunca el que se acaba de pedir)
+    while _cache_stats["events"] > EVENT_CACHE_MAX and len(_seg_cache) > 1:
+        oldest = next(iter(_seg_cache))
+        if oldest == key:
+            _seg_cache.move_to_end(key)
+            continue
+        _cache_stats["events"] -= len(_seg_cache.pop(oldest)["events"])
+
+# Eventos de un segmento desde el cache (revalidado). Con load=False y sin entrada valida regresa None.
+def _cached_events(path: Path, load: bool = True) -> Optional[List[Dict[str, Any]]]:
+    if EVENT_CACHE_MAX <= 0:
+        return None
+    key = str(path)
+    with _cache_lock:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            dropped = _seg_cache.pop(key, None)
+            if dropped is not None:
+                _cache_stats["events"] -= len(dropped["events"])
+            return []
+
+        entry = _seg_cache.get(key)
+        if entry is not None and entry["ino"] == st.st_ino:
+            if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                _seg_cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return entry["events"]
+            if path.suffix == ".jsonl" and st.st_size >= entry["size"]:
+                new, end = _read_tail(path, entry["bytes"])
+                entry["events"].extend(new)
+                entry.update(size=st.st_size, mtime=st.st_mtime_ns, bytes=end)
+                _cache_stats["events"] += len(new)
+                _cache_stats["tail_reads"] += 1
+                _seg_cache.move_to_end(key)
+                return entry["events"]
+
+        if not load:
+            return None
+        if path.suffix == ".jsonl":
+            events, end = _read_tail(path, 0)
+        else:
+            events, end = list(_read_segment(path)), st.st_size
+        _cache_stats["full_reads"] += 1
+        _cache_put(key, {"ino": st.st_ino, "size": st.st_size, "mtime": st.st_mtime_ns, "bytes": end, "events": events})
+        return events
+
+# Append propio recien aplicado: si el cache de ese segmento llegaba justo a `offset`, se le agregan
+# los eventos y queda al dia sin leer el archivo (si no, la siguiente lectura revalida por stat)
+def _cache_appended(path: Path, offset: int, end: int, events: List[Dict[str, Any]]) -> None:
+    key = str(path)
+    with _cache_lock:
+        entry = _seg_cache.get(key)
+        if entry is None or entry["bytes"] != offset:
+            return
+        st = path.stat()
+        if st.st_ino != entry["ino"] or st.st_size != end:
+            return
+        entry["events"].extend(events)
+        entry.update(size=st.st_size, mtime=st.st_mtime_ns, bytes=end)
+        _cache_stats["events"] += len(events)
+        _cache_stats["appended"] += 1
+
+# Vacia el cache y el indice de run_id (pruebas, o despues de editar archivos a mano)
+def clear_cache() -> None:
+    with _cache_lock:
+        _seg_cache.clear()
+        _cache_stats.update(events=0, hits=0, tail_reads=0, full_reads=0, appended=0)
+        _run_index.clear()
+        _path_runs.clear()
+        _indexed.clear()
+
+def cache_info() -> Dict[str, Any]:
+    with _cache_lock:
+        return dict(_cache_stats, segments=len(_seg_cache), max_events=EVENT_CACHE_MAX, runs_indexed=len(_run_index))
+
+
+# ===== Lectura =====
+
+# Todos los segmentos de todos los shards (en orden de creacion dentro de cada shard)
+def list_segments(base: Optional[Path] = None) -> List[Dict[str, Any]]:
+    _ready()
+    return [seg for shard in _shards(base) for seg in _load_manifest(shard, base)["segments"]]
+
+# Segmentos que se traslapan con [start, end]; los abiertos no tienen fin todavia
+def segments_for_range(
+    start: TimeBound = None,
+    end: TimeBound = None,
+    base: Optional[Path] = None,
+) -> List[Dict[str, Any]]:
+    start_s, end_s = _iso_bound(start), _iso_bound(end)
+    out = []
+    for seg in list_segments(base):
+        seg_start, seg_end = seg.get("start_ts"), seg.get("end_ts")
+        if end_s is not None and seg_start is not None and seg_start > end_s:
+            continue
+        if start_s is not None and seg.get("sealed") and seg_end is not None and seg_end < start_s:
+            continue
+        out.append(seg)
+    return out
+
+def _ts_key(e: Dict[str, Any]) -> str:
+    return e.get("ts", "")
+
+# Eventos de un shard en orden de ts. Los commits llegan casi en orden (el ts es el del submit), asi que
+# cada segmento se ordena (timsort: casi lineal) y los segmentos de un mismo mes se mezclan (uno tardio se
+# traslapa con el anterior); los meses no se traslapan y van uno tras otro.
+# Salen del cache del proceso; un .apb frio leido con filtros se lee por bloques sin cargarlo completo.
+def _iter_shard(
+    segments: List[Dict[str, Any]],
+    start_s: Optional[str],
+    end_s: Optional[str],
+    types: Optional[set],
+    base: Optional[Path],
+) -> Iterator[Dict[str, Any]]:
+    unfiltered = start_s is None and end_s is None and types is None
+
+    def segment_events(seg: Dict[str, Any]) -> List[Dict[str, Any]]:
+        path = _segment_path(seg, base)
+        events = _cached_events(path, load=unfiltered or path.suffix != ".apb")
+        out = []
+        for e in events if events is not None else _read_segment(path, start_s, end_s, types):
+            if types is not None and e.get("type") not in types:
+                continue
+            ts = e.get("ts", "")
+            if start_s is not None and ts < start_s:
+                continue
+            if end_s is not None and ts > end_s:
+                continue
+            out.append(e)
+        out.sort(key=_ts_key)
+        return out
+
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for seg in segments:
+        by_month.setdefault(seg.get("month", ""), []).append(seg)
+    for month in sorted(by_month):
+        segs = by_month[month]
+        if len(segs) == 1:
+            yield from segment_events(segs[0])
+        else:
+            yield from heapq.merge(*(segment_events(seg) for seg in segs), key=_ts_key)
+
+# Recorre eventos de todos los shards mezclados por ts (heapq.merge de los shards, cada uno ya en orden),
+# abriendo solo los segmentos que caen en el rango pedido.
+# Los eventos son los mismos objetos del cache: son de solo lectura (copiar antes de modificar).
+def iter_events(
+    start: TimeBound = None,
+    end: TimeBound = None,
+    types: Optional[Iterable[str]] = None,
+    base: Optional[Path] = None,
+) -> Iterator[Dict[str, Any]]:
+    _ready()
+    if base is None and HISTORY_FILE.exists():
+        migrate_legacy()
+
+    start_s, end_s = _iso_bound(start), _iso_bound(end)
+    types = set(types) if types is not None else None
+
+    by_shard: Dict[str, List[Dict[str, Any]]] = {}
+    for seg in segments_for_range(start_s, end_s, base):
+        by_shard.setdefault(seg.get("shard", ""), []).append(seg)
+
+    streams = [_iter_shard(segs, start_s, end_s, types, base) for segs in by_shard.values()]
+    if len(streams) == 1:
+        yield from streams[0]
+        return
+    yield from heapq.merge(*streams, key=_ts_key)
+
+# Lectura incremental de un segmento desde una marca (lineas ya leidas + byte donde terminaron).
+# Regresa (eventos nuevos, lineas totales, byte final). En archivos sin comprimir salta directo al byte;
+# en .gz hay que recorrer las lineas ya leidas (en .apb, los eventos). Una linea sin salto final
+# (se esta escribiendo) no se cuenta: se lee en la siguiente pasada.
+def read_segment_tail(
+    seg: Dict[str, Any],
+    lines: int = 0,
+    byte_offset: int = 0,
+) -> tuple[List[Dict[str, Any]], int, int]:
+    path = _segment_path(seg)
+    events: List[Dict[str, Any]] = []
+    compressed = path.suffix == ".gz"
+
+    # .apb: sellado y completo; una linea = un evento
+    if path.suffix == ".apb":
+        if not path.exists():
+            return events, lines, byte_offset
+        events = list(codec.iter_file(path))
+        return events[lines:], len(events), path.stat().st_size
+
+    try:
+        f = _open_segment_file(path, binary=True)
+    except FileNotFoundError:
+        return events, lines, byte_offset
+
+    with f:
+        skip = lines
+        if not compressed:
+            f.seek(byte_offset)
+            skip = 0
+        pos = byte_offset if not compressed else 0
+
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            pos += len(raw)
+            if skip > 0:
+                skip -= 1
+                continue
+            lines += 1
+            if not raw.strip():
+                continue
+            try:
+                events.append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+
+    return events, lines, pos
+
+# Lista de eventos (opcionalmente por rango de tiempo y tipo)
+def load_events(
+    start: TimeBound = None,
+    end: TimeBound = None,
+    types: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    return list(iter_events(start, end, types))
+
+
+# ===== Indice run_id -> posiciones =====
+
+# run_id -> segmento -> [(byte donde empieza la linea, tipo)] de los eventos de esa corrida.
+# En formatos frios (.gz, .apb) no hay byte al cual saltar (None): se busca dentro del segmento.
+# El indice no guarda eventos (el tope de APIM_EVENT_CACHE_MAX sigue mandando): por segmento se recuerda
+# (inodo, tamaño, mtime, byte indexado); si crecio se indexa solo la cola, si cambio se vuelve a indexar,
+# si desaparecio (compactado, rebalanceo) se quitan sus entradas. Indexar lee el archivo sin cachearlo.
+_run_index: Dict[str, Dict[str, List[Tuple[Optional[int], str]]]] = {}
+_path_runs: Dict[str, set] = {}
+_indexed: Dict[str, Tuple[int, int, int, int]] = {}
+
+def _unindex(key: str) -> None:
+    for run_id in _path_runs.pop(key, ()):
+        by_path = _run_index.get(run_id)
+        if by_path is not None:
+            by_path.pop(key, None)
+            if not by_path:
+                del _run_index[run_id]
+    _indexed.pop(key, None)
+
+def _index_add(run_id: Any, key: str, pos: Optional[int], kind: Any) -> None:
+    if run_id and isinstance(run_id, str):
+        _run_index.setdefault(run_id, {}).setdefault(key, []).append((pos, kind or ""))
+        _path_runs.setdefault(key, set()).add(run_id)
+
+# Indexa lo nuevo de un segmento (llamar con _cache_lock)
+def _index_segment(path: Path) -> None:
+    key = str(path)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        _unindex(key)
+        return
+    old = _indexed.get(key)
+    start = 0
+    if old is not None:
+        if old[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+            return
+        if path.suffix == ".jsonl" and old[0] == st.st_ino and st.st_size >= old[1]:
+            start = old[3]
+        else:
+            _unindex(key)
+
+    if path.suffix == ".jsonl":
+        end = start
+        with path.open("rb") as f:
+            f.seek(start)
+            for raw in f:
+                # Linea a medias: se indexa cuando este completa
+                if not raw.endswith(b"\n"):
+                    break
+                pos, end = end, end + len(raw)
+                if b'"run_id"' not in raw:
+                    continue
+                try:
+                    e = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(e, dict):
+                    _index_add(e.get("run_id"), key, pos, e.get("type"))
+    else:
+        end = st.st_size
+        for e in _read_segment(path):
+            _index_add(e.get("run_id"), key, None, e.get("type"))
+    _indexed[key] = (st.st_ino, st.st_size, st.st_mtime_ns, end)
+
+def _has_run(run_id: str) -> bool:
+    return any(kind == "run" for entries in _run_index.get(run_id, {}).values() for _, kind in entries)
+
+# Pone al dia el indice (un stat por segmento; solo se lee lo nuevo).
+# Con `shard`, solo los segmentos de ese shard. Con `until`, del segmento mas nuevo al mas viejo
+# y se para en cuanto aparece el evento "run" de esa corrida (una corrida reciente no abre los frios).
+def _refresh_run_index(shard: Optional[str] = None, until: Optional[str] = None) -> None:
+    if HISTORY_FILE.exists():
+        migrate_legacy()
+    segments = list_segments()
+    current = {str(_segment_path(seg)) for seg in segments}
+    for key in [k for k in _indexed if k not in current]:
+        _unindex(key)
+
+    if shard is not None:
+        segments = [seg for seg in segments if seg.get("shard", "") == shard]
+    if until is not None:
+        segments = sorted(segments, key=lambda seg: seg.get("month", ""), reverse=True)
+    for seg in segments:
+        _index_segment(_segment_path(seg))
+        if until is not None and _has_run(until):
+            return
+
+# Shard donde buscar una corrida: los eventos van al shard de su sesion (si se sabe) o de su run_id.
+# Sin session_id no se sabe en que shard quedo: se busca en todos.
+def _run_shard(session_id: Optional[str]) -> Optional[str]:
+    return shard_for(session_id) if session_id else None
+
+# Eventos de una corrida dentro de un segmento: directo a sus lineas, o recorriendo el segmento frio
+def _run_events(key: str, entries: List[Tuple[Optional[int], str]], run_id: str) -> List[Dict[str, Any]]:
+    path = Path(key)
+    out: List[Dict[str, Any]] = []
+    try:
+        if entries and entries[0][0] is None:
+            events = _cached_events(path, load=False)
+            for e in events if events is not None else _read_segment(path):
+                if e.get("run_id") == run_id:
+                    out.append(e)
+            return out
+        with path.open("rb") as f:
+            for pos, _ in entries:
+                f.seek(pos)
+                try:
+                    out.append(json.loads(f.readline()))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return out
+
+# Eventos de una corrida en orden de ts (solo lectura). Con refresh=False se responde directo del indice;
+# con refresh=True antes se revalida cada segmento (un stat por segmento, sin releer lo que no cambio).
+# Con session_id solo se revisa el shard de esa sesion.
+def get_run(run_id: str, refresh: bool = True, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _cache_lock:
+        if refresh or not _indexed:
+            _refresh_run_index(_run_shard(session_id))
+        by_path = {key: list(entries) for key, entries in _run_index.get(run_id, {}).items()}
+        events = [e for key, entries in by_path.items() for e in _run_events(key, entries, run_id)]
+    return sorted(events, key=lambda e: e.get("ts", ""))
+
+# True si la corrida ya esta guardada (hay un evento "run" con ese run_id).
+# Solo mira el indice: se revisa del segmento mas nuevo al mas viejo y se para al encontrarla.
+def run_exists(run_id: str, refresh: bool = True, session_id: Optional[str] = None) -> bool:
+    with _cache_lock:
+        if (refresh or not _indexed) and not _has_run(run_id):
+            _refresh_run_index(_run_shard(session_id), until=run_id)
+        return _has_run(run_id)
+
+
+# ===== Mantenimiento =====
+
+# Compacta los segmentos sellados (son inmutables, solo se leen) al formato frio `fmt`
+# (default APIM_COLD_FORMAT); un sellado que ya esta en otro formato frio se convierte.
+# Antes, checkpoint: el journal no debe apuntar a un archivo que se va a borrar.
+def compress_sealed(ns: str = "historial", fmt: Optional[str] = None) -> int:
+    fmt = fmt or COLD_FORMAT
+    if fmt not in COLD_FORMATS:
+        raise ValueError(f"formato desconocido: {fmt} ({' | '.join(COLD_FORMATS)})")
+    base = namespace_dir(ns)
+    _ready()
+    checkpoint()
+    n = 0
+    for shard in _shards(base):
+        with _shard_lock(shard, base):
+            manifest = _load_manifest(shard, base)
+            for seg in manifest["segments"]:
+                if not seg.get("sealed") or _segment_format(seg) == fmt:
+                    continue
+                src = _segment_path(seg, base)
+                # Mismo nombre .jsonl + la extension del formato (la llave del export columnar no cambia)
+                stem = src.name.removesuffix(".gz").removesuffix(".apb")
+                if fmt == "gzip":
+                    dst = src.with_name(stem + ".gz")
+                    if src.suffix == ".jsonl":
+                        with src.open("rb") as fin, gzip.open(dst, "wb") as fout:
+                            for chunk in iter(lambda: fin.read(1 << 20), b""):
+                                fout.write(chunk)
+                    else:
+                        with gzip.open(dst, "wt", encoding="utf-8") as fout:
+                            for e in _read_segment(src):
+                                fout.write(json.dumps(e, ensure_ascii=False) + "\n")
+                else:
+                    dst = src.with_name(stem + ".apb")
+                    codec.write_file(dst, _read_segment(src), compress=fmt == "apb")
+                _fsync_path(dst)
+                seg["name"] = dst.name
+                seg["format"] = fmt
+                seg["compressed"] = fmt != "apb-raw"
+                seg["bytes_compressed"] = dst.stat().st_size
+                _save_manifest(manifest, shard, base)
+                if src != dst:
+                    src.unlink()
+                n += 1
+    return n
+
+# Recalcula los manifests leyendo cada segmento (por si se edito a mano o se perdio)
+def rebuild_manifest(ns: str = "historial") -> List[Dict[str, Any]]:
+    base = namespace_dir(ns)
+    for shard in _shards(base):
+        with _shard_lock(shard, base):
+            manifest = _load_manifest(shard, base)
+            for seg in manifest["segments"]:
+                sealed = seg.get("sealed", False)
+                _seal(seg, base)
+                seg["sealed"] = sealed
+            _save_manifest(manifest, shard, base)
+    return list_segments(base)
+
+# Reparte el historial en n_shards (herramienta offline: correr con la app apagada).
+# El layout anterior se mueve a historial.pre-rebalance-<fecha> y se reescribe evento por evento
+# en el shard que le toca; el respaldo no se borra solo.
+def rebalance(n_shards: int, batch_size: int = 5000) -> Dict[str, Any]:
+    with _lock:
+        if HISTORY_FILE.exists():
+            migrate_legacy()
+
+        # El journal no debe apuntar a la carpeta que se va a mover
+        _ready()
+        checkpoint()
+
+        old_n = sharding.load_map(HISTORY_DIR)["n_shards"]
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        backup = HISTORY_DIR.with_name(f"{HISTORY_DIR.name}.pre-rebalance-{stamp}")
+        if HISTORY_DIR.exists():
+            HISTORY_DIR.rename(backup)
+        new_map = sharding.save_map(HISTORY_DIR, n_shards)
+
+        # Los eventos llegan en orden de ts: se vacia el buffer al cambiar de mes (o al llenarse)
+        n = 0
+        month = None
+        buffer: List[Dict[str, Any]] = []
+
+        if backup.exists():
+            for e in iter_events(base=backup):
+                # Los eventos leidos son del cache: se copian antes de tocarlos
+                e = dict(e)
+                ts = e.setdefault("ts", _now_iso())
+                if buffer and (ts[:7] != month or len(buffer) >= batch_size):
+                    _commit_events("historial", buffer, chunk=batch_size)
+                    buffer = []
+                month = ts[:7]
+                buffer.append(e)
+                n += 1
+        _commit_events("historial", buffer, chunk=batch_size)
+
+        return {
+            "events": n,
+            "from_shards": old_n,
+            "n_shards": new_map["n_shards"],
+            "generation": new_map["generation"],
+            "backup": str(backup) if backup.exists() else None,
+        }
 
 # Guarda una ejecución del sistema, registro del usuario, persona clasificada, puntuacion, resumen del resultado
-def save_run(respuestas: Dict[str, Any], result: Any) -> str:
+# session_id (opcional) decide el shard: todo lo de una sesion queda junto
+@timed("storage.save_run")
+def save_run(
+    respuestas: Dict[str, Any],
+    result: Any,
+    run_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    ts: Optional[str] = None,
+) -> str:
 
-    run_id = str(uuid.uuid4())
+    run_id = run_id or new_run_id()
 
-    events = _load_events()
-    events.append({
+    event = {
         "type": "run",
         "run_id": run_id,
-        "ts": _now_iso(),
         "respuestas": respuestas,
         "resultado": {
             "persona": getattr(result, "persona", ""),
             "score": getattr(result, "score", None),
             "resumen": getattr(result, "resumen", ""),
         }
-    })
-    _save_events(events)
+    }
+    if session_id is not None:
+        event["session_id"] = session_id
+    # ts del submit (no del momento en que el pipeline la escribe)
+    if ts is not None:
+        event["ts"] = ts
+
+    _append_event(event)
     return run_id
 
 #  Guarda feedback del usuario (evaluacion numerica, texto libre opcional)
-def save_feedback(run_id: str, rating: int, comentario: str = "") -> None:
-    events = _load_events()
-    events.append({
+# Con validate=True (opcional, lo usa la app) la corrida debe existir: ValueError si no (feedback huerfano)
+@timed("storage.save_feedback")
+def save_feedback(
+    run_id: str,
+    rating: int,
+    comentario: str = "",
+    session_id: Optional[str] = None,
+    validate: bool = False,
+) -> None:
+    if validate and not run_exists(run_id, session_id=session_id):
+        raise ValueError(f"run_id desconocido: {run_id}")
+
+    event = {
         "type": "feedback",
         "run_id": run_id,
-        "ts": _now_iso(),
         "rating": int(rating),
         "comentario": (comentario or "").strip()
-    })
-    _save_events(events)
+    }
+    if session_id is not None:
+        event["session_id"] = session_id
+
+    _append_event(event)
 
 # V3
 # shadow = registro paralelo del modelo V3
 
-def save_shadow(run_id: str, v3_pred: Dict[str, Any], v2_persona: Optional[str] = None) -> None:
-    events = _load_events()
+@timed("storage.save_shadow")
+# `sample` es la decision del muestreo ({"rate", "weight", "reason"}, ver apim.sampling)
+def save_shadow(
+    run_id: str,
+    v3_pred: Dict[str, Any],
+    v2_persona: Optional[str] = None,
+    sample: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
+) -> None:
     event = {
         "type": "shadow",
         "run_id": run_id,
-        "ts": _now_iso(),
         "v3": v3_pred,
     }
     if v2_persona is not None:
         event["v2_persona"] = v2_persona
+    if sample is not None:
+        event["sample"] = sample
+    if session_id is not None:
+        event["session_id"] = session_id
+
+    _append_event(event)
+
+# Traza de una corrida: spans compactos [nombre, inicio_ms, duracion_ms] (ver apim.tracing)
+@timed("storage.save_trace")
+def save_trace(record: Dict[str, Any], session_id: Optional[str] = None) -> None:
+    event = dict(record, type="trace")
+    if session_id is not None:
+        event["session_id"] = session_id
+    _append_event(event)
 
-    events.append(event)
-    _save_events(events)
 
+# Punto de entrada: python -m apim.storage [manifest|migrate|compress|rebuild|checkpoint] [historial|history]
+#   compress acepta el formato frio al final: python -m apim.storage compress historial apb
+if __name__ == "__main__":
+    import sys
 
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "manifest"
+    ns = sys.argv[2] if len(sys.argv) > 2 else "historial"
+    if cmd == "migrate":
+        print(f"Eventos migrados: {migrate_legacy()}")
+    elif cmd == "compress":
+        fmt = sys.argv[3] if len(sys.argv) > 3 else None
+        print(f"Segmentos compactados: {compress_sealed(ns, fmt)}")
+    elif cmd == "rebuild":
+        print(json.dumps(rebuild_manifest(ns), ensure_ascii=False, indent=2))
+    elif cmd == "checkpoint":
+        _ready()
+        print(f"Archivos sincronizados: {checkpoint()}")
+    else:
+        for seg in list_segments(namespace_dir(ns)):
+            state = "sellado" if seg.get("sealed") else "abierto"
+            name = f"{seg['shard']}/{seg['name']}" if seg.get("shard") else seg["name"]
+            print(f"- {name} | {state} | {seg.get('start_ts')} -> {seg.get('end_ts')} | {seg.get('counts', {})}")
@@ -0,0 +1,84 @@
+from __future__ import annotations
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Trazas por corrida
+# (trace = todo lo que paso en un submit; span = un pedazo con nombre y duracion)
+# Cada submit abre una traza con su run_id; los spans se anotan con `with span("nombre")`.
+# Si no hay traza activa, span() no hace nada.
+
+
+class Trace:
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.ts = datetime.now(timezone.utc).isoformat()
+        self._t0 = time.perf_counter()
+        # [nombre, inicio_ms desde el submit, duracion_ms]
+        self.spans: List[list] = []
+
+    def add(self, name: str, start: float, end: float) -> None:
+        self.spans.append([
+            name,
+            round((start - self._t0) * 1000.0, 3),
+            round((end - start) * 1000.0, 3),
+        ])
+
+    # Milisegundos desde que se abrio la traza
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    # Registro compacto para guardar en el historial
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "type": "trace",
+            "run_id": self.run_id,
+            "ts": self.ts,
+            "total_ms": round(self.elapsed_ms(), 3),
+            "spans": self.spans,
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("apim_trace", default=None)
+
+
+def start_trace(run_id: str) -> Trace:
+    return Trace(run_id)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+# Activa una traza en este hilo/contexto (ej. el hilo del pipeline que sigue el trabajo del submit)
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+# Mide un pedazo de trabajo dentro de la traza activa
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter())
+
+
+# Suma de duracion por nombre de span (un span puede repetirse)
+def breakdown(record: Dict[str, Any]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for name, _, dur in record.get("spans", []):
+        out[name] = out.get(name, 0.0) + float(dur)
+    return out
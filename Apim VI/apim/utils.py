@@ -1,8 +1,10 @@
 from __future__ import annotations
-import json
+import warnings
 from pathlib import Path
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+from apim import storage
 
 # Convierte un valor a int y lo limita a un rango si la conversión falla, devuelve el valor por defecto.
 def clamp_int(value: Any, min_v: int, max_v: int, default: int) -> int:
@@ -12,12 +14,14 @@ def clamp_int(value: Any, min_v: int, max_v: int, default: int) -> int:
         return default
     return max(min_v, min(max_v, v))
 
-# Convierte un valor a float y lo limita a un rango si la conversión falla, devuelve el valor por defecto.
+# Convierte un valor a float y lo limita a un rango si la conversión falla (o es NaN), devuelve el valor por defecto.
 def clamp_float(value: Any, min_v: float, max_v: float, default: float) -> float:
     try:
         v = float(value)
     except (TypeError, ValueError):
         return default
+    if v != v:
+        return default
     return max(min_v, min(max_v, v))
 
 # Formatea cantidad como MXN con separador de miles y sin decimales
@@ -28,34 +32,40 @@ def format_mxn(amount: float) -> str:
         amt = 0.0
     return f"${amt:,.0f} MXN"
 
-#  Asegura que exista la carpeta data/ dentro del proyecto, si no existe, la crea. 
+#  Asegura que exista la carpeta Data/ dentro del proyecto (la misma del motor de almacenamiento), si no existe, la crea. 
 def ensure_data_dir(project_root: Path) -> Path:
-    data_dir = project_root / "data"
+    data_dir = project_root / "Data"
     data_dir.mkdir(parents=True, exist_ok=True)
     return data_dir
 
-# Devuelve la ruta completa al archivo data/history.json.
-def history_path(project_root: Path) -> Path:
-    return ensure_data_dir(project_root) / "history.json"
+# project_root ya no se usa (obsoleto): el historial vive en el Data/ del motor (apim.storage).
+# Si llega, se avisa; si apunta a otro proyecto se rechaza, para no leer ni escribir el almacen real por error.
+def _check_project_root(project_root: Optional[Path]) -> None:
+    if project_root is None:
+        return
+    warnings.warn(
+        "project_root ya no se usa: el historial vive en el Data/ de apim.storage",
+        DeprecationWarning,
+        stacklevel=3,
+    )
+    if (Path(project_root) / "Data").resolve() != storage.DATA_DIR.resolve():
+        raise ValueError(f"project_root distinto del Data/ del motor ({storage.DATA_DIR}): {project_root}")
 
-# Carga el historial desde data/history.json.  Si el archivo no existe o esta corrupto,  devuelve una lista vacia 
-def load_history(project_root: Path) -> List[Dict[str, Any]]:
-    path = history_path(project_root)
-    if not path.exists():
-        return []
-    try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except Exception:
-        return []
-
-# Agrega un nuevo registro al historial en data/history.json.
-    history = load_history(project_root)
-def append_history(project_root: Path, record: Dict[str, Any]) -> None:
-    history = load_history(project_root)
+# Devuelve la carpeta de la coleccion "history" del motor (Data/history/; el data/history.json de antes se migra solo).
+def history_path(project_root: Optional[Path] = None) -> Path:
+    _check_project_root(project_root)
+    return storage.namespace_dir("history")
+
+# Carga el historial en orden de tiempo.  Si no hay registros, devuelve una lista vacia 
+def load_history(project_root: Optional[Path] = None) -> List[Dict[str, Any]]:
+    _check_project_root(project_root)
+    # Copias: los eventos del motor vienen de su cache (solo lectura)
+    return [dict(r) for r in storage.iter_events(base=storage.namespace_dir("history"))]
+
+# Agrega un nuevo registro al historial: un append al segmento del mes (ya no se reescribe todo el archivo).
+# Dentro de storage.batch() se escribe junto con lo demas del lote.
+def append_history(project_root: Optional[Path], record: Dict[str, Any]) -> None:
+    _check_project_root(project_root)
     record = dict(record)
     record["timestamp"] = datetime.now().isoformat(timespec="seconds")
-    history.append(record)
-    history_path(project_root).write_text(
-        json.dumps(history, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+    storage.append("history", record)
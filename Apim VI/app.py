@@ -1,19 +1,67 @@
+import os
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime, timezone
+
+import altair as alt
+import numpy as np
+import pandas as pd
 import streamlit as st
 import apim.dojo as dojo
+from apim import metrics, tracing
 from apim.core import clasificar, recomendaciones
 from apim.dojo import demo_forward_pass, train_on_startup
-from apim.dojo import predict_v3
-from apim.storage import save_shadow
-from apim.storage import save_run, save_feedback
+from apim.inference import get_server
+from apim.pipeline import PostSubmitPipeline
+from apim.storage import new_run_id, save_feedback
+
+# Cuanto espera "Guardar feedback" a que el pipeline guarde la corrida (segundos)
+FEEDBACK_WAIT_S = 2.0
 
 # Para Genio / Jefe NO mostramos el botón, pero igual lo guardamos por si lo piden
 def debe_mostrar_principios(persona: str) -> bool:
     return persona not in ["Jefe de jefes", "Genio financiero"]
 
+# Un solo pipeline post-submit para todas las sesiones (guardar corrida + shadow V3 en segundo plano)
+# Varios hilos de trabajo (APIM_PIPELINE_WORKERS); sus predicciones V3 se juntan en el servidor de micro-batching
+@st.cache_resource
+def get_pipeline() -> PostSubmitPipeline:
+    inference = get_server()
+    pipeline = PostSubmitPipeline(
+        max_queue=256,
+        workers=int(os.environ.get("APIM_PIPELINE_WORKERS", "4")),
+        inference=inference,
+    )
+
+    # Con APIM_METRICS=1: profundidad de cola, overflow, errores y cache V3 salen en el export periodico
+    def gauges() -> dict:
+        s = pipeline.stats()
+        inf = inference.stats()
+        return {
+            "pipeline_depth": s["depth"],
+            "pipeline_overflow": s["overflow"],
+            "pipeline_errors": sum(s["errors"].values()),
+            "shadow_sampled": s["shadow_sampled"],
+            "shadow_skipped": s["shadow_skipped"],
+            "shadow_over_budget": s["shadow_over_budget"],
+            "v3_cache_hit_rate": dojo.prediction_cache_info()["hit_rate"],
+            "v3_queue_depth": inf["depth"],
+            "v3_avg_batch": inf["avg_batch"],
+            "v3_avg_wait_ms": inf["avg_wait_ms"],
+        }
+
+    metrics.register_collector(gauges)
+    metrics.start_exporter()
+    return pipeline
+
 # Configuracion basica 
 st.set_page_config(page_title="APIM VI", page_icon="💸", layout="centered")
 st.title("APIM VI - Test Financiero Inteligente")
 
+# Id de la sesion del navegador: decide el shard del historial (todo lo de una sesion queda junto)
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = new_run_id()
+session_id = st.session_state["session_id"]
+
 # Formulario
 with st.form("form_apim"):
     st.subheader("Ingresa tus respuestas")
@@ -34,9 +82,17 @@ if submitted:
         "registra_gastos": bool(registra),
         "fondo_emergencia_meses": int(fondo_meses),
     }
+# Cada submit abre una traza con su run_id (spans: clasificacion, recomendaciones, guardado, V3)
+    run_id = new_run_id()
+    run_ts = datetime.now(timezone.utc).isoformat()
+    trace = tracing.start_trace(run_id)
+
 # Clasificacion principal y recomendaciones personalizadas
-    result = clasificar(respuestas)
-    reco = recomendaciones(result.persona, respuestas)
+    with tracing.activate(trace):
+        with tracing.span("clasificar"):
+            result = clasificar(respuestas)
+        with tracing.span("recomendaciones"):
+            reco = recomendaciones(result.persona, respuestas)
 
 # Guardamos todo en sesion 
     st.session_state["respuestas"] = respuestas
@@ -44,16 +100,11 @@ if submitted:
     st.session_state["reco"] = reco
     st.session_state["active_section"] = None
 
-    # Guardamos corrida una sola vez
-    run_id = save_run(respuestas, result)
+    # Guardamos corrida una sola vez; guardado + prediccion V3 (shadow) corren fuera del render
     st.session_state["run_id"] = run_id
-
-    # Prediccion silenciosa V3 en modo shadow
-    try:
-        v3_pred = predict_v3(respuestas)
-        save_shadow(run_id, result.persona, v3_pred)
-    except Exception:
-        pass
+    st.session_state["run_job"] = get_pipeline().submit(
+        run_id, respuestas, result, trace=trace, session_id=session_id, ts=run_ts
+    )
 
 
 # Resultados
@@ -77,6 +128,29 @@ if "result" in st.session_state:
         st.code(str(salida))
         st.write(f"Medidor de cercanía (demo): **{medidor:.4f}**")
 
+        # Mapa de calor: el demo en todo el rango de dos sliders, con tus otras respuestas fijas (sale del cache)
+        ejes = {
+            "Ahorro %": "ahorro_mensual_pct",
+            "Compras impulsivas": "compras_impulsivas_sem",
+            "Fondo (meses)": "fondo_emergencia_meses",
+        }
+        c1, c2, c3 = st.columns(3)
+        eje_x = c1.selectbox("Eje X", list(ejes), index=0)
+        eje_y = c2.selectbox("Eje Y", [e for e in ejes if e != eje_x], index=1 if eje_x == "Ahorro %" else 0)
+        capa = c3.selectbox("Mostrar", ["Medidor", "Señal 1", "Señal 2", "Señal 3"])
+
+        grid = dojo.demo_grid_forward(ejes[eje_x], ejes[eje_y], fixed=respuestas)
+        z = grid["medidor"] if capa == "Medidor" else grid["outputs"][:, :, int(capa[-1]) - 1]
+        gx, gy = np.meshgrid(grid["x"], grid["y"])
+        df = pd.DataFrame({"x": gx.ravel().astype(int), "y": gy.ravel().astype(int), "valor": z.ravel()})
+        heatmap = alt.Chart(df).mark_rect().encode(
+            x=alt.X("x:O", title=eje_x),
+            y=alt.Y("y:O", title=eje_y, sort="descending"),
+            color=alt.Color("valor:Q", title=capa),
+            tooltip=["x", "y", alt.Tooltip("valor:Q", format=".4f")],
+        )
+        st.altair_chart(heatmap, use_container_width=True)
+
 
     # Botones de acciones/planes
     col1, col2, col3 = st.columns(3)
@@ -136,8 +210,26 @@ if "result" in st.session_state:
 
     if st.button("Guardar feedback"):
         if run_id:
-            save_feedback(run_id, rating, comentario)
-            st.success(" ✅ Gracias por tu respuesta")
+            saved, pending = True, False
+            try:
+                save_feedback(run_id, rating, comentario, session_id=session_id, validate=True)
+            except ValueError:
+                # La corrida puede seguir en la cola del pipeline: se espera solo a su trabajo (con tope) y se reintenta
+                job = st.session_state.get("run_job")
+                try:
+                    if job is not None:
+                        job.result(timeout=FEEDBACK_WAIT_S)
+                    save_feedback(run_id, rating, comentario, session_id=session_id, validate=True)
+                except FutureTimeout:
+                    saved, pending = False, True
+                except ValueError:
+                    saved = False
+            if saved:
+                st.success(" ✅ Gracias por tu respuesta")
+            elif pending:
+                st.warning("Tu corrida todavía se está guardando; intenta de nuevo en un momento.")
+            else:
+                st.warning("No encontramos esa corrida en el historial; vuelve a clasificar.")
         else:
             st.warning("Primero clasifica para generar un run_id.")
 
@@ -0,0 +1,156 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Tuple
+
+from apim import dojo
+from apim.core import clasificar, detectar_debilidades
+
+# Scoring masivo de respuestas (archivos de campañas)
+# Entrada: JSON Lines (un objeto por linea) desde archivo o stdin. Cada linea puede ser
+#   {"ahorro_mensual_pct": 10, ...}                      -> respuestas directas
+#   {"id": "abc", "respuestas": {"ahorro_mensual_pct": 10, ...}}
+# Salida: JSON Lines en el mismo orden que la entrada, con V2 (clasificar), debilidades y V3.
+#
+# Las lineas se parten en chunks y se reparten en un pool de procesos. Solo hay `workers * 2`
+# chunks en vuelo a la vez: la memoria no crece con el tamaño del archivo.
+
+
+def _init_worker() -> None:
+    if dojo.TORCH_AVAILABLE:
+        import torch
+
+        # Un hilo por proceso: N procesos x N hilos saturaria la maquina
+        torch.set_num_threads(1)
+
+
+# Califica un chunk de lineas crudas; regresa (lineas de salida, ok, errores)
+# Nada de una linea o de V3 tumba el chunk (ni el pool): la linea o su "v3" quedan marcados con el error
+def score_chunk(lines: List[str], first_line: int, with_v3: bool = True) -> Tuple[List[str], int, int]:
+    records: List[Dict[str, Any]] = []
+    valid: List[Tuple[int, Dict[str, Any]]] = []
+
+    for i, raw in enumerate(lines):
+        n = first_line + i
+        try:
+            obj = json.loads(raw)
+            if not isinstance(obj, dict):
+                raise ValueError("la linea no es un objeto")
+            respuestas = obj["respuestas"] if isinstance(obj.get("respuestas"), dict) else obj
+            result = clasificar(respuestas)
+            record = {
+                "line": n,
+                "id": obj.get("id"),
+                "ok": True,
+                "v2": asdict(result),
+                "debilidades": detectar_debilidades(respuestas),
+            }
+            valid.append((len(records), respuestas))
+        except Exception as exc:
+            record = {"line": n, "id": None, "ok": False, "reason": f"{type(exc).__name__}: {exc}"}
+        records.append(record)
+
+    # V3 en un solo forward pass para todo el chunk
+    if with_v3 and valid:
+        try:
+            preds = dojo.predict_v3_batch([r for _, r in valid])
+        except Exception as exc:
+            reason = f"{type(exc).__name__}: {exc}"
+            preds = [{"ok": False, "reason": reason} for _ in valid]
+        for (idx, _), pred in zip(valid, preds):
+            records[idx]["v3"] = pred
+
+    out = [json.dumps(r, ensure_ascii=False) for r in records]
+    return out, len(valid), len(records) - len(valid)
+
+
+# Chunks (numero de primera linea, lineas) leidos de a poco; se saltan lineas vacias pero se respeta su numero
+def _chunks(f, chunk_size: int) -> Iterator[Tuple[int, List[str]]]:
+    numbered = ((n, line) for n, line in enumerate(f, start=1) if line.strip())
+    while True:
+        block = list(itertools.islice(numbered, chunk_size))
+        if not block:
+            return
+        yield block[0][0], [line for _, line in block]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scoring masivo V2 + V3 de respuestas en JSON Lines")
+    parser.add_argument("input", nargs="?", default="-", help="archivo .jsonl de entrada ('-' = stdin)")
+    parser.add_argument("-o", "--output", default="-", help="archivo .jsonl de salida ('-' = stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos (0 = sin pool)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="lineas por chunk")
+    parser.add_argument("--no-v3", action="store_true", help="solo V2 (sin inferencia V3)")
+    parser.add_argument("--progress", type=float, default=2.0, help="segundos entre reportes de avance")
+    args = parser.parse_args()
+
+    fin = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with_v3 = not args.no_v3
+
+    t0 = time.perf_counter()
+    last_report = t0
+    totals = {"lines": 0, "ok": 0, "errors": 0}
+
+    # Escribe un chunk ya calificado y reporta avance a stderr (stdout puede ser la salida)
+    def write(result: Tuple[List[str], int, int]) -> None:
+        nonlocal last_report
+        out, ok, errors = result
+        fout.write("".join(line + "\n" for line in out))
+        totals["lines"] += len(out)
+        totals["ok"] += ok
+        totals["errors"] += errors
+
+        now = time.perf_counter()
+        if now - last_report >= args.progress:
+            last_report = now
+            rate = totals["lines"] / (now - t0)
+            print(f"... {totals['lines']:,} lineas | {rate:,.0f} lineas/s | errores={totals['errors']}", file=sys.stderr)
+
+    try:
+        chunks = _chunks(fin, max(1, args.chunk_size))
+        if args.workers <= 0:
+            for first, lines in chunks:
+                write(score_chunk(lines, first, with_v3))
+        else:
+            # spawn: procesos limpios, sin heredar hilos de torch del proceso padre
+            with ProcessPoolExecutor(
+                max_workers=args.workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+            ) as pool:
+                # Cola de futures en orden de entrada: se escribe siempre el mas viejo
+                pending: deque = deque()
+                for first, lines in chunks:
+                    pending.append(pool.submit(score_chunk, lines, first, with_v3))
+                    if len(pending) >= args.workers * 2:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+        else:
+            fout.flush()
+
+    dt = time.perf_counter() - t0
+    rate = totals["lines"] / dt if dt > 0 else 0.0
+    print(
+        f"Listo: {totals['lines']:,} lineas ({totals['ok']:,} ok, {totals['errors']:,} con error)"
+        f" en {dt:.2f}s | {rate:,.0f} lineas/s",
+        file=sys.stderr,
+    )
+
+
+# Punto de entrada para correr el scoring desde terminal
+if __name__ == "__main__":
+    main()
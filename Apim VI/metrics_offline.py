@@ -1,102 +1,206 @@
+import argparse
 import json
-from collections import Counter
-from statistics import mean
+import time
+from typing import Any, Dict
 
-# Ruta al historial donde quedo todo lo que ha pasado
-HIST = "Data/historial.json"
+import numpy as np
+
+from apim.columnar import load_columns
+from apim.features import PROFILE_TO_ID
 
 # Rangos de confidence solo para analizar que tan seguro anda el modelo y entender su comportamiento
 BUCKET_EDGES = [0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 1.01]
 BUCKET_LABELS = ["0.0-0.5", "0.5-0.6", "0.6-0.7", "0.7-0.8", "0.8-0.9", "0.9-1.0"]
 
 # alto riesgo si se equivoca con >= esto
-HIGH_CONF_THRESHOLD = 0.6  
-
-def bucket_of(conf: float) -> str | None:
-    for i, label in enumerate(BUCKET_LABELS):
-        if BUCKET_EDGES[i] <= conf < BUCKET_EDGES[i + 1]:
-            return label
-    return None
-
-
-def main() -> None:
-    with open(HIST, "r", encoding="utf-8") as f:
-        events = json.load(f)
+HIGH_CONF_THRESHOLD = 0.6
+
+# Cuantos errores / confusiones mostrar
+TOP_K = 5
+
+# id -> persona; el ultimo renglon/columna de la matriz es "persona desconocida o vacia" (id -1)
+ID_TO_PROFILE = {i: p for p, i in PROFILE_TO_ID.items()}
+N_CLASSES = len(PROFILE_TO_ID)
+LABELS = [ID_TO_PROFILE[i] for i in range(N_CLASSES)] + [""]
+
+
+# Todas las metricas sobre arreglos (sin loops por evento)
+# v2_id / v3_id: int (-1 = desconocido), confidence: float, run_id: bytes. Solo shadows con v3 ok.
+# weight: peso del muestreo shadow (1/rate). Las tasas y conteos estimados se reponderan;
+# `total`, `n` por bucket y los errores con alta confidence siguen siendo muestras reales.
+def compute_metrics(
+    v2_id: np.ndarray,
+    v3_id: np.ndarray,
+    confidence: np.ndarray,
+    run_id: np.ndarray,
+    weight: np.ndarray | None = None,
+) -> Dict[str, Any]:
+    total = int(len(confidence))
+    conf = confidence.astype(np.float64)
+    w = np.ones(total) if weight is None else weight.astype(np.float64)
+    w_total = float(w.sum())
+
+    known = (v2_id >= 0) & (v3_id >= 0)
+    match = known & (v2_id == v3_id)
+    matches = int(match.sum())
+
+    # Matriz de confusion (N+1)x(N+1): el -1 se manda a la ultima posicion (conteos estimados)
+    k = N_CLASSES + 1
+    r = np.where(v2_id >= 0, v2_id, N_CLASSES).astype(np.int64)
+    c = np.where(v3_id >= 0, v3_id, N_CLASSES).astype(np.int64)
+    full = np.rint(np.bincount(r * k + c, weights=w, minlength=k * k)).astype(np.int64).reshape(k, k)
+
+    # Buckets: edges[i] <= conf < edges[i+1]  ->  indice i
+    nb = len(BUCKET_LABELS)
+    b = np.digitize(conf, BUCKET_EDGES) - 1
+    in_bucket = (b >= 0) & (b < nb)
+    bucket_n = np.bincount(b[in_bucket], minlength=nb)
+    bucket_total = np.bincount(b[in_bucket], weights=w[in_bucket], minlength=nb)
+    bucket_ok = np.bincount(b[in_bucket & match], weights=w[in_bucket & match], minlength=nb)
+    bucket_conf = np.bincount(b[in_bucket], weights=(w * conf)[in_bucket], minlength=nb)
+
+    # ECE (error de calibracion esperado) = promedio ponderado de |accuracy - confidence| por bucket
+    nonempty = bucket_total > 0
+    gap = np.zeros(nb)
+    gap[nonempty] = np.abs(bucket_ok[nonempty] / bucket_total[nonempty] - bucket_conf[nonempty] / bucket_total[nonempty])
+    ece = float((gap * bucket_total).sum() / w_total) if w_total else 0.0
+
+    # Top confusiones: todo lo que no fue match (como antes, incluye desconocidos)
+    errors = full.copy()
+    errors[np.arange(N_CLASSES), np.arange(N_CLASSES)] = 0
+    flat = errors.ravel()
+    order = np.argsort(-flat, kind="stable")[:TOP_K]
+    top_errors = [
+        {"v2": LABELS[i // k], "v3": LABELS[i % k], "n": int(flat[i])}
+        for i in order if flat[i] > 0
+    ]
 
-# Nos quedamos solo con eventos shadow donde V3 sí dio predicción válida
-    shadows = [
-        e for e in events
-        if e.get("type") == "shadow" and e.get("v3", {}).get("ok") is True
+    # Errores con alta confidence: argpartition para no ordenar todo
+    hc_idx = np.flatnonzero(known & ~match & (conf >= HIGH_CONF_THRESHOLD))
+    if len(hc_idx) > TOP_K:
+        hc_top = hc_idx[np.argpartition(-conf[hc_idx], TOP_K)[:TOP_K]]
+    else:
+        hc_top = hc_idx
+    hc_top = hc_top[np.argsort(-conf[hc_top], kind="stable")]
+
+    return {
+        "total": total,
+        "weighted_total": w_total,
+        "matches": matches,
+        "accuracy": float(w[match].sum() / w_total) if w_total else 0.0,
+        "avg_confidence": float((w * conf).sum() / w_total) if w_total else 0.0,
+        "ece": ece,
+        "buckets": [
+            {
+                "label": label,
+                "n": int(bucket_n[i]),
+                "accuracy": float(bucket_ok[i] / bucket_total[i]) if bucket_total[i] else None,
+                "avg_confidence": float(bucket_conf[i] / bucket_total[i]) if bucket_total[i] else None,
+            }
+            for i, label in enumerate(BUCKET_LABELS)
+        ],
+        # Renglon = V2, columna = V3 (solo personas conocidas)
+        "labels": LABELS[:N_CLASSES],
+        "confusion": full[:N_CLASSES, :N_CLASSES].tolist(),
+        "top_errors": top_errors,
+        "high_conf_threshold": HIGH_CONF_THRESHOLD,
+        "high_conf_errors": int(len(hc_idx)),
+        "high_conf_top": [
+            {
+                "run_id": run_id[i].decode("ascii", "replace") if isinstance(run_id[i], bytes) else str(run_id[i]),
+                "v2": LABELS[r[i]],
+                "v3": LABELS[c[i]],
+                "confidence": float(conf[i]),
+            }
+            for i in hc_top
+        ],
+    }
+
+
+# Mismo reporte de texto de siempre (+ matriz de confusion y ECE)
+def render_text(m: Dict[str, Any]) -> str:
+    lines = [
+        f"Comparaciones (shadow válidos): {m['total']}",
+    ]
+    # Con muestreo shadow, cuantas corridas representan esas muestras
+    if round(m["weighted_total"]) != m["total"]:
+        lines.append(f"Corridas representadas (repondera muestreo): {m['weighted_total']:.0f}")
+    lines += [
+        f"Accuracy V3 vs V2: {m['accuracy']:.2%}",
+        f"Confidence promedio: {m['avg_confidence']:.3f}",
+        "",
+        "Accuracy por bucket de confidence:",
     ]
+    for b in m["buckets"]:
+        if b["n"] == 0:
+            lines.append(f"- {b['label']}: (sin datos)")
+        else:
+            lines.append(f"- {b['label']}: {b['accuracy']:.2%}  (n={b['n']})")
 
-# Si no hay datos, no hay nada que analizar
-    if not shadows:
-        print("No hay eventos shadow válidos (v3 ok=True).")
-        return
+    lines += ["", "Top errores (V2 -> V3):"]
+    for e in m["top_errors"]:
+        lines.append(f"- {e['v2']} -> {e['v3']}: {e['n']}")
 
-    total = len(shadows)
-    matches = 0
+    lines += ["", f"Errores con alta confidence (>= {m['high_conf_threshold']}): {m['high_conf_errors']}"]
+    for e in m["high_conf_top"]:
+        lines.append(f"- run_id={e['run_id']} | {e['v2']} -> {e['v3']} | conf={e['confidence']:.3f}")
 
-# Sacamos el promedio que se guardo  de todas las confidence 
-    confs: list[float] = []
+    lines += ["", f"ECE (error de calibracion): {m['ece']:.4f}", "", "Matriz de confusion (renglon = V2, columna = V3):"]
+    for i, label in enumerate(m["labels"]):
+        cells = " ".join(f"{n:>8d}" for n in m["confusion"][i])
+        lines.append(f"  [{i}] {label:<24} {cells}")
 
-# Contador de errores (V2 -> V3)
-    errors = Counter() # 
+    return "\n".join(lines)
 
-# Conteo por rango
-    bucket_total = {k: 0 for k in BUCKET_LABELS}
-    bucket_ok = {k: 0 for k in BUCKET_LABELS}
 
-    high_conf_errors: list[tuple[str, str, str, float]] = []
+# Arreglos sinteticos para medir el motor sin depender del historial
+def _bench(n: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    v2 = rng.integers(0, N_CLASSES, n, dtype=np.int8)
+    v3 = np.where(rng.random(n) < 0.8, v2, rng.integers(0, N_CLASSES, n, dtype=np.int8)).astype(np.int8)
+    conf = rng.uniform(0.25, 1.0, n).astype(np.float32)
+    run_id = np.zeros(n, dtype="S36")
 
-    for s in shadows:
-        v2 = s.get("v2_persona", "") 
-        v3 = s.get("v3", {}).get("pred_persona", "")
-        conf = float(s.get("v3", {}).get("confidence", 0.0))
-        confs.append(conf)
+    t0 = time.perf_counter()
+    m = compute_metrics(v2, v3, conf, run_id)
+    dt = time.perf_counter() - t0
+    print(f"bench: {n:,} shadows en {dt:.2f} s ({n / dt:,.0f}/s) | accuracy={m['accuracy']:.2%} | ece={m['ece']:.4f}")
 
-        b = bucket_of(conf)
-        if b is not None:
-            bucket_total[b] += 1
 
-        # v3 coincide con V2
-        if v2 and v3 and (v2 == v3):
-            matches += 1
-            if b is not None:
-                bucket_ok[b] += 1
-        else:
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Metricas offline de V3 (shadow) contra V2")
+    parser.add_argument("--json", default=None, help="tambien escribir las metricas en JSON (ruta o '-' para stdout)")
+    parser.add_argument("--bench", type=int, default=0, help="solo medir el motor con N shadows sinteticos")
+    args = parser.parse_args()
 
-            # contamos confusiones
-            errors[(v2, v3)] += 1
+    if args.bench:
+        _bench(args.bench)
+        return
 
-             # Estaba seguro y aún así se equivoco, error serio
-            if v2 and v3 and conf >= HIGH_CONF_THRESHOLD and (v2 != v3):
-                high_conf_errors.append((s.get("run_id", ""), v2, v3, conf))
+    # Export columnar del historial (sync incremental antes de leer); solo nos interesan los shadow
+    cols = load_columns("shadow", refresh=True)
 
- # Metricas finales
-    acc = matches / total
-    avg_conf = mean(confs) if confs else 0.0
+# Nos quedamos solo con eventos shadow donde V3 sí dio predicción válida
+    ok = cols["ok"]
 
-    print(f"Comparaciones (shadow válidos): {total}")
-    print(f"Accuracy V3 vs V2: {acc:.2%}")
-    print(f"Confidence promedio: {avg_conf:.3f}")
+# Si no hay datos, no hay nada que analizar
+    if not ok.any():
+        print("No hay eventos shadow válidos (v3 ok=True).")
+        return
 
-    print("\nAccuracy por bucket de confidence:")
-    for k in BUCKET_LABELS:
-        if bucket_total[k] == 0:
-            print(f"- {k}: (sin datos)")
-        else:
-            print(f"- {k}: {(bucket_ok[k] / bucket_total[k]):.2%}  (n={bucket_total[k]})")
+    m = compute_metrics(
+        cols["v2_id"][ok], cols["v3_id"][ok], cols["confidence"][ok], cols["run_id"][ok], weight=cols["weight"][ok]
+    )
 
-    print("\nTop errores (V2 -> V3):")
-    for (v2p, v3p), n in errors.most_common(5):
-        print(f"- {v2p} -> {v3p}: {n}")
+    if args.json == "-":
+        print(json.dumps(m, ensure_ascii=False, indent=2))
+        return
 
-    print(f"\nErrores con alta confidence (>= {HIGH_CONF_THRESHOLD}): {len(high_conf_errors)}")
-    for run_id, v2p, v3p, c in sorted(high_conf_errors, key=lambda x: -x[3])[:5]:
-        print(f"- run_id={run_id} | {v2p} -> {v3p} | conf={c:.3f}")
+    print(render_text(m))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(m, f, ensure_ascii=False, indent=2)
 
 # Punto de entrada para correr el análisis desde terminal
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,165 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from statistics import mean, pstdev
+
+import numpy as np
+
+from apim import dojo
+
+# Sweep de hiperparametros para el entrenador V3
+# (k-fold = partir los datos en k pedazos, entrenar con k-1 y medir accuracy en el que queda fuera)
+# Cada config corre en su propio proceso; torch usa 1 hilo por proceso para no pelearse por los cores.
+
+GRID = {
+    "epochs": [10, 20, 40],
+    "batch_size": [8, 32, 128],
+    "lr": [1e-3, 3e-3, 1e-2],
+    "n_hidden": [8, 16, 32],
+}
+
+# Datos compartidos por cada worker (se cargan una vez en el initializer, no por tarea)
+_X = None
+_y = None
+_w = None
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray, w: np.ndarray) -> None:
+    global _X, _y, _w
+    import torch
+
+    # Un hilo por proceso: N procesos x N hilos saturaria la maquina
+    torch.set_num_threads(1)
+    _X, _y, _w = X, y, w
+
+
+# Indices (train, test) de cada fold, barajados con semilla fija.
+# Los folds son sobre filas unicas: una misma entrada nunca queda en train y test a la vez.
+def kfold_indices(n: int, k: int, seed: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    idx = np.random.default_rng(seed).permutation(n)
+    folds = np.array_split(idx, k)
+    return [
+        (np.concatenate([f for j, f in enumerate(folds) if j != i]), folds[i])
+        for i in range(k)
+    ]
+
+
+# Evalua una config con k-fold y regresa accuracy held-out contra V2 + tiempo
+def _eval_config(config: dict, k: int, seed: int) -> dict:
+    import torch
+    from torch.utils.data import TensorDataset, Subset
+
+    t0 = time.perf_counter()
+    dataset = TensorDataset(
+        torch.tensor(_X, dtype=torch.float32),
+        torch.tensor(_y, dtype=torch.long),
+        torch.tensor(_w, dtype=torch.float32),
+    )
+
+    accs = []
+    for i, (train_idx, test_idx) in enumerate(kfold_indices(len(dataset), k, seed)):
+        model, _ = dojo.fit_dojonet(Subset(dataset, train_idx.tolist()), seed=seed + i, **config)
+        accs.append(dojo.evaluate_accuracy(model, Subset(dataset, test_idx.tolist())))
+
+    return {
+        "config": config,
+        "acc_mean": mean(accs),
+        "acc_std": pstdev(accs),
+        "fold_accs": accs,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# Todas las combinaciones del grid, o una muestra aleatoria de ellas
+def build_configs(n_random: int | None, seed: int) -> list[dict]:
+    keys = list(GRID)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*GRID.values())]
+    if n_random is not None and n_random < len(configs):
+        configs = random.Random(seed).sample(configs, n_random)
+    return configs
+
+
+# Guarda la mejor config donde la busca train_on_startup (escritura atomica)
+def write_best(best: dict, k: int, n: int) -> None:
+    payload = {
+        "config": best["config"],
+        "cv_accuracy": best["acc_mean"],
+        "cv_accuracy_std": best["acc_std"],
+        "k": k,
+        "n": n,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    path = dojo.TRAIN_CONFIG_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sweep de hiperparametros V3 con k-fold")
+    parser.add_argument("--k", type=int, default=5, help="numero de folds")
+    parser.add_argument("--random", type=int, default=None, help="probar N configs al azar del grid")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-write", action="store_true", help="no guardar la mejor config")
+    args = parser.parse_args()
+
+    if not dojo.TORCH_AVAILABLE:
+        print("El sweep necesita torch instalado.")
+        return
+
+    dataset = dojo.FinancialDataset.from_columnar()
+    if len(dataset) < args.k * 2:
+        print(f"Muy pocos ejemplos unicos para {args.k}-fold: n_unique={len(dataset)}")
+        return
+
+    X = np.asarray(dataset.X, dtype=np.float32)
+    y = np.asarray(dataset.y, dtype=np.int64)
+    w = np.asarray(dataset.w, dtype=np.float32)
+    configs = build_configs(args.random, args.seed)
+
+    print(
+        f"Sweep V3: {len(configs)} configs x {args.k} folds | n={dataset.n_samples}"
+        f" (unicos={len(dataset)}) | workers={args.workers}"
+    )
+
+    # spawn: procesos limpios, sin heredar hilos de torch del proceso padre
+    t0 = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(X, y, w),
+    ) as pool:
+        futures = [pool.submit(_eval_config, c, args.k, args.seed) for c in configs]
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            c = r["config"]
+            print(
+                f"- epochs={c['epochs']:<3} batch={c['batch_size']:<4} lr={c['lr']:<6g} hidden={c['n_hidden']:<3}"
+                f" | acc={r['acc_mean']:.2%} ±{r['acc_std']:.2%} | {r['seconds']:.2f}s"
+            )
+
+    # Mejor accuracy; en empate, la mas rapida
+    results.sort(key=lambda r: (-r["acc_mean"], r["seconds"]))
+    best = results[0]
+    print(f"\nTiempo total: {time.perf_counter() - t0:.2f}s")
+    print(f"Mejor config: {best['config']} | acc={best['acc_mean']:.2%}")
+
+    if not args.no_write:
+        write_best(best, args.k, dataset.n_samples)
+        print(f"Guardada en {dojo.TRAIN_CONFIG_PATH}")
+
+
+# Punto de entrada para correr el sweep desde terminal
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+
+from apim.storage import load_events
+from apim.tracing import breakdown
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Corridas mas lentas y en que se les fue el tiempo")
+    parser.add_argument("-n", type=int, default=10, help="cuantas corridas mostrar")
+    parser.add_argument("--since", default=None, help="solo trazas desde esta fecha ISO (ej. 2026-10-01)")
+    args = parser.parse_args()
+
+# Solo los registros de traza (uno por submit), abriendo solo los segmentos del rango
+    traces = load_events(start=args.since, types={"trace"})
+
+    if not traces:
+        print("No hay trazas guardadas.")
+        return
+
+    traces.sort(key=lambda t: -float(t.get("total_ms", 0.0)))
+
+    print(f"Trazas: {len(traces)} | mostrando las {min(args.n, len(traces))} mas lentas\n")
+    for t in traces[: args.n]:
+        print(f"- run_id={t.get('run_id', '')} | ts={t.get('ts', '')} | total={float(t.get('total_ms', 0.0)):.1f} ms")
+
+        # Spans de mayor a menor duracion
+        for name, ms in sorted(breakdown(t).items(), key=lambda kv: -kv[1]):
+            print(f"    {name:<16} {ms:>9.2f} ms")
+
+
+# Punto de entrada para correr el análisis desde terminal
+if __name__ == "__main__":
+    main()
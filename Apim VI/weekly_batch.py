@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List, Set
+
+from apim import memory_json, storage
+from apim.reporting import build_weekly_report
+
+# Reportes semanales en lote para todas las memorias de usuario
+# Cada memoria se procesa en un proceso del pool: filas, zona global, tendencia y snapshot;
+# el snapshot se agrega a la memoria (escritura atomica) y el resultado va a un JSON Lines consolidado.
+#
+# - Fallos parciales: un usuario que truena queda como {"status": "error"} y el lote sigue.
+# - Reanudable: cada snapshot lleva la semana ISO ("week"); si la memoria ya tiene el de esta
+#   semana no se vuelve a agregar. Ademas, los archivos que ya estan en la salida se saltan.
+
+REPORTS_NAME = "reports"
+
+
+# Carpeta de salida dentro del almacen (se resuelve al llamar para seguir a storage.DATA_DIR)
+def _reports_dir() -> Path:
+    return storage.DATA_DIR / REPORTS_NAME
+
+
+# Semana ISO actual, ej. 2026-W42
+def current_week() -> str:
+    year, week, _ = datetime.now().isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+# Reporte de un usuario: lee su memoria, calcula y (si toca) guarda el snapshot
+def report_user(path: str, week: str, n_events: int, dry_run: bool = False) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {"path": path, "user_id": None, "week": week}
+    try:
+        memory = memory_json.load_memory_file(Path(path))
+        out["user_id"] = memory.get("user", {}).get("id") or Path(path).stem
+
+        snaps = memory.get("weekly_snapshots", [])
+        if snaps and snaps[-1].get("week") == week:
+            out.update(status="skipped", reason="ya_tiene_snapshot", snapshot=snaps[-1])
+        else:
+            report = build_weekly_report(memory, n_events=n_events)
+            if not report["ok"]:
+                out.update(status="skipped", reason=report["reason"])
+            else:
+                snapshot = dict(report["snapshot"], week=week)
+                if not dry_run:
+                    memory.setdefault("weekly_snapshots", []).append(snapshot)
+                    memory_json.save_memory_file(Path(path), memory)
+                out.update(status="ok", rows=report["rows"], snapshot=snapshot)
+    except Exception as exc:
+        out.update(status="error", reason=f"{type(exc).__name__}: {exc}")
+
+    out["seconds"] = time.perf_counter() - t0
+    return out
+
+
+# Archivos que ya quedaron en la salida (para reanudar sin repetir)
+def _done_paths(output: Path) -> Set[str]:
+    done: Set[str] = set()
+    if not output.exists():
+        return done
+    with output.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Los errores se reintentan en la siguiente corrida
+            if r.get("status") in ("ok", "skipped"):
+                done.add(r["path"])
+    return done
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reporte semanal en lote para todas las memorias")
+    parser.add_argument("paths", nargs="*", help="archivos de memoria (default: todas las del almacen)")
+    parser.add_argument("--week", default=None, help="semana ISO del lote (default: la actual)")
+    parser.add_argument("--events", type=int, default=5, help="ultimos N eventos por usuario")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos (0 = sin pool)")
+    parser.add_argument("--output", default=None, help="JSON Lines consolidado (default: Data/reports/weekly-<semana>.jsonl)")
+    parser.add_argument("--dry-run", action="store_true", help="no guardar snapshots en las memorias")
+    parser.add_argument("--slowest", type=int, default=5, help="cuantos usuarios lentos mostrar")
+    args = parser.parse_args()
+
+    week = args.week or current_week()
+    output = Path(args.output) if args.output else _reports_dir() / f"weekly-{week}.jsonl"
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    paths = [str(p) for p in (args.paths or memory_json.list_memory_files())]
+    done = _done_paths(output)
+    todo = [p for p in paths if p not in done]
+    print(f"Reporte semanal {week}: {len(paths)} memorias | ya hechas={len(paths) - len(todo)} | por hacer={len(todo)}")
+
+    t0 = time.perf_counter()
+    results: List[Dict[str, Any]] = []
+    # Un resultado por linea en cuanto llega: si el lote se corta, lo hecho queda en la salida
+    with output.open("a", encoding="utf-8") as fout:
+        def collect(r: Dict[str, Any]) -> None:
+            fout.write(json.dumps(r, ensure_ascii=False) + "\n")
+            fout.flush()
+            results.append({k: r.get(k) for k in ("path", "user_id", "status", "reason", "seconds")})
+
+        if args.workers <= 0:
+            for p in todo:
+                collect(report_user(p, week, args.events, args.dry_run))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn")) as pool:
+                futures = pool.map(
+                    report_user,
+                    todo,
+                    [week] * len(todo),
+                    [args.events] * len(todo),
+                    [args.dry_run] * len(todo),
+                    chunksize=max(1, len(todo) // (args.workers * 8)),
+                )
+                for r in futures:
+                    collect(r)
+
+    total = time.perf_counter() - t0
+    by_status: Dict[str, int] = {}
+    for r in results:
+        by_status[r["status"]] = by_status.get(r["status"], 0) + 1
+    secs = [r["seconds"] for r in results]
+
+    print(f"\nListo en {total:.2f}s | {by_status} | salida: {output}")
+    if secs:
+        print(
+            f"Tiempo por usuario: p50={median(secs) * 1000:.1f} ms | p95={_pct(secs, 0.95) * 1000:.1f} ms"
+            f" | max={max(secs) * 1000:.1f} ms"
+        )
+        print("Mas lentos:")
+        for r in sorted(results, key=lambda r: -r["seconds"])[: args.slowest]:
+            print(f"- {r['user_id'] or r['path']} | {r['status']} | {r['seconds'] * 1000:.1f} ms")
+
+    errors = [r for r in results if r["status"] == "error"]
+    if errors:
+        print(f"\nErrores ({len(errors)}); se reintentan al volver a correr:")
+        for r in errors[:10]:
+            print(f"- {r['path']}: {r['reason']}")
+
+
+# Punto de entrada para correr el lote desde terminal
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Las pruebas de apim/ importan el paquete desde la carpeta de la app
+APP_DIR = Path(__file__).resolve().parents[1] / "Apim VI"
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+
+# Data/ temporal: historial, memoria, columnar, modelos y journal de la prueba quedan en tmp_path
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    from apim import columnar, dojo, drift, registry, storage
+
+    data = tmp_path / "Data"
+    monkeypatch.setattr(storage, "DATA_DIR", data)
+    monkeypatch.setattr(storage, "HISTORY_FILE", data / "historial.json")
+    monkeypatch.setattr(storage, "HISTORY_DIR", data / "historial")
+    monkeypatch.setattr(storage, "LEGACY_DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(columnar, "COLUMNAR_DIR", data / "columnar")
+    monkeypatch.setattr(registry, "REGISTRY_DIR", data / "models")
+    monkeypatch.setattr(dojo, "MODEL_PATH", data / "dojo_v3.pt")
+    monkeypatch.setattr(dojo, "NPZ_PATH", data / "dojo_v3.npz")
+    monkeypatch.setattr(dojo, "TRAIN_CONFIG_PATH", data / "dojo_v3_config.json")
+    storage.clear_cache()
+    yield data
+    # Lo que el monitor de drift junto en la prueba se escribe aqui, no en el Data/ real al salir
+    drift.flush()
+    # El journal y los fsync pendientes tambien: si no, el checkpoint de salida abre el Data/ real
+    storage.checkpoint()
+    storage.clear_cache()
+
+
+# Modelo V3 chico con pesos al azar (NumPy, sin torch) como modelo "legacy" en el Data/ temporal
+@pytest.fixture
+def v3_model(data_dir, monkeypatch):
+    import numpy as np
+
+    from apim import dojo
+
+    rng = np.random.default_rng(0)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(
+        dojo.NPZ_PATH,
+        **{
+            "fc1.weight": rng.standard_normal((16, 4)).astype(np.float32),
+            "fc1.bias": np.zeros(16, np.float32),
+            "fc2.weight": rng.standard_normal((len(dojo.PROFILE_TO_ID), 16)).astype(np.float32),
+            "fc2.bias": np.zeros(len(dojo.PROFILE_TO_ID), np.float32),
+        },
+    )
+    monkeypatch.setenv("APIM_V3_ENGINE", "numpy")
+    dojo.clear_prediction_cache()
+    yield dojo.NPZ_PATH
+    dojo.clear_prediction_cache()
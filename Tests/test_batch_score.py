@@ -0,0 +1,88 @@
+# Pruebas del scoring masivo (chunks con numero de linea, errores por linea, V3 por lote, orden de salida)
+import io
+import json
+import subprocess
+import sys
+
+from conftest import APP_DIR
+
+import batch_score
+
+GOOD = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 1, "registra_gastos": True, "fondo_emergencia_meses": 3}
+
+
+def test_chunks_skip_blank_lines_but_keep_line_numbers():
+    f = io.StringIO("a\n\nb\nc\n   \nd\n")
+    assert list(batch_score._chunks(f, 2)) == [(1, ["a\n", "b\n"]), (4, ["c\n", "d\n"])]
+
+
+def test_score_chunk_reports_bad_lines_and_keeps_order(v3_model):
+    lines = [
+        json.dumps(GOOD),
+        "no es json",
+        json.dumps([1, 2]),
+        json.dumps({"id": "abc", "respuestas": GOOD}),
+    ]
+    out, ok, errors = batch_score.score_chunk(lines, first_line=10)
+    records = [json.loads(line) for line in out]
+
+    assert (ok, errors) == (2, 2)
+    assert [r["line"] for r in records] == [10, 11, 12, 13]
+    assert [r["ok"] for r in records] == [True, False, False, True]
+    assert records[3]["id"] == "abc" and records[3]["v2"] == records[0]["v2"]
+    assert records[1]["reason"].startswith("JSONDecodeError")
+    # V3 del lote: la misma prediccion que una por una
+    from apim import dojo
+
+    assert records[0]["v3"]["pred_persona"] == dojo.predict_v3(GOOD)["pred_persona"]
+    assert "v3" not in records[1]
+
+
+def test_score_chunk_without_v3():
+    out, ok, _ = batch_score.score_chunk([json.dumps(GOOD)], 1, with_v3=False)
+    assert ok == 1 and "v3" not in json.loads(out[0])
+
+
+def test_cli_with_process_pool_keeps_input_order(tmp_path):
+    src = tmp_path / "in.jsonl"
+    dst = tmp_path / "out.jsonl"
+    rows = [dict(GOOD, ahorro_mensual_pct=i % 50) for i in range(25)]
+    src.write_text("\n".join(json.dumps({"id": str(i), "respuestas": r}) for i, r in enumerate(rows)), encoding="utf-8")
+
+    proc = subprocess.run(
+        [sys.executable, "batch_score.py", str(src), "-o", str(dst), "--workers", "2", "--chunk-size", "4", "--no-v3"],
+        cwd=APP_DIR, capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+    records = [json.loads(line) for line in dst.read_text(encoding="utf-8").splitlines()]
+    assert [r["id"] for r in records] == [str(i) for i in range(25)]
+    assert all(r["ok"] for r in records) and "25 ok" in proc.stderr
+
+
+def test_score_chunk_marks_unexpected_line_errors(monkeypatch):
+    def boom(respuestas):
+        if respuestas.get("id_malo"):
+            raise RuntimeError("regla rota")
+        return real(respuestas)
+
+    real = batch_score.clasificar
+    monkeypatch.setattr(batch_score, "clasificar", boom)
+    out, ok, errors = batch_score.score_chunk([json.dumps({"id_malo": 1}), json.dumps(GOOD)], 1, with_v3=False)
+    records = [json.loads(line) for line in out]
+
+    assert (ok, errors) == (1, 1)
+    assert records[0]["reason"] == "RuntimeError: regla rota" and records[1]["ok"]
+
+
+def test_score_chunk_marks_v3_failure_and_keeps_v2(monkeypatch):
+    def broken(batch):
+        raise RuntimeError("modelo corrupto")
+
+    monkeypatch.setattr(batch_score.dojo, "predict_v3_batch", broken)
+    out, ok, errors = batch_score.score_chunk([json.dumps(GOOD), "no es json", json.dumps(GOOD)], 1)
+    records = [json.loads(line) for line in out]
+
+    assert (ok, errors) == (2, 1)
+    assert records[0]["ok"] and records[0]["v2"]["persona"]
+    assert records[0]["v3"] == records[2]["v3"] == {"ok": False, "reason": "RuntimeError: modelo corrupto"}
+    assert "v3" not in records[1]
@@ -0,0 +1,98 @@
+# Pruebas del formato .apb del historial frio (ida y vuelta exacta, filtros por bloque, crc, compactado)
+import pytest
+
+from apim import codec, storage
+
+
+def _odd_events():
+    return [
+        # ts con zona distinta de UTC, uuid no canonico y persona fuera de la tabla: se guardan tal cual
+        {"type": "run", "run_id": "ABCDEF00-0000-4000-8000-000000000000", "ts": "2026-09-01T10:00:00-06:00",
+         "resultado": {"persona": "Otra persona", "score": None}},
+        {"type": "otro", "run_id": "no-es-uuid", "ts": "2026-09-01", "x": [1.1, {"y": 2}], "z": 0.1 + 0.2},
+        {"sin_type": True},
+    ]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip_is_exact(tmp_path, compress):
+    events = codec._synthetic_events(500) + _odd_events()
+    path = tmp_path / "seg.jsonl.apb"
+    index = codec.write_file(path, events, compress=compress, block_size=64)
+
+    assert index["n"] == len(events) and len(index["blocks"]) == 8
+    assert codec.read_index(path)["compression"] == ("zlib" if compress else "none")
+    assert list(codec.iter_file(path)) == events
+
+
+def test_filters_skip_blocks_by_range_and_type(tmp_path, monkeypatch):
+    events = codec._synthetic_events(400)
+    path = tmp_path / "seg.jsonl.apb"
+    codec.write_file(path, events, block_size=50)
+
+    decoded = []
+    real = codec.decode_block
+    monkeypatch.setattr(codec, "decode_block", lambda *a, **k: decoded.append(1) or real(*a, **k))
+
+    start, end = events[120]["ts"], events[180]["ts"]
+    got = list(codec.iter_file(path, start_s=start, end_s=end, types={"feedback"}))
+    want = [e for e in events if start <= e["ts"] <= end and e["type"] == "feedback"]
+    # El filtro de ts exacto lo hace storage; aqui solo se saltan bloques enteros
+    assert [e for e in got if start <= e["ts"] <= end] == want
+    assert len(decoded) == 2
+
+    decoded.clear()
+    assert list(codec.iter_file(path, types={"nada"})) == [] and decoded == []
+
+
+def test_corrupt_block_is_detected(tmp_path):
+    path = tmp_path / "seg.jsonl.apb"
+    index = codec.write_file(path, codec._synthetic_events(10))
+    data = bytearray(path.read_bytes())
+    data[index["blocks"][0]["offset"] + 5] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="corrupto"):
+        list(codec.iter_file(path))
+    path.write_bytes(b"APB1")
+    with pytest.raises(ValueError):
+        codec.read_index(path)
+
+
+@pytest.mark.parametrize("fmt", ["apb", "apb-raw", "gzip"])
+def test_compress_sealed_keeps_history_readable(data_dir, fmt):
+    for e in codec._synthetic_events(40):
+        storage.append("historial", dict(e, ts=e["ts"].replace("2026-09", "2026-08")))
+    storage.append("historial", {"type": "run", "run_id": "nuevo", "ts": "2026-09-02T00:00:00+00:00"})
+    before = storage.load_events()
+
+    assert storage.compress_sealed(fmt=fmt) == 1
+    seg = storage.list_segments()[0]
+    assert seg["format"] == fmt and seg["compressed"] == (fmt != "apb-raw")
+    storage.clear_cache()
+    assert storage.load_events() == before
+    assert len(storage.load_events(types=["shadow"], end="2026-08-31")) == 10
+
+
+def test_blocks_are_plain_json(tmp_path):
+    # Sin marshal: un bloque se puede leer con cualquier JSON, en cualquier version de Python
+    import json
+    import zlib
+
+    events = codec._synthetic_events(8)
+    path = tmp_path / "seg.jsonl.apb"
+    index = codec.write_file(path, events)
+    block = index["blocks"][0]
+    payload = zlib.decompress(path.read_bytes()[block["offset"]:block["offset"] + block["length"]])
+    shapes, rows = json.loads(payload)
+    assert len(rows) == 8 and all(isinstance(keys, list) for keys, _ in shapes)
+    assert codec.decode_block(payload) == events
+
+
+def test_unknown_format_version_is_rejected(tmp_path, monkeypatch):
+    path = tmp_path / "seg.jsonl.apb"
+    monkeypatch.setattr(codec, "FORMAT_VERSION", 1)
+    codec.write_file(path, codec._synthetic_events(4))
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match="version"):
+        list(codec.iter_file(path))
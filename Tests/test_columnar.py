@@ -0,0 +1,131 @@
+# Pruebas del export columnar incremental (marca de agua por segmento, generacion del sharding)
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from conftest import APP_DIR
+
+from apim import columnar, storage
+from apim.core import clasificar
+
+RESPUESTAS = {
+    "ahorro_mensual_pct": 20,
+    "compras_impulsivas_sem": 1,
+    "registra_gastos": True,
+    "fondo_emergencia_meses": 4,
+}
+
+
+def _run(day, session_id=None):
+    result = clasificar(RESPUESTAS)
+    ts = f"2026-09-{day:02d}T00:00:00+00:00"
+    return storage.save_run(RESPUESTAS, result, session_id=session_id, ts=ts)
+
+
+def test_sync_only_exports_new_events(data_dir):
+    first = [_run(1), _run(2)]
+    storage.save_feedback(first[0], 5)
+
+    assert columnar.sync() == {"run": 2, "shadow": 0, "feedback": 1}
+    assert columnar.sync() == {"run": 0, "shadow": 0, "feedback": 0}
+
+    second = _run(3)
+    assert columnar.sync() == {"run": 1, "shadow": 0, "feedback": 0}
+
+    cols = columnar.load_columns("run")
+    assert [r.decode() for r in cols["run_id"]] == first + [second]
+    assert cols["ahorro_mensual_pct"].tolist() == [20.0] * 3
+    assert (cols["v2_id"] >= 0).all()
+    assert len(list((columnar.COLUMNAR_DIR / "run").glob("part-*"))) == 2
+
+
+def test_rebalance_triggers_a_full_reexport(data_dir):
+    ids = [_run(day, session_id=f"s{day}") for day in range(1, 5)]
+    columnar.sync()
+
+    storage.rebalance(4)
+    # Otra generacion: los parts viejos se borran y se exporta todo de nuevo, sin duplicados
+    assert columnar.sync()["run"] == 4
+    cols = columnar.load_columns("run")
+    assert sorted(r.decode() for r in cols["run_id"]) == sorted(ids)
+
+
+def test_load_columns_fills_columns_missing_from_old_parts(data_dir):
+    old = columnar._shadow_columns([{"run_id": "a" * 36, "v3": {"ok": True}}])
+    del old["weight"]
+    columnar._write_part("shadow", 1, old)
+
+    cols = columnar.load_columns("shadow")
+    assert cols["weight"].tolist() == [1.0]
+    assert cols["weight"].dtype == np.float32
+
+
+def test_financial_dataset_from_columnar_matches_history(data_dir):
+    pytest.importorskip("torch")
+    from apim import dojo
+
+    for day in range(1, 4):
+        _run(day)
+    ds = dojo.FinancialDataset.from_columnar()
+    ref = dojo.FinancialDataset()
+    assert np.allclose(ds.X, ref.X) and np.array_equal(ds.y, ref.y)
+    assert ds.n_samples == 3
+
+
+def test_concurrent_syncs_export_each_event_once(data_dir):
+    ids = []
+    errors = []
+
+    def syncer():
+        try:
+            for _ in range(5):
+                columnar.sync()
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=syncer) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for day in range(1, 11):
+        ids.append(_run(day))
+    for t in threads:
+        t.join(timeout=60)
+    columnar.sync()
+
+    assert errors == []
+    assert sorted(r.decode() for r in columnar.load_columns("run")["run_id"]) == sorted(ids)
+
+
+# Otro proceso con el lock del export tomado (como un sync largo de metrics_offline o del sweep)
+HOLDER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from pathlib import Path
+from apim import storage
+with storage.file_lock(Path(sys.argv[2])):
+    print("locked", flush=True)
+    sys.stdin.readline()
+"""
+
+
+def test_sync_waits_for_other_process(data_dir):
+    _run(1)
+    lock = columnar.COLUMNAR_DIR / columnar.LOCK_NAME
+    child = subprocess.Popen(
+        [sys.executable, "-c", HOLDER, str(APP_DIR), str(lock)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    assert child.stdout.readline().strip() == "locked"
+
+    result = {}
+    t = threading.Thread(target=lambda: result.update(columnar.sync()))
+    t.start()
+    time.sleep(0.3)
+    assert result == {}
+
+    child.communicate("\n", timeout=30)
+    t.join(timeout=30)
+    assert result["run"] == 1
@@ -0,0 +1,52 @@
+# Pruebas de las reglas V2 (clasificar / detectar_debilidades) en los bordes de sus umbrales
+import numpy as np
+import pytest
+
+from apim import features
+from apim.core import clasificar, detectar_debilidades
+
+
+def _r(ahorro=0, impulsivas=0, registra=False, fondo=0):
+    return {"ahorro_mensual_pct": ahorro, "compras_impulsivas_sem": impulsivas, "registra_gastos": registra,
+            "fondo_emergencia_meses": fondo}
+
+
+@pytest.mark.parametrize("respuestas, score, persona", [
+    (_r(ahorro=9, impulsivas=2, fondo=2.9), 0, "Comprador impulsivo"),
+    (_r(ahorro=10, impulsivas=3, registra=True, fondo=3), 5, "Genio financiero"),
+    (_r(ahorro=19.9, impulsivas=6, registra=True, fondo=5.9), 5, "Genio financiero"),
+    (_r(ahorro=20, impulsivas=7, fondo=6), 5, "Genio financiero"),
+    (_r(ahorro=20, registra=True, fondo=6), 12, "Jefe de jefes"),
+    (_r(ahorro=10, registra=True), 5, "Genio financiero"),
+    (_r(ahorro=10), 3, "Ahorrador disciplinado"),
+])
+def test_clasificar_thresholds(respuestas, score, persona):
+    result = clasificar(respuestas)
+    assert (result.score, result.persona) == (score, persona)
+    assert isinstance(result.score, int)
+
+
+def test_out_of_range_answers_reach_v2_as_is_and_are_clamped_only_for_v3():
+    low = _r(ahorro=-5, impulsivas=-1, fondo=-2)
+    high = _r(ahorro=500, impulsivas=200, registra=True, fondo=999)
+
+    assert clasificar(low).score == 0
+    assert clasificar(high).score == 5 - 5 + 2 + 5
+    assert detectar_debilidades(low) == ["sin_registro", "sin_fondo", "bajo_ahorro"]
+    assert detectar_debilidades(high) == ["impulsivas"]
+
+    # V3 si ve los valores limitados a rango
+    np.testing.assert_array_equal(features.encode_one(high), features.encode_one(_r(100, 100, True, 120)))
+    np.testing.assert_array_equal(features.encode_one(low), features.encode_one(_r()))
+
+
+def test_detectar_debilidades_keeps_int_conversion():
+    # int() trunca: 9.9 % de ahorro sigue siendo bajo y 2.9 compras no llegan a 3
+    assert detectar_debilidades(_r(ahorro=9.9, impulsivas=2.9, registra=True, fondo=1)) == ["bajo_ahorro"]
+    assert detectar_debilidades(_r(ahorro="12", impulsivas="3", registra=True, fondo="0.5")) == ["impulsivas", "sin_fondo"]
+    assert detectar_debilidades({}) == ["sin_registro", "sin_fondo", "bajo_ahorro"]
+
+    # Lo que no es numero falla como siempre en V2 (el formulario solo manda numeros); V3 usa el default
+    with pytest.raises(ValueError):
+        detectar_debilidades(_r(ahorro="mucho"))
+    np.testing.assert_array_equal(features.encode_one(_r(ahorro="mucho")), features.encode_one(_r()))
@@ -0,0 +1,190 @@
+# Pruebas de la inferencia V3 del Dojo (cache de predicciones, motor NumPy, grid de la demo)
+import json
+import os
+
+import numpy as np
+import pytest
+
+from apim import dojo
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 3, "registra_gastos": True, "fondo_emergencia_meses": 4}
+
+
+def test_predict_v3_without_model(data_dir, monkeypatch):
+    monkeypatch.setenv("APIM_V3_ENGINE", "numpy")
+    dojo.clear_prediction_cache()
+    assert dojo.predict_v3(RESPUESTAS) == {"ok": False, "reason": "no_model"}
+
+
+def test_prediction_cache_hits_and_returns_copies(v3_model):
+    first = dojo.predict_v3(RESPUESTAS)
+    first["probs"][0] = -1.0
+    second = dojo.predict_v3(RESPUESTAS)
+
+    info = dojo.prediction_cache_info()
+    assert (info["hits"], info["misses"]) == (1, 1)
+    assert second["probs"][0] != -1.0 and second["ok"]
+
+
+def test_prediction_cache_invalidated_by_new_model(v3_model):
+    before = dojo.predict_v3(RESPUESTAS)
+
+    # Otros pesos en el mismo archivo: cambia la huella del modelo y no se sirve la prediccion vieja
+    with np.load(v3_model) as data:
+        weights = {k: data[k] for k in data.files}
+    weights["fc2.bias"] = np.arange(len(dojo.PROFILE_TO_ID), dtype=np.float32) * 5.0
+    tmp = v3_model.with_name("nuevo.npz")
+    np.savez(tmp, **weights)
+    os.replace(tmp, v3_model)
+
+    after = dojo.predict_v3(RESPUESTAS)
+    assert dojo.prediction_cache_info()["invalidations"] == 1
+    assert after["probs"] != before["probs"]
+
+
+def test_numpy_engine_matches_reference_math(v3_model):
+    with np.load(v3_model) as data:
+        w = {k: data[k] for k in data.files}
+    X = np.random.default_rng(1).random((5, 4)).astype(np.float32)
+
+    # fc1 -> ReLU -> fc2 -> softmax, con pesos en el formato de torch (salidas, entradas)
+    h = np.maximum(X @ w["fc1.weight"].T + w["fc1.bias"], 0.0)
+    logits = h @ w["fc2.weight"].T + w["fc2.bias"]
+    expected = np.exp(logits - logits.max(axis=1, keepdims=True))
+    expected /= expected.sum(axis=1, keepdims=True)
+
+    probs = dojo.DojoNetNumpy.load(v3_model).predict_proba(X)
+    np.testing.assert_allclose(probs, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_prediction_maps_argmax_to_profile(v3_model):
+    # Un modelo con las 4 clases de produccion: la persona es la del id con mayor probabilidad
+    with np.load(v3_model) as data:
+        weights = {k: data[k] for k in data.files}
+    assert weights["fc2.weight"].shape == (len(dojo.PROFILE_TO_ID), 16)
+
+    id_to_profile = {i: p for p, i in dojo.PROFILE_TO_ID.items()}
+    for target in range(len(id_to_profile)):
+        weights["fc2.bias"] = np.where(np.arange(len(id_to_profile)) == target, 50.0, 0.0).astype(np.float32)
+        tmp = v3_model.with_name("nuevo.npz")
+        np.savez(tmp, **weights)
+        os.replace(tmp, v3_model)
+
+        pred = dojo.predict_v3(RESPUESTAS)
+        assert pred["pred_persona"] == id_to_profile[target]
+        assert pred["confidence"] == pytest.approx(max(pred["probs"]))
+        assert len(pred["probs"]) == len(id_to_profile)
+
+
+def test_export_npz_matches_torch_model(data_dir):
+    torch = pytest.importorskip("torch")
+    model = dojo.DojoNet(n_hidden=16)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    torch.save(model.state_dict(), dojo.MODEL_PATH)
+
+    npz = dojo.export_npz()
+    X = np.random.default_rng(2).random((8, 4)).astype(np.float32)
+    with torch.no_grad():
+        expected = torch.softmax(model(torch.from_numpy(X)), dim=1).numpy()
+    np.testing.assert_allclose(dojo.DojoNetNumpy.load(npz).predict_proba(X), expected, rtol=1e-5, atol=1e-6)
+
+
+def _toy_tensors(torch, n=32):
+    rng = np.random.default_rng(0)
+    X = torch.tensor(rng.random((n, 4)), dtype=torch.float32)
+    y = torch.tensor((rng.random(n) > 0.5).astype(np.int64))
+    return X, y
+
+
+def test_fit_early_stopping_stops_when_val_loss_stalls():
+    torch = pytest.importorskip("torch")
+    from torch.utils.data import TensorDataset
+
+    # lr = 0: la loss de validacion nunca mejora despues de la primera epoch
+    _, info = dojo.fit_dojonet(
+        TensorDataset(*_toy_tensors(torch)), epochs=50, batch_size=8, lr=0.0, n_hidden=8,
+        seed=0, early_stopping=True, patience=3,
+    )
+    assert info["stop_reason"] == "early_stopping"
+    assert info["epochs_run"] == 4
+    assert info["val_loss"] is not None
+
+
+def test_fit_full_batch_is_one_step_per_epoch():
+    torch = pytest.importorskip("torch")
+    from torch.utils.data import TensorDataset
+
+    ds = TensorDataset(*_toy_tensors(torch))
+    full, info = dojo.fit_dojonet(ds, epochs=3, batch_size=8, lr=1e-2, n_hidden=8, seed=0, full_batch=True)
+    same, _ = dojo.fit_dojonet(ds, epochs=3, batch_size=len(ds), lr=1e-2, n_hidden=8, seed=0)
+
+    assert info["stop_reason"] == "max_epochs" and info["epochs_run"] == 3
+    for k, v in full.state_dict().items():
+        assert torch.equal(v, same.state_dict()[k])
+
+
+def _run(persona, ahorro):
+    return {"type": "run", "respuestas": {**RESPUESTAS, "ahorro_mensual_pct": ahorro}, "resultado": {"persona": persona}}
+
+
+def test_dataset_keeps_unique_rows_with_counts(tmp_path):
+    runs = [_run("Genio financiero", 40)] * 3 + [_run("Comprador impulsivo", 5), _run("Persona rara", 5), {"type": "feedback"}]
+    path = tmp_path / "historial.json"
+    path.write_text(json.dumps(runs), encoding="utf-8")
+
+    ds = dojo.FinancialDataset(path)
+    assert (len(ds), ds.n_samples) == (2, 4)
+    by_label = dict(zip(ds.y, ds.w))
+    assert by_label == {dojo.PROFILE_TO_ID["Genio financiero"]: 3.0, dojo.PROFILE_TO_ID["Comprador impulsivo"]: 1.0}
+
+
+def test_weighted_unique_rows_train_like_repeated_rows(tmp_path):
+    torch = pytest.importorskip("torch")
+    from torch.utils.data import TensorDataset
+
+    runs = [_run("Genio financiero", 40)] * 3 + [_run("Comprador impulsivo", 5)] * 2
+    path = tmp_path / "historial.json"
+    path.write_text(json.dumps(runs), encoding="utf-8")
+    ds = dojo.FinancialDataset(path)
+
+    # Full batch: la loss pesada por conteo es la misma que con las filas repetidas
+    X = torch.tensor([ds.X[i] for i in range(len(ds)) for _ in range(int(ds.w[i]))], dtype=torch.float32)
+    y = torch.tensor([ds.y[i] for i in range(len(ds)) for _ in range(int(ds.w[i]))])
+    _, weighted = dojo.fit_dojonet(ds, epochs=5, batch_size=8, lr=1e-2, n_hidden=8, seed=0, full_batch=True)
+    _, repeated = dojo.fit_dojonet(TensorDataset(X, y), epochs=5, batch_size=8, lr=1e-2, n_hidden=8, seed=0, full_batch=True)
+    assert weighted["last_loss"] == pytest.approx(repeated["last_loss"], rel=1e-5)
+
+
+def test_demo_grid_matches_forward_per_point():
+    fixed = {"compras_impulsivas_sem": 3, "registra_gastos": True}
+    grid = dojo.demo_grid_forward("ahorro_mensual_pct", "fondo_emergencia_meses", fixed=fixed)
+    assert grid["outputs"].shape == (13, 51, 3) and grid["medidor"].shape == (13, 51)
+
+    for iy, ix in [(0, 0), (4, 20), (12, 50)]:
+        respuestas = dict(fixed, ahorro_mensual_pct=grid["x"][ix], fondo_emergencia_meses=grid["y"][iy])
+        salida, medidor = dojo.demo_forward_pass(respuestas)
+        assert np.allclose(grid["outputs"][iy, ix], salida[0])
+        assert grid["medidor"][iy, ix] == pytest.approx(medidor)
+
+
+def test_demo_grid_is_cached_and_read_only():
+    dojo._demo_grid_cached.cache_clear()
+    a = dojo.demo_grid_forward("ahorro_mensual_pct", "compras_impulsivas_sem", fixed={"fondo_emergencia_meses": 2})
+    # Los valores de los ejes no cuentan para la llave del cache
+    b = dojo.demo_grid_forward(
+        "ahorro_mensual_pct", "compras_impulsivas_sem",
+        fixed={"fondo_emergencia_meses": 2, "ahorro_mensual_pct": 40},
+    )
+    assert a is b
+    assert dojo.demo_grid_cache_info()["hits"] == 1 and dojo.demo_grid_cache_info()["misses"] == 1
+    with pytest.raises(ValueError):
+        a["medidor"][0, 0] = 1.0
+
+
+def test_demo_grid_rejects_bad_axes():
+    with pytest.raises(ValueError):
+        dojo.demo_grid_forward("ahorro_mensual_pct", "ahorro_mensual_pct")
+    with pytest.raises(ValueError):
+        dojo.demo_grid_forward("ahorro_mensual_pct", "edad")
+    with pytest.raises(ValueError):
+        dojo.demo_grid_forward(x_values=[])
@@ -0,0 +1,150 @@
+# Pruebas del monitor de drift (histogramas por dia, PSI/KL, reporte contra la ventana de entrenamiento)
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from apim import drift, storage
+from apim.core import clasificar
+from conftest import APP_DIR
+
+
+def _save_runs(n, days_ago, ahorro):
+    ts = (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+    for _ in range(n):
+        respuestas = {"ahorro_mensual_pct": ahorro, "compras_impulsivas_sem": 2, "registra_gastos": True,
+                      "fondo_emergencia_meses": 3}
+        storage.save_run(respuestas, clasificar(respuestas), ts=ts)
+    return ts[:10]
+
+
+@pytest.fixture
+def monitor(data_dir, monkeypatch):
+    drift.install()
+    drift.flush()
+    monkeypatch.setattr(drift, "MIN_RECENT", 10)
+    return data_dir
+
+
+def test_psi_kl_zero_for_same_distribution_and_grows_with_shift():
+    base = np.array([50, 30, 20])
+    assert drift.psi_kl(base, base * 3) == pytest.approx((0.0, 0.0), abs=1e-12)
+
+    small_psi, small_kl = drift.psi_kl(base, np.array([45, 33, 22]))
+    big_psi, big_kl = drift.psi_kl(base, np.array([5, 15, 80]))
+    assert 0 < small_psi < drift.PSI_WARN <= drift.PSI_RETRAIN < big_psi
+    assert 0 < small_kl < big_kl
+
+    r = np.array([0.05, 0.15, 0.8])
+    b = np.array([0.5, 0.3, 0.2])
+    assert big_psi == pytest.approx(((r - b) * np.log(r / b)).sum(), rel=1e-3)
+
+
+def test_commits_are_counted_per_day_and_flushed_in_batches(monitor, monkeypatch):
+    monkeypatch.setattr(drift, "FLUSH_EVERY", 5)
+    day = _save_runs(3, 0, ahorro=12)
+    assert not drift._drift_path().exists()
+
+    _save_runs(2, 0, ahorro=12)
+    assert drift._drift_path().exists()
+    counts = drift.load_days()[day]
+    assert counts["ahorro_mensual_pct"].tolist() == [0, 0, 5] + [0] * 8
+    assert counts[drift.PERSONA_FIELD].sum() == 5
+
+    # rebuild desde el historial da lo mismo que el conteo incremental
+    assert drift.rebuild() == {"runs": 5, "days": 1}
+    assert drift.load_days()[day]["ahorro_mensual_pct"].tolist() == counts["ahorro_mensual_pct"].tolist()
+
+
+def test_report_flags_retrain_when_answers_shift(monitor):
+    _save_runs(30, 20, ahorro=30)
+    _save_runs(30, 1, ahorro=30)
+    rep = drift.report(recent_days=7)
+    assert rep["ok"] and not rep["retrain"]
+    assert rep["baseline"]["n"] == 30 and rep["recent"]["n"] == 30
+    assert rep["fields"]["ahorro_mensual_pct"]["status"] == "estable"
+
+    _save_runs(60, 0, ahorro=2)
+    rep = drift.report(recent_days=7)
+    assert rep["retrain"] and rep["fields"]["ahorro_mensual_pct"]["status"] == "alto"
+    assert rep["fields"]["registra_gastos"]["status"] == "estable"
+    assert any(r.startswith("ahorro_mensual_pct: PSI=") for r in rep["reasons"])
+    assert "Reentrenar: SI" in drift.render_text(rep)
+
+
+def test_report_needs_data_and_enough_recent_runs(monitor, monkeypatch):
+    assert drift.report()["reason"] == "sin_datos"
+
+    _save_runs(20, 20, ahorro=30)
+    _save_runs(5, 0, ahorro=2)
+    monkeypatch.setattr(drift, "MIN_RECENT", 200)
+    rep = drift.report()
+    assert not rep["retrain"] and "pero solo 5 corridas recientes" in rep["reasons"][-1]
+
+
+def test_bins_change_discards_old_counts(monitor, monkeypatch):
+    _save_runs(3, 0, ahorro=12)
+    drift.flush()
+    monkeypatch.setattr(drift, "BINS_VERSION", drift.BINS_VERSION + 1)
+    assert drift.load_days() == {}
+
+
+def test_drift_loads_without_torch():
+    code = "import sys, apim.drift, apim.columnar; sys.exit('torch' in sys.modules)"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr or "apim.drift importo torch"
+
+
+def test_commits_are_not_blocked_while_flush_writes(monitor, monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+    real_save = drift._save
+
+    def slow_save(data):
+        writing.set()
+        assert release.wait(5)
+        real_save(data)
+
+    monkeypatch.setattr(drift, "_save", slow_save)
+    monkeypatch.setattr(drift, "FLUSH_EVERY", 1000)
+    day = _save_runs(3, 0, ahorro=12)
+    flusher = threading.Thread(target=drift.flush)
+    flusher.start()
+    try:
+        assert writing.wait(5)
+        # el flush esta escribiendo: otro commit solo suma a lo pendiente y no espera
+        saver = threading.Thread(target=_save_runs, args=(2, 0, 12))
+        saver.start()
+        saver.join(2)
+        assert not saver.is_alive()
+    finally:
+        release.set()
+        flusher.join(5)
+
+    monkeypatch.setattr(drift, "_save", real_save)
+    assert drift.load_days()[day]["ahorro_mensual_pct"].tolist() == [0, 0, 5] + [0] * 8
+
+
+def test_flush_taken_before_rebuild_is_not_counted_twice(monitor, monkeypatch):
+    # un rebuild (que ya cuenta las corridas del historial) escribe entre que el flush toma lo pendiente y lo suma
+    class RebuildFirst:
+        def __init__(self):
+            self.real = threading.Lock()
+            self.rebuild = True
+
+        def __enter__(self):
+            if self.rebuild:
+                self.rebuild = False
+                drift.rebuild()
+            self.real.acquire()
+
+        def __exit__(self, *exc):
+            self.real.release()
+
+    monkeypatch.setattr(drift, "FLUSH_EVERY", 1000)
+    day = _save_runs(3, 0, ahorro=12)
+    monkeypatch.setattr(drift, "_io_lock", RebuildFirst())
+    drift.flush()
+    assert drift.load_days()[day]["ahorro_mensual_pct"].tolist() == [0, 0, 3] + [0] * 8
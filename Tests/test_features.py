@@ -0,0 +1,38 @@
+# Pruebas del codificador de features compartido (dojo y analitica)
+import numpy as np
+
+from apim import features
+
+
+def test_encode_batch_matches_encode_one():
+    batch = [
+        {"ahorro_mensual_pct": 25, "compras_impulsivas_sem": 7, "registra_gastos": True, "fondo_emergencia_meses": 6},
+        {"ahorro_mensual_pct": "10", "compras_impulsivas_sem": None, "registra_gastos": 0, "fondo_emergencia_meses": 3.5},
+        {},
+    ]
+    X = features.encode(batch)
+
+    assert X.shape == (3, features.N_FEATURES) and X.dtype == np.float32
+    for row, r in zip(X, batch):
+        np.testing.assert_array_equal(row, features.encode_one(r))
+
+
+def test_encode_scales_clamps_and_defaults():
+    X = features.encode([
+        # Dentro de rango: solo se escala (ahorro / 50, compras / 14, fondo / 12)
+        {"ahorro_mensual_pct": 25, "compras_impulsivas_sem": 7, "registra_gastos": True, "fondo_emergencia_meses": 6},
+        # Fuera de rango se limita; lo que no es numero cae al default
+        {"ahorro_mensual_pct": 500, "compras_impulsivas_sem": -3, "registra_gastos": False, "fondo_emergencia_meses": "mucho"},
+    ])
+
+    np.testing.assert_allclose(X[0], [0.5, 0.5, 1.0, 0.5])
+    np.testing.assert_allclose(X[1], [2.0, 0.0, 0.0, 0.0])
+
+
+def test_encode_columns_reclamps_old_columns():
+    cols = {"ahorro_mensual_pct": np.array([150.0, np.nan]), "registra_gastos": np.array([1, 0])}
+    X = features.encode_columns(cols)
+
+    np.testing.assert_allclose(X[:, 0], [2.0, 0.0])
+    np.testing.assert_allclose(X[:, 2], [1.0, 0.0])
+    np.testing.assert_allclose(X[:, 1], [0.0, 0.0])
@@ -0,0 +1,77 @@
+# Pruebas del servidor de micro-batching V3
+import threading
+from concurrent.futures import wait
+
+import pytest
+
+from apim import dojo
+from apim.inference import InferenceServer
+
+
+def _respuestas(i):
+    return {"ahorro_mensual_pct": i % 50, "compras_impulsivas_sem": i % 7, "registra_gastos": i % 2 == 0, "fondo_emergencia_meses": i % 13}
+
+
+def test_batched_predictions_match_predict_v3(v3_model):
+    server = InferenceServer(window_ms=5, max_batch=16)
+    try:
+        futures = [server.submit(_respuestas(i)) for i in range(100)]
+        results = [f.result(timeout=10) for f in futures]
+        stats = server.stats()
+    finally:
+        server.close()
+
+    assert all(r["ok"] for r in results)
+    dojo.clear_prediction_cache()
+    single = [dojo.predict_v3(_respuestas(i)) for i in range(100)]
+    assert [r["pred_persona"] for r in results] == [s["pred_persona"] for s in single]
+    assert [r["confidence"] for r in results] == pytest.approx([s["confidence"] for s in single], abs=1e-5)
+    # Se juntaron en lotes, sin pasar de max_batch
+    assert stats["served"] == 100
+    assert stats["batches"] < 100
+    assert stats["batch_sizes"][">256"] == 0 and stats["avg_batch"] <= 16
+
+
+def test_submit_after_close_raises(v3_model):
+    server = InferenceServer()
+    server.close()
+    with pytest.raises(RuntimeError):
+        server.submit(_respuestas(0))
+
+
+def test_close_while_submitting_resolves_every_future(v3_model):
+    server = InferenceServer(window_ms=1)
+    futures = []
+    start = threading.Event()
+
+    def client():
+        start.wait()
+        for i in range(500):
+            try:
+                futures.append(server.submit(_respuestas(i)))
+            except RuntimeError:
+                return
+
+    threads = [threading.Thread(target=client) for _ in range(4)]
+    for t in threads:
+        t.start()
+    start.set()
+    server.close()
+    for t in threads:
+        t.join()
+
+    # Ninguna peticion se queda sin respuesta: o tiene resultado o recibio el error de cierre
+    _, not_done = wait(futures, timeout=10)
+    assert not not_done
+
+
+def test_predict_times_out(v3_model, monkeypatch):
+    gate = threading.Event()
+    monkeypatch.setattr("apim.inference.predict_v3_batch", lambda batch, use_cache=False: gate.wait(5) and [{}] * len(batch))
+    server = InferenceServer()
+    try:
+        with pytest.raises(TimeoutError):
+            server.predict(_respuestas(0), timeout=0.05)
+    finally:
+        gate.set()
+        server.close()
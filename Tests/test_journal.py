@@ -0,0 +1,89 @@
+# Pruebas del journal de storage: recuperacion despues de una caida y lock entre procesos
+import subprocess
+import sys
+import threading
+import time
+
+from conftest import APP_DIR
+
+from apim import storage
+
+# Proceso aparte sobre el mismo Data/: escribe un lote en el journal con el lock tomado y luego
+# - "crash": se cae antes de aplicarlo
+# - "hold": espera una linea en stdin y despues lo aplica (como un _commit lento)
+CHILD = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+from pathlib import Path
+from apim import storage
+data = Path(sys.argv[2])
+storage.DATA_DIR = data
+storage.HISTORY_DIR = data / "historial"
+seg = storage.HISTORY_DIR / "x.jsonl"
+line = '{"type": "run", "run_id": "r1"}\\n'
+with storage._journal_guard():
+    ops = [("append", seg, 0, line)]
+    storage._journal_write(ops)
+    if sys.argv[3] == "crash":
+        os._exit(1)
+    print("locked", flush=True)
+    sys.stdin.readline()
+    storage._apply("append", seg, line)
+"""
+
+
+def _child(data, mode):
+    return subprocess.Popen(
+        [sys.executable, "-c", CHILD, str(APP_DIR), str(data), mode],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def _lines(data):
+    return (data / "historial" / "x.jsonl").read_text(encoding="utf-8").splitlines()
+
+
+def test_recover_applies_batch_of_crashed_process_once(data_dir):
+    data_dir.mkdir(parents=True)
+    assert _child(data_dir, "crash").wait() == 1
+
+    # El lote quedo en el journal pero no en el segmento: se aplica una sola vez
+    assert storage.recover() == 1
+    assert _lines(data_dir) == ['{"type": "run", "run_id": "r1"}']
+    assert storage.recover() == 0
+    assert _lines(data_dir) == ['{"type": "run", "run_id": "r1"}']
+    assert storage._journal_path().stat().st_size == 0
+
+
+def test_recover_waits_for_batch_in_flight_of_other_process(data_dir):
+    data_dir.mkdir(parents=True)
+    child = _child(data_dir, "hold")
+    assert child.stdout.readline().strip() == "locked"
+
+    # Otro proceso tiene un lote escrito en el journal y sin aplicar: recover no debe reaplicarlo
+    done = threading.Event()
+    t = threading.Thread(target=lambda: (storage.recover(), done.set()))
+    t.start()
+    time.sleep(0.3)
+    assert not done.is_set()
+
+    child.communicate("\n", timeout=30)
+    t.join(timeout=30)
+    assert done.is_set()
+    assert _lines(data_dir) == ['{"type": "run", "run_id": "r1"}']
+
+
+def test_checkpoint_fsyncs_every_journaled_path(data_dir, monkeypatch):
+    data_dir.mkdir(parents=True)
+    synced = []
+    monkeypatch.setattr(storage, "_fsync_path", lambda path, directory=False: synced.append(path))
+
+    # Un lote de otro proceso: su archivo no esta en _dirty de este
+    other = data_dir / "historial" / "otro.jsonl"
+    storage._journal_write([("append", other, 0, "{}\n")])
+    storage.checkpoint()
+
+    assert other in synced
+    assert storage._journal_path().stat().st_size == 0
@@ -0,0 +1,71 @@
+# Pruebas de las metricas de latencia por etapa y su export
+import json
+
+import pytest
+
+from apim import metrics
+
+
+@pytest.fixture
+def on(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", [])
+    was = metrics.enabled()
+    metrics.reset()
+    metrics.enable(True)
+    yield
+    metrics.enable(was)
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing():
+    was = metrics.enabled()
+    metrics.enable(False)
+    try:
+        metrics.observe("x", 0.1)
+        metrics.incr("y")
+        assert "x" not in metrics.snapshot()["stages"]
+        assert "y" not in metrics.snapshot()["counters"]
+    finally:
+        metrics.enable(was)
+
+
+def test_timed_records_calls_even_when_they_fail(on):
+    @metrics.timed("etapa")
+    def boom():
+        raise ValueError("x")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            boom()
+    metrics.observe("etapa", 0.3)
+
+    h = metrics.snapshot()["stages"]["etapa"]
+    assert h["count"] == 4
+    assert h["max"] == pytest.approx(0.3)
+    assert h["buckets"]["0.5"] == 1
+    assert sum(h["buckets"].values()) == 4
+
+
+def test_prometheus_buckets_are_cumulative(on):
+    metrics.observe("guardar", 0.002)
+    metrics.observe("guardar", 0.02)
+    metrics.observe("guardar", 20.0)
+    metrics.incr("errores", 2)
+    metrics.register_collector(lambda: {"cola.profundidad": 3})
+    metrics.register_collector(lambda: 1 / 0)
+
+    text = metrics.render_prometheus()
+    assert 'apim_stage_duration_seconds_bucket{stage="guardar",le="0.0025"} 1' in text
+    assert 'apim_stage_duration_seconds_bucket{stage="guardar",le="0.025"} 2' in text
+    assert 'apim_stage_duration_seconds_bucket{stage="guardar",le="+Inf"} 3' in text
+    assert 'apim_stage_duration_seconds_count{stage="guardar"} 3' in text
+    assert 'apim_events_total{name="errores"} 2' in text
+    assert "apim_cola_profundidad 3.0" in text
+
+
+def test_export_writes_prometheus_and_json(on, tmp_path):
+    metrics.observe("guardar", 0.01)
+    metrics.export(tmp_path / "m.prom", tmp_path / "m.json")
+
+    assert "apim_stage_duration_seconds_count" in (tmp_path / "m.prom").read_text(encoding="utf-8")
+    assert json.loads((tmp_path / "m.json").read_text(encoding="utf-8"))["stages"]["guardar"]["count"] == 1
@@ -0,0 +1,65 @@
+# Pruebas del motor vectorizado de metrics_offline (accuracy, buckets, ECE, confusion, pesos del muestreo)
+import numpy as np
+import pytest
+
+import metrics_offline as mo
+
+
+def _ids(*xs):
+    return np.array(xs, dtype=np.int8)
+
+
+def _run_ids(n):
+    return np.array([f"r{i}".encode() for i in range(n)], dtype="S36")
+
+
+def test_accuracy_buckets_and_confusion():
+    v2 = _ids(0, 0, 1, 2)
+    v3 = _ids(0, 1, 1, -1)
+    conf = np.array([0.95, 0.65, 0.55, 0.3], dtype=np.float32)
+
+    m = mo.compute_metrics(v2, v3, conf, _run_ids(4))
+    assert m["total"] == 4 and m["matches"] == 2
+    assert m["accuracy"] == pytest.approx(0.5)
+    assert m["avg_confidence"] == pytest.approx(conf.astype(np.float64).mean())
+
+    by_label = {b["label"]: b for b in m["buckets"]}
+    assert by_label["0.9-1.0"]["n"] == 1 and by_label["0.9-1.0"]["accuracy"] == 1.0
+    assert by_label["0.6-0.7"]["accuracy"] == 0.0
+    assert by_label["0.7-0.8"]["accuracy"] is None
+
+    assert m["confusion"][0][0] == 1 and m["confusion"][0][1] == 1
+    # El -1 cuenta como error en top_errors, pero no entra a la matriz de personas conocidas
+    assert {"v2": mo.LABELS[2], "v3": "", "n": 1} in m["top_errors"]
+    assert sum(map(sum, m["confusion"])) == 3
+
+
+def test_ece_matches_the_bucket_definition():
+    conf = np.array([0.95, 0.95, 0.55, 0.55], dtype=np.float32)
+    m = mo.compute_metrics(_ids(0, 0, 1, 1), _ids(0, 1, 1, 1), conf, _run_ids(4))
+    # bucket 0.9-1.0: acc 0.5 vs conf 0.95; bucket 0.5-0.6: acc 1.0 vs conf 0.55
+    assert m["ece"] == pytest.approx((0.45 * 2 + 0.45 * 2) / 4, abs=1e-6)
+
+
+def test_high_conf_errors_are_sorted_and_capped(monkeypatch):
+    monkeypatch.setattr(mo, "TOP_K", 2)
+    conf = np.array([0.7, 0.99, 0.8, 0.5], dtype=np.float32)
+    m = mo.compute_metrics(_ids(0, 0, 0, 0), _ids(1, 1, 1, 1), conf, _run_ids(4))
+    assert m["high_conf_errors"] == 3
+    assert [e["run_id"] for e in m["high_conf_top"]] == ["r1", "r2"]
+
+
+def test_sampling_weights_reweight_rates_but_not_sample_counts():
+    v2, v3 = _ids(0, 0), _ids(0, 1)
+    conf = np.array([0.95, 0.95], dtype=np.float32)
+    w = np.array([1.0, 3.0], dtype=np.float32)
+
+    m = mo.compute_metrics(v2, v3, conf, _run_ids(2), weight=w)
+    assert m["total"] == 2 and m["weighted_total"] == 4.0
+    assert m["accuracy"] == pytest.approx(0.25)
+    assert m["confusion"][0][1] == 3
+    assert m["buckets"][-1]["n"] == 2
+
+    # Sin pesos es lo mismo que peso 1
+    same = mo.compute_metrics(v2, v3, conf, _run_ids(2), weight=np.ones(2, np.float32))
+    assert same == mo.compute_metrics(v2, v3, conf, _run_ids(2))
@@ -0,0 +1,86 @@
+# Pruebas del pipeline post-submit (guardado en segundo plano + shadow V3)
+import threading
+
+import pytest
+
+from apim import pipeline as pipeline_mod
+from apim import storage, tracing
+from apim.core import clasificar
+from apim.pipeline import PostSubmitPipeline
+from apim.sampling import ShadowSampler
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 1, "registra_gastos": True, "fondo_emergencia_meses": 3}
+
+
+@pytest.fixture
+def pipeline(data_dir):
+    p = PostSubmitPipeline(max_queue=16, sampler=ShadowSampler(rate=0.0))
+    yield p
+    p.close()
+
+
+def test_submit_future_resolves_once_run_is_saved(pipeline):
+    run_id = storage.new_run_id()
+    job = pipeline.submit(run_id, RESPUESTAS, clasificar(RESPUESTAS), session_id="s1")
+
+    # Solo se espera a este trabajo; al resolverse la corrida ya se puede leer (feedback valido)
+    assert job.result(timeout=10) is True
+    assert storage.run_exists(run_id, session_id="s1")
+    storage.save_feedback(run_id, 5, session_id="s1")
+
+
+def test_run_keeps_submit_ts(pipeline):
+    run_id = storage.new_run_id()
+    ts = "2026-01-02T03:04:05+00:00"
+    trace = tracing.start_trace(run_id)
+    pipeline.submit(run_id, RESPUESTAS, clasificar(RESPUESTAS), trace=trace, ts=ts).result(timeout=10)
+
+    events = {e["type"]: e for e in storage.get_run(run_id)}
+    assert events["run"]["ts"] == ts
+    assert events["trace"]["ts"] >= ts
+
+
+def test_full_queue_saves_run_inline(data_dir, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+    real_save_run = pipeline_mod.save_run
+
+    # El hilo de trabajo se queda atorado en su primera corrida
+    def slow_save_run(*args, **kwargs):
+        if threading.current_thread().name.startswith("apim-post-submit"):
+            entered.set()
+            release.wait(10)
+        return real_save_run(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline_mod, "save_run", slow_save_run)
+    p = PostSubmitPipeline(max_queue=1, sampler=ShadowSampler(rate=0.0))
+    try:
+        ids = [storage.new_run_id() for _ in range(3)]
+        jobs = [p.submit(ids[0], RESPUESTAS, clasificar(RESPUESTAS))]
+        entered.wait(10)
+        jobs += [p.submit(run_id, RESPUESTAS, clasificar(RESPUESTAS)) for run_id in ids[1:]]
+
+        # La tercera no cupo en la cola: ya quedo guardada en el hilo que la mando
+        assert jobs[2].done() and jobs[2].result() is True
+        assert storage.run_exists(ids[2])
+        assert not jobs[0].done()
+        release.set()
+        assert all(job.result(timeout=10) for job in jobs)
+        assert p.stats()["overflow"] == 1
+    finally:
+        release.set()
+        p.close()
+
+
+def test_stage_errors_are_counted(data_dir, monkeypatch):
+    def broken(*args, **kwargs):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(pipeline_mod, "save_run", broken)
+    p = PostSubmitPipeline(sampler=ShadowSampler(rate=0.0))
+    try:
+        assert p.submit(storage.new_run_id(), RESPUESTAS, clasificar(RESPUESTAS)).result(timeout=10) is False
+        stats = p.stats()
+    finally:
+        p.close()
+    assert stats["errors"]["save_run"] == 1
+    assert "disco lleno" in stats["last_error"]
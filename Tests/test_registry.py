@@ -0,0 +1,49 @@
+# Pruebas del registro de modelos V3 (publicar, puntero CURRENT, rollback)
+import shutil
+
+from apim import dojo, registry
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 3, "registra_gastos": True, "fondo_emergencia_meses": 4}
+
+
+def _publish(n, npz=None):
+    version, staging = registry.stage_version()
+    if npz is not None:
+        shutil.copy(npz, staging / dojo.NPZ_FILE)
+    final = registry.publish(version, staging, {"n": n})
+    return version, final
+
+
+def test_publish_moves_current_and_writes_meta(data_dir):
+    assert registry.current_version() is None
+    v1, _ = _publish(10)
+    v2, final = _publish(20)
+
+    assert registry.list_versions() == [v1, v2]
+    assert registry.current_version() == v2
+    assert registry.read_meta(v2)["n"] == 20
+    # La carpeta temporal ya no existe: solo quedo la version publicada
+    assert not [p for p in registry.REGISTRY_DIR.iterdir() if p.name.startswith(".staging-")]
+    assert registry.artifact_path("meta.json") == final / "meta.json"
+
+
+def test_rollback(data_dir):
+    v1, _ = _publish(10)
+    v2, _ = _publish(20)
+
+    assert registry.rollback() == {"ok": True, "previous": v2, "current": v1}
+    assert registry.current_version() == v1
+    assert registry.rollback()["reason"] == "no_previous_version"
+    assert registry.rollback("no-existe")["reason"] == "unknown_version"
+    assert registry.rollback(v2)["current"] == v2
+
+
+def test_predict_v3_follows_current_version(v3_model):
+    assert dojo.predict_v3(RESPUESTAS)["model_version"] == dojo.LEGACY_VERSION
+
+    v1, _ = _publish(10, npz=v3_model)
+    assert dojo.predict_v3(RESPUESTAS)["model_version"] == v1
+    v2, _ = _publish(20, npz=v3_model)
+    assert dojo.predict_v3(RESPUESTAS)["model_version"] == v2
+    registry.rollback()
+    assert dojo.predict_v3(RESPUESTAS)["model_version"] == v1
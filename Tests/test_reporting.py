@@ -0,0 +1,87 @@
+# Pruebas del render de reportes (tabla, CSV y JSON Lines a un solo stream)
+import csv
+import io
+import json
+
+import pytest
+
+from apim import memory_json, reporting
+
+ROWS = [
+    {"date": "2026-10-01", "event": "Renta", "amount": "8000", "context": "casa", "emotion": "tranquilo",
+     "zone": "🟢", "trend": "➖"},
+    {"date": "2026-10-02", "event": "Una descripcion demasiado larga para la tabla", "amount": "1,200",
+     "context": 'dijo "ya"', "emotion": "estrés", "zone": "🟡", "trend": "📉"},
+]
+
+
+def test_table_cuts_long_cells_to_fixed_widths():
+    out = io.StringIO()
+    reporting.render_rows(ROWS, out, "table")
+    lines = out.getvalue().splitlines()
+
+    assert lines[1].startswith("Fecha ")
+    body = lines[3:]
+    assert len(body) == 2
+    cells = body[1].split(" | ")
+    assert cells[1] == reporting._cut(ROWS[1]["event"], 24) and cells[1].endswith("…")
+    assert len(cells[1]) == 24
+
+
+def test_csv_and_jsonl_round_trip():
+    out = io.StringIO()
+    reporting.render_rows(ROWS, out, "csv")
+    assert list(csv.DictReader(io.StringIO(out.getvalue()))) == ROWS
+
+    out = io.StringIO()
+    reporting.render_rows(ROWS, out, "jsonl")
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == ROWS
+
+
+def test_writes_are_batched(monkeypatch):
+    monkeypatch.setattr(reporting, "_WRITE_BATCH", 2)
+    writes = []
+
+    class Out(io.StringIO):
+        def write(self, s):
+            writes.append(s)
+            return super().write(s)
+
+    reporting.write_jsonl(ROWS * 3, Out())
+    assert len(writes) == 3
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        reporting.render_rows(ROWS, io.StringIO(), "xml")
+
+
+def test_weekly_report_renders_and_saves_snapshot():
+    memory = memory_json._default_memory()
+    for emotion in ("tranquilo", "estrés", "estrés"):
+        memory_json.add_event(memory, {"description": "compra", "emotion": emotion})
+
+    out = io.StringIO()
+    report = reporting.weekly_report(memory, out=out, fmt="jsonl")
+    assert report["ok"] and report["snapshot"]["overall_zone"] == reporting.ZONE_YELLOW
+    assert len(out.getvalue().splitlines()) == 3
+    assert memory["weekly_snapshots"] == [report["snapshot"]]
+
+    # render=False no escribe nada
+    out = io.StringIO()
+    reporting.weekly_report(memory, out=out, render=False, save_snapshot=False)
+    assert out.getvalue() == "" and len(memory["weekly_snapshots"]) == 1
+
+
+def test_rows_use_zone_stored_on_write_without_changing_memory():
+    memory = memory_json._default_memory()
+    memory_json.add_event(memory, {"description": "compra", "emotion": "tranquilo"})
+    event = memory["events"][0]
+    assert event["zone"] == reporting.ZONE_GREEN and "trend" not in event
+
+    # Zona guardada con las reglas actuales: el reporte la usa tal cual
+    event["zone"] = reporting.ZONE_RED
+    before = [dict(e) for e in memory["events"]]
+    rows = reporting.build_weekly_report(memory)["rows"]
+    assert rows[0]["zone"] == reporting.ZONE_RED
+    assert memory["events"] == before
@@ -1,8 +1,10 @@
 # Importamos las funciones y constantes que queremos probar
-from apim_vi.rules import (
+from apim.rules import (
     compute_zone,       # decide 🟢🟡🔴 por evento
     compute_trend,      # decide 📈➖📉 por cambio de zona
     build_feedback,     # genera comentarios y sugerencias
+    cached_zone,        # zona guardada en el evento (o recalculada si cambiaron las reglas)
+    RULES_VERSION,
     ZONE_GREEN,
     ZONE_YELLOW,
     ZONE_RED,
@@ -72,3 +74,37 @@ def test_compute_trend_up_down_flat():
 
     # Sin histórico → neutro
     assert compute_trend(None, ZONE_YELLOW) == TREND_FLAT
+
+
+def test_cached_zone_uses_stored_value_when_version_matches():
+    # La zona guardada manda aunque el texto diga otra cosa: no se vuelve a escanear
+    event = {
+        "description": "Me robaron el carro",
+        "emotion": "enojo",
+        "zone": ZONE_GREEN,
+        "rules_version": RULES_VERSION,
+    }
+
+    assert cached_zone(event) == ZONE_GREEN
+
+
+def test_cached_zone_recomputes_when_version_changes():
+    # Evento guardado con otras reglas: se recalcula, pero el evento no se toca (leer no cambia datos)
+    event = {
+        "description": "Me robaron el carro",
+        "emotion": "enojo",
+        "zone": ZONE_GREEN,
+        "rules_version": "reglas-viejas",
+    }
+    before = dict(event)
+
+    assert cached_zone(event) == ZONE_RED
+    assert event == before
+
+
+def test_cached_zone_without_stored_zone():
+    # Evento viejo (sin zona guardada)
+    event = {"description": "Cena con amigos", "emotion": "tranquilo"}
+
+    assert cached_zone(event) == ZONE_GREEN
+    assert "zone" not in event
@@ -0,0 +1,92 @@
+# Pruebas del cache de eventos por segmento y del indice run_id de storage
+from pathlib import Path
+
+import pytest
+
+from apim import storage
+
+
+class _Result:
+    persona = "Ahorrador disciplinado"
+    score = 1
+    resumen = ""
+
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 1, "registra_gastos": True, "fondo_emergencia_meses": 3}
+
+
+# Tres meses (un segmento por mes), `per_month` corridas cada uno; regresa los run_id por mes
+def _seed(per_month, session_id=None):
+    runs = {}
+    with storage.batch():
+        for month in ("2026-07", "2026-08", "2026-09"):
+            runs[month] = [
+                storage.save_run(RESPUESTAS, _Result(), session_id=session_id, ts=f"{month}-01T00:00:{i:02d}+00:00")
+                for i in range(per_month)
+            ]
+    return runs
+
+
+def test_run_lookups_keep_event_cache_under_cap(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "EVENT_CACHE_MAX", 10)
+    runs = _seed(5)
+    storage.load_events()
+    assert storage.cache_info()["events"] <= 10
+
+    for month, ids in runs.items():
+        storage.save_feedback(ids[0], 5)
+        assert [e["type"] for e in storage.get_run(ids[0])] == ["run", "feedback"]
+    assert storage.cache_info()["events"] <= 10
+
+    # El indice guarda posiciones, no eventos
+    for by_path in storage._run_index.values():
+        for entries in by_path.values():
+            assert all(pos is None or isinstance(pos, int) for pos, _ in entries)
+
+
+def test_run_exists_stops_at_newest_segment(data_dir):
+    runs = _seed(3)
+    storage.clear_cache()
+
+    assert storage.run_exists(runs["2026-09"][0])
+    assert [Path(k).name for k in storage._indexed] == ["2026-09.000.jsonl"]
+    assert not storage.run_exists("no-existe")
+    assert len(storage._indexed) == 3
+
+
+def test_run_lookup_with_session_reads_only_its_shard(data_dir):
+    storage.rebalance(4)
+    runs = _seed(2, session_id="s1")
+    storage.clear_cache()
+
+    run_id = runs["2026-07"][1]
+    assert storage.run_exists(run_id, session_id="s1")
+    shard_dir = str(storage._shard_dir(storage.shard_for("s1")))
+    assert storage._indexed and all(k.startswith(shard_dir) for k in storage._indexed)
+    assert storage.get_run(run_id, session_id="s1")[0]["ts"] == "2026-07-01T00:00:01+00:00"
+
+
+def test_run_index_follows_compaction(data_dir):
+    runs = _seed(2)
+    storage.append("historial", {"type": "run", "run_id": "nuevo"})  # sella los meses anteriores
+    assert storage.run_exists(runs["2026-07"][0])
+
+    storage.compress_sealed(fmt="apb")
+    run = storage.get_run(runs["2026-07"][0])
+    assert [e["type"] for e in run] == ["run"]
+    assert storage.run_exists(runs["2026-08"][1])
+
+
+def test_save_feedback_validates_run_only_when_asked(data_dir):
+    run_id = storage.save_run(RESPUESTAS, _Result(), session_id="s1")
+
+    # Por defecto no se valida (como antes): el feedback huerfano se guarda
+    storage.save_feedback("no-existe", 3)
+    assert [e["type"] for e in storage.get_run("no-existe")] == ["feedback"]
+
+    # validate=True (la app): la corrida debe existir; si no, ValueError y no se escribe nada
+    storage.save_feedback(run_id, 5, session_id="s1", validate=True)
+    with pytest.raises(ValueError, match="tampoco-existe"):
+        storage.save_feedback("tampoco-existe", 1, validate=True)
+    assert storage.get_run("tampoco-existe") == []
+    assert [e["type"] for e in storage.get_run(run_id)] == ["run", "feedback"]
@@ -0,0 +1,94 @@
+# Pruebas del muestreo shadow (cupo diario por persona, rate fijo, peso 1/rate, presupuesto)
+from apim import pipeline as pipeline_mod
+from apim import storage
+from apim.core import clasificar
+from apim.pipeline import PostSubmitPipeline
+from apim.sampling import ShadowSampler
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 1, "registra_gastos": True, "fondo_emergencia_meses": 3}
+
+
+def test_target_per_day_then_falls_back_to_rate():
+    s = ShadowSampler(rate=0.0, target_per_day=2)
+    for _ in range(2):
+        assert s.decide("Genio financiero") == {"rate": 1.0, "weight": 1.0, "reason": "target"}
+        s.record("Genio financiero")
+
+    # Cupo lleno y rate 0: ya no entra; otra persona tiene su propio cupo
+    assert s.decide("Genio financiero") is None
+    assert s.decide("Jefe de jefes")["reason"] == "target"
+
+
+def test_decide_does_not_spend_the_quota():
+    s = ShadowSampler(rate=0.0, target_per_day=1)
+    assert s.decide("a") is not None
+    assert s.decide("a") is not None
+    s.record("a")
+    assert s.decide("a") is None
+
+
+def test_rate_sampling_weight_is_inverse_rate():
+    s = ShadowSampler(rate=0.25, seed=1)
+    picks = [s.decide("a") for _ in range(4000)]
+    taken = [p for p in picks if p is not None]
+    assert all(p == {"rate": 0.25, "weight": 4.0, "reason": "rate"} for p in taken)
+    assert 800 < len(taken) < 1200
+
+
+def test_over_budget_only_with_a_budget():
+    assert not ShadowSampler().over_budget(10_000)
+    s = ShadowSampler(budget_ms=50)
+    assert not s.over_budget(50) and s.over_budget(51)
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("APIM_SHADOW_RATE", "2")
+    monkeypatch.setenv("APIM_SHADOW_TARGET_PER_DAY", "3")
+    monkeypatch.setenv("APIM_SHADOW_BUDGET_MS", "nope")
+    assert ShadowSampler.from_env().config() == {"rate": 1.0, "target_per_day": 3, "budget_ms": 0.0}
+
+
+def _submit(p):
+    run_id = storage.new_run_id()
+    assert p.submit(run_id, RESPUESTAS, clasificar(RESPUESTAS)).result(timeout=10)
+    return run_id
+
+
+def test_pipeline_saves_sample_weight_and_counts_only_stored_shadows(v3_model, monkeypatch):
+    sampler = ShadowSampler(rate=0.0, target_per_day=1)
+    persona = clasificar(RESPUESTAS).persona
+
+    def broken(*args, **kwargs):
+        raise OSError("disco lleno")
+
+    p = PostSubmitPipeline(sampler=sampler)
+    try:
+        # Un shadow que no se guardo no gasta el cupo del dia
+        with monkeypatch.context() as m:
+            m.setattr(pipeline_mod, "save_shadow", broken)
+            _submit(p)
+        assert sampler._taken.get(persona, 0) == 0
+
+        run_id = _submit(p)
+        shadow = [e for e in storage.get_run(run_id) if e["type"] == "shadow"]
+        assert shadow[0]["sample"] == {"rate": 1.0, "weight": 1.0, "reason": "target"}
+        assert sampler._taken[persona] == 1
+
+        # Cupo lleno con rate 0: la tercera corrida ya no lleva shadow
+        run_id = _submit(p)
+        assert [e["type"] for e in storage.get_run(run_id)] == ["run"]
+        stats = p.stats()
+    finally:
+        p.close()
+    assert stats["shadow_sampled"] == 2 and stats["shadow_skipped"] == 1
+
+
+def test_pipeline_drops_shadows_over_budget(v3_model):
+    p = PostSubmitPipeline(sampler=ShadowSampler(budget_ms=1e-6))
+    try:
+        run_id = _submit(p)
+        stats = p.stats()
+    finally:
+        p.close()
+    assert stats["shadow_over_budget"] == 1 and stats["shadow_sampled"] == 0
+    assert [e["type"] for e in storage.get_run(run_id)] == ["run"]
@@ -0,0 +1,63 @@
+# Pruebas del sharding por sesion/usuario (hash estable, rebalanceo del historial y de la memoria)
+from apim import memory_json, sharding, storage
+
+
+def test_shard_of_is_stable_and_in_range():
+    # blake2b, no hash(): el mismo shard en cualquier proceso
+    assert sharding.shard_of("sesion-1", 8) == sharding.shard_of("sesion-1", 8)
+    assert sharding.shard_of("sesion-1", 1) == 0
+    assert {sharding.shard_of(f"s{i}", 4) for i in range(200)} == {0, 1, 2, 3}
+    assert sharding.shard_name(3, 4) == "shard-03" and sharding.shard_name(0, 1) == ""
+
+
+def test_save_map_changes_generation(tmp_path):
+    assert sharding.load_map(tmp_path) == {"version": 1, "n_shards": 1, "generation": "0"}
+    first = sharding.save_map(tmp_path, 4)
+    second = sharding.save_map(tmp_path, 4)
+    assert first["generation"] != second["generation"]
+    assert sharding.load_map(tmp_path) == second
+
+
+def test_history_rebalance_keeps_every_event(data_dir):
+    for i in range(20):
+        storage.append("historial", {"type": "run", "run_id": f"r{i}", "session_id": f"s{i % 5}",
+                                     "ts": f"2026-09-{i + 1:02d}T00:00:00+00:00"})
+
+    out = storage.rebalance(4)
+    assert out["events"] == 20 and out["from_shards"] == 1 and out["n_shards"] == 4
+
+    events = storage.load_events()
+    assert sorted(e["run_id"] for e in events) == sorted(f"r{i}" for i in range(20))
+    # Cada segmento quedo en un shard, y todo lo de una sesion en el shard de su llave
+    for seg in storage.list_segments():
+        assert seg["shard"].startswith("shard-")
+        events_in_seg, _, _ = storage.read_segment_tail(seg)
+        assert {storage.shard_for(e["session_id"]) for e in events_in_seg} == {seg["shard"]}
+    assert storage.get_run("r7", session_id="s2")[0]["run_id"] == "r7"
+
+
+def test_memory_rebalance_moves_user_files(data_dir):
+    users = [f"user{i}" for i in range(10)]
+    for u in users:
+        memory = memory_json.load_memory(u)
+        memory_json.add_event(memory, {"type": "run", "score": 1})
+        memory_json.save_memory(memory, u)
+
+    out = memory_json.rebalance(3)
+    assert out == {"users": 10, "moved": out["moved"], "n_shards": 3} and out["moved"] > 0
+    assert sorted(u for u, _ in memory_json.iter_memories()) == users
+    for u in users:
+        path = memory_json._memory_path(u)
+        assert path.exists() and path.parent.name.startswith("shard-")
+        assert len(memory_json.get_events(memory_json.load_memory(u))) == 1
+
+
+def test_user_id_cannot_overwrite_the_shard_map(data_dir):
+    memory_json.save_memory(memory_json._default_memory(), "shards")
+    memory_json.save_memory(memory_json._default_memory(), "SHARDS")
+    assert memory_json._user_file_name("shards") != "shards.json"
+    assert memory_json._user_file_name("../x") != "../x.json"
+
+    memory_json.rebalance(2)
+    assert sharding.load_map(memory_json._memory_dir())["n_shards"] == 2
+    assert sorted(u for u, _ in memory_json.iter_memories()) == ["SHARDS", "shards"]
@@ -0,0 +1,107 @@
+# Pruebas del historial por segmentos (manifest, sellado, lectura por rango, migracion)
+import json
+
+from apim import storage
+
+
+def _event(ts, kind="run", **extra):
+    return {"type": kind, "run_id": f"r-{ts}", "ts": ts, **extra}
+
+
+def test_events_go_to_monthly_segments_and_old_months_get_sealed(data_dir):
+    storage.append("historial", _event("2026-08-05T00:00:00+00:00"))
+    storage.append("historial", _event("2026-08-06T00:00:00+00:00", "feedback"))
+    storage.append("historial", _event("2026-09-02T00:00:00+00:00"))
+
+    segs = storage.list_segments()
+    assert [s["name"] for s in segs] == ["2026-08.000.jsonl", "2026-09.000.jsonl"]
+    aug, sep = segs
+    assert aug["sealed"] and aug["n_events"] == 2
+    assert aug["counts"] == {"run": 1, "feedback": 1}
+    assert aug["end_ts"] == "2026-08-06T00:00:00+00:00" and aug["sha256"]
+    assert not sep["sealed"]
+
+
+def test_segment_rolls_over_at_size_cap(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "MAX_SEGMENT_BYTES", 200)
+    for day in range(1, 10):
+        storage.append("historial", _event(f"2026-08-{day:02d}T00:00:00+00:00", pad="x" * 50))
+
+    segs = storage.list_segments()
+    assert len(segs) > 1
+    assert all(s["month"] == "2026-08" for s in segs)
+    assert [s["name"] for s in segs][:2] == ["2026-08.000.jsonl", "2026-08.001.jsonl"]
+    assert len(storage.load_events()) == 9
+
+
+def test_range_reads_skip_segments_outside_the_range(data_dir):
+    for month in ("2026-07", "2026-08", "2026-09"):
+        storage.append("historial", _event(f"{month}-10T00:00:00+00:00"))
+        storage.append("historial", _event(f"{month}-11T00:00:00+00:00", "shadow"))
+
+    assert [s["month"] for s in storage.segments_for_range("2026-08-01", "2026-08-31")] == ["2026-08"]
+    events = storage.load_events(start="2026-08-01", end="2026-09-10T12:00:00", types=["run"])
+    assert [e["ts"][:10] for e in events] == ["2026-08-10", "2026-09-10"]
+
+
+def test_legacy_history_file_is_migrated_once(data_dir):
+    data_dir.mkdir(parents=True)
+    legacy = [_event("2026-09-02T00:00:00+00:00"), _event("2026-08-01T00:00:00+00:00")]
+    storage.HISTORY_FILE.write_text(json.dumps(legacy), encoding="utf-8")
+
+    assert [e["ts"][:7] for e in storage.load_events()] == ["2026-08", "2026-09"]
+    assert not storage.HISTORY_FILE.exists()
+    assert storage.HISTORY_FILE.with_suffix(".json.migrated").exists()
+    assert len(storage.load_events()) == 2
+
+
+def test_read_segment_tail_returns_only_new_lines(data_dir):
+    storage.append("historial", _event("2026-09-01T00:00:00+00:00"))
+    seg = storage.list_segments()[0]
+    events, lines, offset = storage.read_segment_tail(seg)
+    assert (len(events), lines) == (1, 1)
+
+    storage.append("historial", _event("2026-09-02T00:00:00+00:00"))
+    events, lines, offset = storage.read_segment_tail(seg, lines, offset)
+    assert [e["ts"][:10] for e in events] == ["2026-09-02"] and lines == 2
+
+
+def test_out_of_order_commits_are_read_in_ts_order(data_dir):
+    # Hilos del pipeline que terminan en otro orden que el de sus submits
+    for ts in ("2026-08-10T10:00:02+00:00", "2026-08-10T10:00:01+00:00", "2026-08-10T10:00:03+00:00"):
+        storage.append("historial", _event(ts))
+
+    assert [e["ts"][11:19] for e in storage.load_events()] == ["10:00:01", "10:00:02", "10:00:03"]
+    # El rango del segmento abierto cubre al evento tardio
+    assert storage.list_segments()[0]["start_ts"] == "2026-08-10T10:00:01+00:00"
+    assert len(storage.load_events(end="2026-08-10T10:00:01+00:00")) == 1
+
+
+def test_late_event_from_previous_month(data_dir, monkeypatch):
+    monkeypatch.setattr(storage, "SEAL_GRACE_S", 600)
+    storage.append("historial", _event("2026-08-31T23:59:58+00:00"))
+    storage.append("historial", _event("2026-09-01T00:00:01+00:00"))
+    # Submit de agosto que se guardo despues: dentro de la gracia, va al segmento de agosto (aun abierto)
+    storage.append("historial", _event("2026-08-31T23:59:59+00:00"))
+    segs = storage.list_segments()
+    assert [s["name"] for s in segs] == ["2026-08.000.jsonl", "2026-09.000.jsonl"]
+    assert not segs[0]["sealed"]
+
+    # Pasada la gracia agosto se sella; uno todavia mas tardio abre otro segmento de agosto
+    storage.append("historial", _event("2026-09-01T00:20:00+00:00"))
+    storage.append("historial", _event("2026-08-31T23:59:57+00:00"))
+    names = [s["name"] for s in storage.list_segments()]
+    assert names == ["2026-08.000.jsonl", "2026-09.000.jsonl", "2026-08.001.jsonl"]
+
+    ts = [e["ts"] for e in storage.load_events()]
+    assert ts == sorted(ts) and len(ts) == 5
+
+
+def test_out_of_order_commits_merge_across_shards(data_dir):
+    storage.rebalance(3)
+    for i in (5, 1, 4, 0, 3, 2, 7, 6):
+        storage.append("historial", {"type": "run", "run_id": f"r{i}", "session_id": f"s{i % 4}",
+                                     "ts": f"2026-08-10T10:00:0{i}+00:00"})
+
+    assert len({s["shard"] for s in storage.list_segments()}) > 1
+    assert [e["run_id"] for e in storage.load_events()] == [f"r{i}" for i in range(8)]
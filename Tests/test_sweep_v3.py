@@ -0,0 +1,51 @@
+# Pruebas del sweep de hiperparametros V3 (folds, configs y la config que lee el entrenador)
+import numpy as np
+import pytest
+
+import sweep_v3
+from apim import dojo
+
+
+def test_kfold_indices_partition_rows():
+    folds = sweep_v3.kfold_indices(23, 5, seed=3)
+
+    assert len(folds) == 5
+    tests = np.concatenate([test for _, test in folds])
+    assert sorted(tests.tolist()) == list(range(23))
+    for train, test in folds:
+        assert not set(train.tolist()) & set(test.tolist())
+        assert len(train) + len(test) == 23
+    # Misma semilla, mismos folds
+    assert all(np.array_equal(a[1], b[1]) for a, b in zip(folds, sweep_v3.kfold_indices(23, 5, seed=3)))
+
+
+def test_build_configs_full_grid_and_sample():
+    full = sweep_v3.build_configs(None, seed=0)
+    assert len(full) == int(np.prod([len(v) for v in sweep_v3.GRID.values()]))
+    sample = sweep_v3.build_configs(4, seed=0)
+    assert len(sample) == 4 and all(c in full for c in sample)
+    assert sample == sweep_v3.build_configs(4, seed=0)
+
+
+def test_best_config_is_what_the_trainer_loads(data_dir):
+    best = {"config": {"epochs": 40, "batch_size": 32, "lr": 0.003, "n_hidden": 8}, "acc_mean": 0.9, "acc_std": 0.01}
+    sweep_v3.write_best(best, k=5, n=100)
+
+    config = dojo.load_train_config()
+    assert {k: config[k] for k in best["config"]} == best["config"]
+    assert config["patience"] == dojo.DEFAULT_TRAIN_CONFIG["patience"]
+
+
+def test_eval_config_reports_fold_accuracies():
+    torch = pytest.importorskip("torch")
+    threads = torch.get_num_threads()
+    rng = np.random.default_rng(0)
+    X = rng.random((40, 4)).astype(np.float32)
+    y = (X[:, 0] > 0.5).astype(np.int64)
+    sweep_v3._init_worker(X, y, np.ones(40, dtype=np.float32))
+    try:
+        r = sweep_v3._eval_config({"epochs": 5, "batch_size": 8, "lr": 1e-2, "n_hidden": 8}, k=4, seed=1)
+    finally:
+        torch.set_num_threads(threads)
+    assert len(r["fold_accs"]) == 4
+    assert 0.0 <= r["acc_mean"] <= 1.0
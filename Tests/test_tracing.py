@@ -0,0 +1,49 @@
+# Pruebas de las trazas por corrida (spans y su registro en el historial)
+from apim import storage, tracing
+from apim.core import clasificar
+from apim.pipeline import PostSubmitPipeline
+from apim.sampling import ShadowSampler
+
+RESPUESTAS = {"ahorro_mensual_pct": 20, "compras_impulsivas_sem": 1, "registra_gastos": True, "fondo_emergencia_meses": 3}
+
+
+def test_span_without_active_trace_is_a_noop():
+    assert tracing.current() is None
+    with tracing.span("nada"):
+        pass
+
+
+def test_spans_are_recorded_in_the_active_trace():
+    trace = tracing.start_trace("r1")
+    with tracing.activate(trace):
+        with tracing.span("clasificar"):
+            pass
+        with tracing.span("guardar"):
+            pass
+        with tracing.span("guardar"):
+            pass
+    assert tracing.current() is None
+
+    record = trace.to_record()
+    assert (record["type"], record["run_id"]) == ("trace", "r1")
+    assert [name for name, _, _ in record["spans"]] == ["clasificar", "guardar", "guardar"]
+    assert all(start >= 0 and dur >= 0 for _, start, dur in record["spans"])
+    assert set(tracing.breakdown(record)) == {"clasificar", "guardar"}
+
+
+def test_pipeline_stores_trace_next_to_its_run(data_dir):
+    run_id = storage.new_run_id()
+    trace = tracing.start_trace(run_id)
+    with tracing.activate(trace), tracing.span("clasificar"):
+        result = clasificar(RESPUESTAS)
+
+    p = PostSubmitPipeline(sampler=ShadowSampler(rate=0.0))
+    try:
+        p.submit(run_id, RESPUESTAS, result, trace=trace, session_id="s1").result(timeout=10)
+    finally:
+        p.close()
+
+    saved = [e for e in storage.get_run(run_id, session_id="s1") if e["type"] == "trace"]
+    assert len(saved) == 1 and saved[0]["session_id"] == "s1"
+    names = [name for name, _, _ in saved[0]["spans"]]
+    assert names[:3] == ["clasificar", "queue_wait", "save_run"]
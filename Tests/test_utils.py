@@ -0,0 +1,29 @@
+# Pruebas del historial de utils sobre el motor de almacenamiento (project_root obsoleto)
+import pytest
+
+from apim import storage, utils
+
+
+def test_history_round_trip_without_project_root(data_dir):
+    utils.append_history(None, {"accion": "a"})
+    utils.append_history(None, {"accion": "b"})
+
+    records = utils.load_history()
+    assert [r["accion"] for r in records] == ["a", "b"]
+    assert utils.history_path() == data_dir / "history"
+
+
+def test_project_root_is_deprecated(data_dir):
+    with pytest.warns(DeprecationWarning):
+        utils.append_history(data_dir.parent, {"accion": "a"})
+    with pytest.warns(DeprecationWarning):
+        assert len(utils.load_history(data_dir.parent)) == 1
+
+
+def test_other_project_root_is_rejected(data_dir, tmp_path):
+    other = tmp_path / "otro"
+    with pytest.warns(DeprecationWarning), pytest.raises(ValueError):
+        utils.append_history(other, {"accion": "a"})
+    with pytest.warns(DeprecationWarning), pytest.raises(ValueError):
+        utils.load_history(other)
+    assert storage.list_segments(storage.namespace_dir("history")) == []
@@ -0,0 +1,75 @@
+# Pruebas del reporte semanal en lote (snapshot por semana ISO, fallos parciales, reanudar)
+import json
+import sys
+
+from apim import memory_json
+
+import weekly_batch
+
+WEEK = "2026-W42"
+
+
+def _memory_file(user_id, emotions):
+    memory = memory_json.load_memory(user_id)
+    for emotion in emotions:
+        memory_json.add_event(memory, {"description": "compra", "emotion": emotion})
+    memory_json.save_memory(memory, user_id)
+    return str(memory_json._memory_path(user_id))
+
+
+def test_report_user_appends_one_snapshot_per_week(data_dir):
+    path = _memory_file("ana", ["pánico", "enojo", "tranquilo"])
+
+    r = weekly_batch.report_user(path, WEEK, n_events=5)
+    assert r["status"] == "ok" and r["user_id"] == "ana"
+    assert r["snapshot"]["week"] == WEEK and r["snapshot"]["counts"]["red"] == 2
+    assert len(r["rows"]) == 3
+
+    again = weekly_batch.report_user(path, WEEK, n_events=5)
+    assert (again["status"], again["reason"]) == ("skipped", "ya_tiene_snapshot")
+    assert len(memory_json.load_memory("ana")["weekly_snapshots"]) == 1
+
+
+def test_report_user_dry_run_and_failures(data_dir, tmp_path):
+    path = _memory_file("beto", ["tranquilo"])
+    assert weekly_batch.report_user(path, WEEK, 5, dry_run=True)["status"] == "ok"
+    assert memory_json.load_memory("beto")["weekly_snapshots"] == []
+
+    empty = _memory_file("caro", [])
+    assert weekly_batch.report_user(empty, WEEK, 5)["reason"] == "no_events"
+
+    broken = tmp_path / "roto.json"
+    broken.write_text("{no", encoding="utf-8")
+    r = weekly_batch.report_user(str(broken), WEEK, 5)
+    assert r["status"] == "error" and r["reason"].startswith("JSONDecodeError")
+
+
+def test_main_resumes_and_retries_errors(data_dir, tmp_path, monkeypatch, capsys):
+    paths = [_memory_file(u, ["tranquilo", "estrés"]) for u in ("u1", "u2")]
+    broken = tmp_path / "roto.json"
+    broken.write_text("{no", encoding="utf-8")
+    output = tmp_path / "weekly.jsonl"
+
+    def run():
+        argv = ["weekly_batch.py", *paths, str(broken), "--week", WEEK, "--workers", "0", "--output", str(output)]
+        monkeypatch.setattr(sys, "argv", argv)
+        weekly_batch.main()
+        return [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+
+    first = run()
+    assert [r["status"] for r in first] == ["ok", "ok", "error"]
+    assert weekly_batch._done_paths(output) == set(paths)
+
+    # Segunda vuelta: solo se reintenta el que fallo
+    second = run()
+    assert len(second) == 4 and second[-1]["path"] == str(broken)
+    assert "ya hechas=2 | por hacer=1" in capsys.readouterr().out
+
+
+def test_main_writes_default_output_under_data_dir(data_dir, monkeypatch):
+    path = _memory_file("u1", ["tranquilo"])
+    monkeypatch.setattr(sys, "argv", ["weekly_batch.py", path, "--week", WEEK, "--workers", "0"])
+    weekly_batch.main()
+
+    output = data_dir / "reports" / f"weekly-{WEEK}.jsonl"
+    assert [json.loads(line)["status"] for line in output.read_text(encoding="utf-8").splitlines()] == ["ok"]